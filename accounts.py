@@ -0,0 +1,105 @@
+import contextvars
+import json
+import os
+from contextlib import contextmanager
+
+import db
+
+# Per-account file names inside an account directory
+TOKEN_FILE = "token.json"
+CREDENTIALS_FILE = "credentials.json"
+
+
+class Account:
+    """
+    One watched mailbox: where its OAuth token, client credentials and local state live.
+
+    Credentials, clients, checkpoints, caches, the calendar mirror and the Gmail/Calendar
+    rate limits are all kept per account, looked up through current_account().
+    """
+
+    def __init__(self, name, token_file=TOKEN_FILE, creds_file=CREDENTIALS_FILE, db_path=db.DB_PATH):
+        self.name = name
+        self.token_file = token_file
+        self.creds_file = creds_file
+        self.db_path = db_path
+
+    def __repr__(self):
+        return f"Account({self.name!r})"
+
+
+DEFAULT_ACCOUNT = Account('default')
+
+_current_account = contextvars.ContextVar('current_account', default=None)
+# Used where no account is set in the context, e.g. threads started by a worker process
+_default_account = DEFAULT_ACCOUNT
+
+
+def current_account():
+    """Return the account the calling code works for."""
+    return _current_account.get() or _default_account
+
+
+@contextmanager
+def use_account(account):
+    """Work for account within the block (in this thread, or this asyncio task)."""
+    token = _current_account.set(account)
+    try:
+        yield account
+    finally:
+        _current_account.reset(token)
+
+
+def set_default_account(account):
+    """Make account the one used wherever no account is set, for processes serving one account at a time."""
+    global _default_account
+    _default_account = account
+
+
+def load_accounts(path):
+    """
+    Load the accounts to watch from a directory or a JSON config file.
+
+    A directory holds one subdirectory per account, named after it, with the account's
+    token.json; credentials.json is taken from the subdirectory or else from the directory
+    itself, and the account's database is created in the subdirectory.
+
+    A config file looks like {"accounts": [{"name": ..., "token_file": ..., "credentials_file": ...,
+    "db_path": ...}]}, with paths relative to the file.
+
+    Returns:
+        list: Account objects, sorted by name.
+    """
+    accounts = []
+    if os.path.isdir(path):
+        shared_creds_file = os.path.join(path, CREDENTIALS_FILE)
+        for name in sorted(os.listdir(path)):
+            directory = os.path.join(path, name)
+            if not os.path.isfile(os.path.join(directory, TOKEN_FILE)):
+                continue
+            creds_file = os.path.join(directory, CREDENTIALS_FILE)
+            accounts.append(Account(
+                name,
+                token_file=os.path.join(directory, TOKEN_FILE),
+                creds_file=creds_file if os.path.exists(creds_file) else shared_creds_file,
+                db_path=os.path.join(directory, db.DB_PATH),
+            ))
+    else:
+        base = os.path.dirname(os.path.abspath(path))
+        with open(path) as f:
+            config = json.load(f)
+        for entry in config.get('accounts', []):
+            name = entry['name']
+            accounts.append(Account(
+                name,
+                token_file=os.path.join(base, entry.get('token_file', os.path.join(name, TOKEN_FILE))),
+                creds_file=os.path.join(base, entry.get('credentials_file', CREDENTIALS_FILE)),
+                db_path=os.path.join(base, entry.get('db_path', os.path.join(name, db.DB_PATH))),
+            ))
+        accounts.sort(key=lambda account: account.name)
+
+    names = [account.name for account in accounts]
+    duplicates = {name for name in names if names.count(name) > 1}
+    if duplicates:
+        raise ValueError(f"Duplicate account names in {path}: {', '.join(sorted(duplicates))}")
+    return accounts
@@ -1,22 +1,69 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain.agents import  AgentExecutor, create_tool_calling_agent
-from langchain.prompts import ChatPromptTemplate,MessagesPlaceholder
+import threading
 
-from cal.create_event import create_event
-from cal.read_calendar import read_calendar
+# LangChain's agent stack and the Gemini client take seconds to import and build, so they are
+# only set up when the first email needs them. llm, tools, prompt, agent and mailer_agent are
+# still available as module attributes, see __getattr__.
+_lock = threading.RLock()
+_llm = None
+_mailer_agent = None
 
-tools=[create_event, read_calendar]
 
-llm=ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.2, max_output_tokens=1000)
+def get_tools():
+    from cal.create_event import create_event
+    from cal.free_busy import check_free_busy
+    from cal.read_calendar import read_calendar
 
-prompt = ChatPromptTemplate.from_messages([
-    ("system", "You are a helpful assistant that reads the mail and adds the event to the cal  "
-               "you will be having read and write access to the cal through tools and also the structure of inputs to each tool is defined properly in the docstring. "
-               "you can use tools whenever you need "),
-    ("human", "{input}"),
-    MessagesPlaceholder("agent_scratchpad"),
-])
+    return [create_event, read_calendar, check_free_busy]
 
-agent=create_tool_calling_agent(llm, tools=tools,prompt=prompt)
 
-mailer_agent=AgentExecutor(agent=agent, tools=tools, verbose=True)
+def get_llm():
+    """Return the shared Gemini chat model, building it on first use."""
+    global _llm
+    with _lock:
+        if _llm is None:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+            from agent.callbacks import RateLimitCallback
+
+            _llm=ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.2, max_output_tokens=1000,
+                                        callbacks=[RateLimitCallback()])
+        return _llm
+
+
+def get_prompt():
+    from langchain.prompts import ChatPromptTemplate,MessagesPlaceholder
+
+    return ChatPromptTemplate.from_messages([
+        ("system", "You are a helpful assistant that reads the mail and adds the event to the cal  "
+                   "you will be having read and write access to the cal through tools and also the structure of inputs to each tool is defined properly in the docstring. "
+                   "you can use tools whenever you need "),
+        ("human", "{input}"),
+        MessagesPlaceholder("agent_scratchpad"),
+    ])
+
+
+def get_mailer_agent():
+    """Return the shared tool-calling AgentExecutor, building it on first use."""
+    global _mailer_agent
+    with _lock:
+        if _mailer_agent is None:
+            from langchain.agents import  AgentExecutor, create_tool_calling_agent
+            from agent.budget import compact_tools
+
+            # The tool schemas are sent with every agent step, so they get short descriptions
+            tools=compact_tools(get_tools())
+            agent=create_tool_calling_agent(get_llm(), tools=tools,prompt=get_prompt())
+
+            _mailer_agent=AgentExecutor(agent=agent, tools=tools, verbose=True)
+        return _mailer_agent
+
+
+def __getattr__(name):
+    if name == 'llm':
+        return get_llm()
+    if name == 'mailer_agent':
+        return get_mailer_agent()
+    if name == 'tools':
+        return get_tools()
+    if name == 'prompt':
+        return get_prompt()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
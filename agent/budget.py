@@ -0,0 +1,177 @@
+import re
+
+from util import mentions_date_or_time
+
+# Upper bound on the estimated tokens of an email body handed to the LLM
+EMAIL_TOKEN_BUDGET = 1500
+# Lines after a sign-off that can still be a signature
+MAX_SIGNATURE_LINES = 4
+# Signature lines are short
+MAX_SIGNATURE_LINE_CHARS = 60
+# Lines longer than this are split into sentences when truncating
+MAX_UNIT_CHARS = 300
+
+_ATTRIBUTION_RE = re.compile(
+    r'^(?:On [^\n]{0,300}(?:\n[^\n]{0,120})?wrote:|-{2,}\s*Original Message\s*-{2,})\s*$',
+    re.MULTILINE | re.IGNORECASE)
+_QUOTED_LINE_RE = re.compile(r'^\s*>')
+_QUOTE_PREFIX_RE = re.compile(r'(?m)^(\s*>)+ ?')
+_SIGNATURE_DELIMITER_RE = re.compile(
+    r'^(?:-- ?|_{3,}|Sent from my \w+.*|Get Outlook for \w+.*)$', re.IGNORECASE)
+_SIGN_OFF_RE = re.compile(
+    r'^\s*(?:best regards|kind regards|warm regards|regards|best|thanks|thank you|many thanks|cheers|sincerely)'
+    r'[,.!]?\s*$', re.IGNORECASE)
+_CONTACT_RE = re.compile(r'^[^:]{1,20}:\s*(?:\+?[\d\s().-]{6,}|\S+@\S+|(?:https?://|www\.)\S+)$')
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+
+# Descriptions the agent sees instead of the tools' long docstrings
+COMPACT_TOOL_DESCRIPTIONS = {
+    'create_event': (
+        "Create an event in the primary calendar. event_data keys: summary; start and end as "
+        "'YYYY-MM-DD' (all-day), 'YYYY-MM-DDTHH:MM:SS' (IST) or {'dateTime', 'timeZone'}; optional "
+        "description, location, attendees [{'email'}], recurrence ['RRULE:...']. "
+        "Returns status and event_link, or error."
+    ),
+    'read_calendar': (
+        "List the events of all calendars around a day. date_str: 'YYYY-MM-DD/before=X/after=Y' "
+        "(days before/after, default 2). Returns events with summary, date, start, end and calendar."
+    ),
+    'check_free_busy': (
+        "Check which days have busy time across all calendars, cheaper than read_calendar. date_str as "
+        "for read_calendar. Events marked free, like most all-day events, don't count. "
+        "Returns busy, busy_days and intervals."
+    ),
+}
+
+
+def estimate_tokens(text):
+    """Cheap token estimate, about four characters per token for Gemini on English text."""
+    return len(text) // 4 + 1
+
+
+def split_quoted(text):
+    """
+    Split an email body into (new, quoted): the text the sender wrote, and the reply trail
+    (from an "On ... wrote:" or "Original Message" line on, plus '>'-quoted lines).
+    A body that is quoted as a whole, like some forwards, is all new text.
+    """
+    match = _ATTRIBUTION_RE.search(text)
+    head, tail = (text[:match.start()], text[match.start():]) if match else (text, '')
+
+    new_lines = []
+    quoted_lines = []
+    for line in head.splitlines():
+        (quoted_lines if _QUOTED_LINE_RE.match(line) else new_lines).append(line)
+
+    new = '\n'.join(new_lines).strip()
+    if not new:
+        return _QUOTE_PREFIX_RE.sub('', text).strip(), ''
+    return new, '\n'.join(quoted_lines + [tail]).strip()
+
+
+def _is_signature_line(line):
+    """True for the short lines below a sign-off: a name, a title, a phone number or an address."""
+    line = line.strip()
+    if not line:
+        return True
+    if len(line) > MAX_SIGNATURE_LINE_CHARS or mentions_date_or_time(line):
+        return False
+    # "Room: 4B" or a full sentence is content, "Phone: +91 98..." is contact details
+    if ':' in line and not _CONTACT_RE.match(line):
+        return False
+    return not (line[-1] in '.!?' and len(line.split()) >= 3)
+
+
+def strip_signature(text):
+    """
+    Remove a trailing signature: after a '-- ' delimiter or a 'Sent from' line, or a closing sign-off
+    followed only by a few signature lines. Either one must sit in the second half of the text.
+    """
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if _SIGNATURE_DELIMITER_RE.match(line.strip()) and i >= len(lines) // 2:
+            return '\n'.join(lines[:i]).rstrip()
+
+    # Sign-offs are only looked for in the last lines, from the bottom up
+    for i in range(len(lines) - 1, max(len(lines) - MAX_SIGNATURE_LINES - 2, 0), -1):
+        if i < len(lines) // 2:
+            break
+        if _SIGN_OFF_RE.match(lines[i]):
+            return '\n'.join(lines[:i]).rstrip()
+        if not _is_signature_line(lines[i]):
+            break
+    return text
+
+
+def _units(text):
+    """Split text into lines, and overlong lines into sentences."""
+    units = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if len(line) > MAX_UNIT_CHARS:
+            units.extend(sentence for sentence in _SENTENCE_END_RE.split(line) if sentence)
+        else:
+            units.append(line)
+    return units
+
+
+def truncate(text, budget):
+    """
+    Cut text down to about budget tokens. Date- and time-bearing lines and sentences are
+    kept first, then the rest in reading order; what is kept stays in its original order.
+    """
+    units = _units(text)
+    order = sorted(range(len(units)), key=lambda i: (not mentions_date_or_time(units[i]), i))
+
+    kept = set()
+    used = 0
+    for i in order:
+        tokens = estimate_tokens(units[i])
+        if used + tokens > budget:
+            continue
+        kept.add(i)
+        used += tokens
+
+    parts = []
+    for i, unit in enumerate(units):
+        if i in kept:
+            parts.append(unit)
+        elif not parts or parts[-1] != '[...]':
+            parts.append('[...]')
+    return '\n'.join(parts)
+
+
+def compact_body(body, budget=EMAIL_TOKEN_BUDGET):
+    """
+    Shrink an email body for the prompt: drop the quoted reply trail (keeping its date- and
+    time-bearing lines) and the signature, then truncate to budget tokens if still needed.
+    """
+    new, quoted = split_quoted(body)
+    text = strip_signature(new)
+    quoted_dates = [unit for unit in _units(_QUOTE_PREFIX_RE.sub('', quoted)) if mentions_date_or_time(unit)]
+    if quoted_dates:
+        text += '\n\n[Earlier in the thread]\n' + '\n'.join(quoted_dates)
+    if estimate_tokens(text) > budget:
+        text = truncate(text, budget)
+    return text
+
+
+def compact_email(email, budget=EMAIL_TOKEN_BUDGET):
+    """
+    Return (email, tokens_before, tokens_after): a copy of email with its body compacted
+    by compact_body, and the estimated tokens of the body before and after.
+    """
+    body = email.get('body', '')
+    compacted = compact_body(body, budget)
+    return dict(email, body=compacted), estimate_tokens(body), estimate_tokens(compacted)
+
+
+def compact_tools(tools):
+    """Return tools with the long descriptions replaced by COMPACT_TOOL_DESCRIPTIONS."""
+    return [
+        tool.model_copy(update={'description': COMPACT_TOOL_DESCRIPTIONS[tool.name]})
+        if tool.name in COMPACT_TOOL_DESCRIPTIONS else tool
+        for tool in tools
+    ]
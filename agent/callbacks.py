@@ -0,0 +1,79 @@
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from agent.budget import estimate_tokens
+from metrics import inc, observe
+from ratelimit import acquire
+
+# LangChain callbacks, kept out of metrics and ratelimit so that importing those, as the watchers
+# do at startup, doesn't load LangChain; this module is only imported once an LLM is needed.
+
+
+class RateLimitCallback(BaseCallbackHandler):
+    """LangChain callback that holds every LLM call to the rate limit of api."""
+
+    def __init__(self, api='gemini'):
+        self.api = api
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        acquire(self.api)
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        acquire(self.api)
+
+
+class MetricsCallback(BaseCallbackHandler):
+    """LangChain callback recording LLM calls with their token usage, and tool calls."""
+
+    def __init__(self):
+        self._started = {}
+
+    def _start(self, run_id):
+        self._started[run_id] = time.monotonic()
+
+    def _elapsed(self, run_id):
+        started = self._started.pop(run_id, None)
+        return time.monotonic() - started if started is not None else None
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+        text = ''.join(str(message.content) for batch in messages for message in batch)
+        observe('llm_prompt_tokens_estimated', estimate_tokens(text))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        elapsed = self._elapsed(run_id)
+        if elapsed is not None:
+            observe('llm_call_seconds', elapsed)
+        inc('llm_calls_total', status='ok')
+
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, 'message', None), 'usage_metadata', None) or {}
+                inc('llm_tokens_total', usage.get('input_tokens', 0), kind='input')
+                inc('llm_tokens_total', usage.get('output_tokens', 0), kind='output')
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._elapsed(run_id)
+        inc('llm_calls_total', status='error')
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._started[run_id] = (time.monotonic(), (serialized or {}).get('name', 'unknown'))
+
+    def _end_tool(self, run_id, status):
+        started, tool = self._started.pop(run_id, (None, 'unknown'))
+        if started is not None:
+            observe('tool_call_seconds', time.monotonic() - started, tool=tool)
+        inc('tool_calls_total', tool=tool, status=status)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end_tool(run_id, 'ok')
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end_tool(run_id, 'error')
+
+
+metrics_callback = MetricsCallback()
@@ -0,0 +1,193 @@
+import datetime
+from typing import List, Optional
+
+from langchain.prompts import ChatPromptTemplate
+from pydantic import BaseModel, Field
+
+from agent.agent import llm
+from agent.budget import estimate_tokens
+from agent.callbacks import metrics_callback
+from cal.create_event import insert_event
+from cal.free_busy import is_day_busy
+from ratelimit import call
+from util import IST, email_date
+
+# Extractions below this confidence are treated as "no event"
+MIN_CONFIDENCE = 0.6
+# Rough upper bound on the prompt tokens of one batched extraction request
+BATCH_TOKEN_BUDGET = 8000
+
+
+class EventExtraction(BaseModel):
+    """The event described by an email, if any."""
+
+    has_event: bool = Field(description="True if the email announces an event that belongs in a calendar")
+    title: Optional[str] = Field(default=None, description="Short event title")
+    start: Optional[str] = Field(default=None, description="YYYY-MM-DD for all-day events, else YYYY-MM-DDTHH:MM:SS (IST)")
+    end: Optional[str] = Field(default=None, description="Same format as start, empty if not stated")
+    location: Optional[str] = Field(default=None, description="Venue or meeting link")
+    all_day: bool = Field(default=False, description="True if the email gives no time of day")
+    confidence: float = Field(default=0.0, description="0 to 1, how sure you are the fields are right")
+
+
+class EmailEventExtraction(EventExtraction):
+    """The event described by one email of a batch."""
+
+    message_id: str = Field(description="The message ID the email was given under")
+
+
+class BatchEventExtraction(BaseModel):
+    """One extraction per email of the batch."""
+
+    results: List[EmailEventExtraction]
+
+
+extraction_prompt = ChatPromptTemplate.from_messages([
+    ("system", "You extract calendar events from emails. The email was received on {today} (Asia/Kolkata). "
+               "Resolve relative dates against that day and give times in IST. "
+               "If the email does not announce an event, set has_event to false."),
+    ("human", "{email}"),
+])
+
+extraction_chain = extraction_prompt | llm.with_structured_output(EventExtraction)
+
+batch_extraction_prompt = ChatPromptTemplate.from_messages([
+    ("system", "You extract calendar events from emails. "
+               "Each email starts with a '=== message_id: <id> ===' line and has a 'Received:' line; resolve "
+               "its relative dates against the day it was received (Asia/Kolkata) and give times in IST. "
+               "Return exactly one result per email with its message_id; if an email does not announce "
+               "an event, set has_event to false."),
+    ("human", "{emails}"),
+])
+
+batch_extraction_chain = batch_extraction_prompt | llm.with_structured_output(BatchEventExtraction)
+
+
+def _format_email(email, received=False):
+    header = f"From: {email.get('sender', '')}\nSubject: {email.get('subject', '')}\n"
+    if received:
+        header += f"Received: {email_date(email).isoformat()}\n"
+    return f"{header}\n{email.get('body', '')}"
+
+
+def extract_event(email):
+    """Extract the event of one email with a single LLM call."""
+    # The llm's RateLimitCallback already takes the token, call() only adds the retries
+    return call('gemini', extraction_chain.invoke, {
+        "today": email_date(email).isoformat(),
+        "email": _format_email(email),
+    }, config={"callbacks": [metrics_callback]}, tokens=0)
+
+
+def pack_batches(emails, token_budget=BATCH_TOKEN_BUDGET):
+    """Split emails into consecutive batches whose estimated prompt size stays within token_budget."""
+    batches = []
+    batch = []
+    batch_tokens = 0
+    for email in emails:
+        tokens = estimate_tokens(_format_email(email))
+        if batch and batch_tokens + tokens > token_budget:
+            batches.append(batch)
+            batch = []
+            batch_tokens = 0
+        batch.append(email)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def extract_events_batch(emails, token_budget=BATCH_TOKEN_BUDGET):
+    """
+    Extract the events of several emails with one LLM call per token_budget worth of emails.
+
+    Returns:
+        dict: EventExtraction per message ID. Emails whose batch failed, or that the model
+              left out, are missing and should be extracted one by one.
+    """
+    extractions = {}
+
+    for batch in pack_batches(emails, token_budget):
+        message_ids = {email['id'] for email in batch}
+        try:
+            result = call('gemini', batch_extraction_chain.invoke, {
+                "emails": "\n\n".join(f"=== message_id: {email['id']} ===\n{_format_email(email, received=True)}"
+                                      for email in batch),
+            }, config={"callbacks": [metrics_callback]}, tokens=0)
+        except Exception as e:
+            print(f"Batch extraction of {len(batch)} emails failed, falling back to one by one: {e}")
+            continue
+
+        for item in result.results:
+            if item.message_id in message_ids:
+                extractions[item.message_id] = EventExtraction(**item.model_dump(exclude={'message_id'}))
+        print(f"Batch extraction: {len(batch)} emails in one request, "
+              f"{len(message_ids & set(extractions))} results")
+
+    return extractions
+
+
+def _local_datetime(value):
+    """Parse a YYYY-MM-DDTHH:MM:SS string as IST, converting one with an offset, and drop the offset."""
+    dt = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(IST).replace(tzinfo=None)
+    return dt
+
+
+def to_event_data(extraction, email=None):
+    """
+    Turn an extraction into create_event's event_data, filling in a missing end. A date-only
+    start makes an all-day event; timed starts and ends are both written in IST without offset.
+    """
+    start = extraction.start
+    if extraction.all_day or 'T' not in start:
+        start = start[:10]
+        end = (extraction.end or '')[:10]
+        if not end or end <= start:
+            end = (datetime.date.fromisoformat(start) + datetime.timedelta(days=1)).isoformat()
+        else:
+            # Calendar all-day ends are exclusive
+            end = (datetime.date.fromisoformat(end) + datetime.timedelta(days=1)).isoformat()
+    else:
+        start_dt = _local_datetime(start)
+        end_dt = _local_datetime(extraction.end) if extraction.end and 'T' in extraction.end else None
+        if end_dt is None or end_dt <= start_dt:
+            end_dt = start_dt + datetime.timedelta(hours=1)
+        start, end = start_dt.strftime('%Y-%m-%dT%H:%M:%S'), end_dt.strftime('%Y-%m-%dT%H:%M:%S')
+
+    event_data = {'summary': extraction.title or 'Event', 'start': start, 'end': end}
+    if extraction.location:
+        event_data['location'] = extraction.location
+    if email is not None:
+        event_data['description'] = f"Created from email from {email.get('sender', '')}: {email.get('subject', '')}"
+    return event_data
+
+
+def process_with_extraction(email, extraction=None):
+    """
+    Single-shot alternative to the agent: one LLM call for the fields, then plain code
+    for the occupancy check and the insert. Returns the outcome.
+
+    An extraction made beforehand (e.g. by extract_events_batch) saves the LLM call.
+    """
+    if extraction is None:
+        extraction = extract_event(email)
+    print(f"Extraction for email {email.get('id')}: {extraction}")
+
+    if not extraction.has_event or not extraction.start or extraction.confidence < MIN_CONFIDENCE:
+        return f"no event (confidence {extraction.confidence:.2f})"
+
+    try:
+        event_data = to_event_data(extraction, email)
+    except ValueError as e:
+        return f"error: unusable start/end {extraction.start!r}/{extraction.end!r}: {e}"
+
+    day = event_data['start'][:10]
+    if is_day_busy(day):
+        return f"skipped: {day} already has events"
+
+    result = insert_event(event_data, source_id=email.get('id'))
+    if result.get('status') != 'success':
+        return f"error: {result.get('error')} {result.get('details')}"
+    return f"created: {result['event_link']}"
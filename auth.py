@@ -1,14 +1,23 @@
+import datetime
+import json
 import os
+import threading
+
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document, fix_method_name
+
+from accounts import DEFAULT_ACCOUNT, current_account
 
 SCOPES = ["https://www.googleapis.com/auth/calendar.readonly", "https://www.googleapis.com/auth/calendar", "https://www.googleapis.com/auth/gmail.readonly", 'https://www.googleapis.com/auth/gmail.modify']
 
-def check_auth():
+# Refresh access tokens this long before they actually expire
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+def check_auth(token_file="token.json", creds_file="credentials.json"):
     creds = None
-    token_file = "token.json"
-    creds_file = "credentials.json"
 
     if not os.path.exists(creds_file):
         raise FileNotFoundError(f"Credentials file not found at {creds_file}")
@@ -44,4 +53,111 @@ def check_auth():
         with open(token_file, "w") as token:
             token.write(creds.to_json())
 
-    return creds
\ No newline at end of file
+    return creds
+
+
+class CredentialManager:
+    """Process-wide holder of the OAuth credentials, refreshed once and ahead of expiry."""
+
+    def __init__(self, token_file="token.json", creds_file="credentials.json"):
+        self.token_file = token_file
+        self.creds_file = creds_file
+        self._creds = None
+        self._lock = threading.Lock()
+
+    def _needs_refresh(self):
+        if not self._creds.valid:
+            return True
+        if self._creds.expiry is None:
+            return False
+        # google-auth stores expiry as a naive UTC datetime
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        return self._creds.expiry - now < REFRESH_MARGIN
+
+    def get(self):
+        """Return valid credentials, loading or refreshing them only when needed."""
+        with self._lock:
+            if self._creds is None:
+                self._creds = check_auth(self.token_file, self.creds_file)
+            elif self._needs_refresh() and self._creds.refresh_token:
+                self._creds.refresh(Request())
+                with open(self.token_file, "w") as token:
+                    token.write(self._creds.to_json())
+            return self._creds
+
+
+credential_manager = CredentialManager()
+
+# One CredentialManager per account, keyed by account name
+_credential_managers = {DEFAULT_ACCOUNT.name: credential_manager}
+_credential_managers_lock = threading.Lock()
+
+# googleapiclient service objects share an httplib2.Http, which is not thread-safe,
+# so the pool keeps one client per (thread, account, api, version)
+_service_pool = threading.local()
+
+
+def get_credential_manager():
+    """Return the CredentialManager of the current account."""
+    account = current_account()
+    with _credential_managers_lock:
+        manager = _credential_managers.get(account.name)
+        if manager is None:
+            manager = _credential_managers[account.name] = CredentialManager(account.token_file, account.creds_file)
+        return manager
+
+
+def get_credentials():
+    return get_credential_manager().get()
+
+
+# Parsed discovery documents, shared by every client of the same API
+_discovery_documents = {}
+_discovery_lock = threading.Lock()
+
+
+def _build(api, version, creds):
+    """
+    Build a client from the discovery document bundled with googleapiclient, read and parsed
+    once per process, falling back to build() if no copy is bundled for this API.
+    """
+    with _discovery_lock:
+        document = _discovery_documents.get((api, version))
+        if document is None:
+            content = discovery_cache.get_static_doc(api, version)
+            if content is None:
+                return build(api, version, credentials=creds, cache_discovery=False)
+            document = json.loads(content)
+            _complete_document(document, creds)
+            _discovery_documents[(api, version)] = document
+    # The document is complete, clients can share it without a lock
+    return build_from_document(document, credentials=creds)
+
+
+def _complete_document(document, creds):
+    """
+    Build every resource of document once. Clients add the method parameters they derive to their
+    discovery document, lazily as their resources are first used; after this every later client
+    only writes values that are already there, so concurrent clients can share the document.
+    """
+    def walk(resource, description):
+        for name, nested in description.get('resources', {}).items():
+            walk(getattr(resource, fix_method_name(name))(), nested)
+
+    walk(build_from_document(document, credentials=creds), document)
+
+
+def get_service(api, version):
+    """Return a cached Google API client of the current account for the calling thread."""
+    creds = get_credentials()
+    services = getattr(_service_pool, 'services', None)
+    if services is None:
+        services = _service_pool.services = {}
+
+    key = (current_account().name, api, version)
+    cached = services.get(key)
+    # Credentials are refreshed in place, so a client only goes stale when they are replaced
+    if cached is None or cached[0] is not creds:
+        cached = (creds, _build(api, version, creds))
+        services[key] = cached
+    return cached[1]
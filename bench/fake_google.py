@@ -0,0 +1,372 @@
+"""
+In-process stand-ins for the parts of the Gmail and Calendar APIs the watcher uses.
+
+They mimic googleapiclient's shape (service.users().messages().get(...).execute(),
+new_batch_http_request, HttpError) closely enough for the real code to run unchanged,
+with configurable latency and error injection, and count every call they serve.
+"""
+import datetime
+import json
+import random
+import threading
+import time
+from collections import Counter
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+PAGE_SIZE = 100
+PRIMARY_CALENDAR = 'me@example.com'
+
+_ERROR_REASONS = {403: 'rateLimitExceeded', 404: 'notFound', 409: 'duplicate', 410: 'fullSyncRequired',
+                  429: 'rateLimitExceeded', 500: 'backendError', 503: 'backendError'}
+
+
+def http_error(status, message=''):
+    """Build an HttpError the way googleapiclient raises it, JSON error body included."""
+    reason = _ERROR_REASONS.get(status, 'error')
+    resp = httplib2.Response({'status': status})
+    content = json.dumps({'error': {'code': status, 'message': message or reason,
+                                    'errors': [{'reason': reason, 'message': message or reason}]}})
+    return HttpError(resp, content.encode('utf-8'))
+
+
+class Injector:
+    """
+    Latency and error injection for one API.
+
+    Args:
+        latency: Mean latency of a round trip (in seconds).
+        jitter: Latency is drawn uniformly from latency * (1 +- jitter).
+        error_rate: Share of requests that fail with one of error_statuses.
+        error_statuses: HTTP statuses injected errors use, 429 and 503 by default.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.5, error_rate=0.0, error_statuses=(429, 503), seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def check(self):
+        """Raise an injected error if this request is unlucky."""
+        with self._lock:
+            fails = self.error_rate and self._random.random() < self.error_rate
+            status = self._random.choice(self.error_statuses) if fails else None
+        if status is not None:
+            raise http_error(status, 'injected error')
+
+    def round_trip(self):
+        """Sleep for one round trip, then check() the request."""
+        with self._lock:
+            delay = self.latency * (1 + self._random.uniform(-self.jitter, self.jitter))
+        if delay > 0:
+            time.sleep(delay)
+        self.check()
+
+
+class FakeRequest:
+    """A request object with googleapiclient's execute()."""
+
+    def __init__(self, backend, method, handler, **kwargs):
+        self.backend = backend
+        self.method = method
+        self._handler = handler
+        self._kwargs = kwargs
+
+    def run(self):
+        """Serve the request without a round trip (as part of a batch)."""
+        self.backend.count(self.method)
+        return self._handler(**self._kwargs)
+
+    def execute(self, num_retries=0):
+        self.backend.count('http')
+        self.backend.injector.round_trip()
+        return self.run()
+
+
+class FakeBatch:
+    """new_batch_http_request() stand-in: one round trip, a callback per request."""
+
+    def __init__(self, backend, callback=None):
+        self.backend = backend
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request_id or str(len(self._requests)), request, callback or self._callback))
+
+    def execute(self, num_retries=0):
+        self.backend.count('http')
+        self.backend.count('batch')
+        self.backend.injector.round_trip()
+        for request_id, request, callback in self._requests:
+            try:
+                # Sub-requests fail on their own, like they do in a real batch response
+                self.backend.injector.check()
+                response, exception = request.run(), None
+            except HttpError as e:
+                response, exception = None, e
+            if callback is not None:
+                callback(request_id, response, exception)
+
+
+class _Resource:
+    """Maps attribute calls like service.users().messages() onto the backend."""
+
+    def __init__(self, **methods):
+        self._methods = methods
+
+    def __getattr__(self, name):
+        try:
+            return self._methods[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+class _Backend:
+    def __init__(self, name, injector=None):
+        self.name = name
+        self.injector = injector or Injector()
+        self.calls = Counter()
+        self._lock = threading.RLock()
+
+    def count(self, method):
+        with self._lock:
+            self.calls[method] += 1
+
+    def request(self, method, handler, **kwargs):
+        return FakeRequest(self, method, handler, **kwargs)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+
+def _page(items, page_token, page_size=PAGE_SIZE):
+    start = int(page_token or 0)
+    result = {}
+    if start + page_size < len(items):
+        result['nextPageToken'] = str(start + page_size)
+    return items[start:start + page_size], result
+
+
+class FakeGmail(_Backend):
+    """Gmail history, messages and attachments over an in-memory inbox."""
+
+    def __init__(self, injector=None, history_retention=None):
+        super().__init__('gmail', injector)
+        self._messages = {}
+        self._order = []
+        self._history = []
+        self._history_id = 1000
+        self.history_retention = history_retention
+
+    def deliver(self, message):
+        """
+        Add a message (a dict with id, payload and optionally labelIds) to the inbox as if it had
+        just arrived, setting its historyId and internalDate. Returns the stored message.
+        """
+        with self._lock:
+            self._history_id += 1
+            stored = dict(message, historyId=str(self._history_id),
+                          internalDate=str(int(time.time() * 1000)))
+            stored.setdefault('labelIds', ['INBOX', 'UNREAD'])
+            stored.setdefault('threadId', stored['id'])
+            self._messages[stored['id']] = stored
+            self._order.append(stored['id'])
+            self._history.append((self._history_id, stored['id']))
+            return stored
+
+    def users(self):
+        return _Resource(
+            messages=lambda: _Resource(
+                list=lambda **kwargs: self.request('messages.list', self._list_messages, **kwargs),
+                get=lambda **kwargs: self.request('messages.get', self._get_message, **kwargs),
+                attachments=lambda: _Resource(
+                    get=lambda **kwargs: self.request('attachments.get', self._get_attachment, **kwargs)
+                ),
+            ),
+            history=lambda: _Resource(
+                list=lambda **kwargs: self.request('history.list', self._list_history, **kwargs)
+            ),
+        )
+
+    def _list_messages(self, userId='me', labelIds=None, q=None, maxResults=PAGE_SIZE, pageToken=None, **kwargs):
+        with self._lock:
+            ids = list(reversed(self._order))
+            if q and q.startswith('after:'):
+                after_ms = int(q[len('after:'):]) * 1000
+                ids = [msg_id for msg_id in ids if int(self._messages[msg_id]['internalDate']) > after_ms]
+            items, result = _page(ids, pageToken, maxResults)
+            result['messages'] = [{'id': msg_id, 'threadId': self._messages[msg_id]['threadId']} for msg_id in items]
+            return result
+
+    def _get_message(self, userId='me', id=None, format='full', **kwargs):
+        with self._lock:
+            message = self._messages.get(id)
+        if message is None:
+            raise http_error(404, f'message {id} not found')
+        if format != 'full':
+            return {key: value for key, value in message.items() if key != 'payload'}
+        return message
+
+    def _get_attachment(self, userId='me', messageId=None, id=None, **kwargs):
+        with self._lock:
+            message = self._messages.get(messageId)
+        attachment = (message or {}).get('attachments', {}).get(id)
+        if attachment is None:
+            raise http_error(404, f'attachment {id} not found')
+        return {'data': attachment, 'size': len(attachment)}
+
+    def _list_history(self, userId='me', startHistoryId=None, pageToken=None, **kwargs):
+        start = int(startHistoryId)
+        with self._lock:
+            if self.history_retention is not None and self._history and \
+                    start < self._history[-1][0] - self.history_retention:
+                raise http_error(404, 'startHistoryId is too old')
+            records = [(history_id, msg_id) for history_id, msg_id in self._history if history_id > start]
+            current = self._history_id
+        items, result = _page(records, pageToken)
+        result['history'] = [{'id': str(history_id), 'messagesAdded': [{'message': {'id': msg_id}}]}
+                             for history_id, msg_id in items]
+        result['historyId'] = str(current)
+        return result
+
+
+def _parse_time(value):
+    """Parse an RFC 3339 time or a YYYY-MM-DD date into an aware datetime."""
+    if 'T' not in value:
+        return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc)
+    parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=datetime.timezone(datetime.timedelta(hours=5, minutes=30)))
+
+
+def _event_bounds(event):
+    start, end = event['start'], event['end']
+    return _parse_time(start.get('dateTime') or start['date']), _parse_time(end.get('dateTime') or end['date'])
+
+
+class FakeCalendar(_Backend):
+    """Calendar events, calendarList and freeBusy over in-memory calendars."""
+
+    def __init__(self, injector=None, calendars=None):
+        super().__init__('calendar', injector)
+        calendars = calendars or [{'id': PRIMARY_CALENDAR, 'summary': 'Me', 'primary': True},
+                                  {'id': 'team@example.com', 'summary': 'Team'}]
+        self._calendars = calendars
+        self._events = {calendar['id']: {} for calendar in calendars}
+        self._version = 0
+        self._next_id = 0
+
+    def _calendar_id(self, calendar_id):
+        if calendar_id == 'primary':
+            return next(calendar['id'] for calendar in self._calendars if calendar.get('primary'))
+        if calendar_id not in self._events:
+            raise http_error(404, f'calendar {calendar_id} not found')
+        return calendar_id
+
+    def add_event(self, calendar_id, event):
+        """Seed an event without counting a call."""
+        return self._insert(calendarId=calendar_id, body=event)
+
+    @property
+    def events_created(self):
+        with self._lock:
+            return sum(1 for events in self._events.values() for event, _ in events.values()
+                       if event.get('status') != 'cancelled')
+
+    def calendarList(self):
+        return _Resource(list=lambda **kwargs: self.request('calendarList.list', self._list_calendars, **kwargs))
+
+    def events(self):
+        return _Resource(
+            list=lambda **kwargs: self.request('events.list', self._list_events, **kwargs),
+            insert=lambda **kwargs: self.request('events.insert', self._insert, **kwargs),
+            get=lambda **kwargs: self.request('events.get', self._get, **kwargs),
+        )
+
+    def freebusy(self):
+        return _Resource(query=lambda **kwargs: self.request('freebusy.query', self._freebusy, **kwargs))
+
+    def _list_calendars(self, pageToken=None, **kwargs):
+        items, result = _page(self._calendars, pageToken)
+        result['items'] = items
+        return result
+
+    def _insert(self, calendarId='primary', body=None, **kwargs):
+        with self._lock:
+            events = self._events[self._calendar_id(calendarId)]
+            event = dict(body)
+            if 'id' not in event:
+                self._next_id += 1
+                event['id'] = f'evt{self._next_id:06d}'
+            if event['id'] in events:
+                raise http_error(409, 'The requested identifier already exists.')
+            event.setdefault('status', 'confirmed')
+            event['htmlLink'] = f"https://www.google.com/calendar/event?eid={event['id']}"
+            if 'iCalUID' not in event:
+                event['iCalUID'] = f"{event['id']}@google.com"
+            self._version += 1
+            events[event['id']] = (event, self._version)
+            return event
+
+    def _get(self, calendarId='primary', eventId=None, **kwargs):
+        with self._lock:
+            stored = self._events[self._calendar_id(calendarId)].get(eventId)
+        if stored is None:
+            raise http_error(404, f'event {eventId} not found')
+        return stored[0]
+
+    def _list_events(self, calendarId='primary', timeMin=None, timeMax=None, syncToken=None, pageToken=None,
+                     iCalUID=None, privateExtendedProperty=None, showDeleted=False, maxResults=250, **kwargs):
+        with self._lock:
+            stored = list(self._events[self._calendar_id(calendarId)].values())
+            version = self._version
+
+        items = []
+        for event, event_version in stored:
+            if syncToken is not None and event_version <= int(syncToken):
+                continue
+            if not showDeleted and event.get('status') == 'cancelled':
+                continue
+            if iCalUID is not None and event.get('iCalUID') != iCalUID:
+                continue
+            if privateExtendedProperty is not None:
+                name, _, value = privateExtendedProperty.partition('=')
+                if event.get('extendedProperties', {}).get('private', {}).get(name) != value:
+                    continue
+            if timeMin or timeMax:
+                start, end = _event_bounds(event)
+                if (timeMax and start >= _parse_time(timeMax)) or (timeMin and end <= _parse_time(timeMin)):
+                    continue
+            items.append(event)
+        items.sort(key=lambda event: _event_bounds(event)[0])
+
+        page, result = _page(items, pageToken, maxResults)
+        result['items'] = page
+        if 'nextPageToken' not in result:
+            result['nextSyncToken'] = str(version)
+        return result
+
+    def _freebusy(self, body=None, **kwargs):
+        time_min, time_max = _parse_time(body['timeMin']), _parse_time(body['timeMax'])
+        calendars = {}
+        for item in body.get('items', []):
+            try:
+                calendar_id = self._calendar_id(item['id'])
+            except HttpError:
+                calendars[item['id']] = {'errors': [{'reason': 'notFound'}], 'busy': []}
+                continue
+            with self._lock:
+                stored = list(self._events[calendar_id].values())
+            busy = []
+            for event, _ in stored:
+                if event.get('status') == 'cancelled' or event.get('transparency') == 'transparent':
+                    continue
+                start, end = _event_bounds(event)
+                if start < time_max and end > time_min:
+                    busy.append({'start': start.isoformat(), 'end': end.isoformat()})
+            calendars[item['id']] = {'busy': sorted(busy, key=lambda interval: interval['start'])}
+        return {'calendars': calendars}
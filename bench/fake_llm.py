@@ -0,0 +1,146 @@
+"""
+Scripted chat model standing in for Gemini: it reads the synthetic emails of bench.mailbox
+with regular expressions and answers the way a well-behaved model would, both as the
+tool-calling agent and through with_structured_output.
+"""
+import datetime
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import ConfigDict, PrivateAttr
+
+_WHEN_RE = re.compile(r'\bon (\d{4}-\d{2}-\d{2})(?: at (\d{1,2}):(\d{2}))?')
+_SUBJECT_RE = re.compile(r"""(?:Subject: |'subject': ['"])([^'"\n]+)""")
+_ID_RE = re.compile(r"""'id': '([^']+)'""")
+_BATCH_SPLIT_RE = re.compile(r'^=== message_id: (\S+) ===$', re.MULTILINE)
+
+
+def _read_event(text):
+    """Return (title, start, end, all_day) for the event an email announces, None if it has none."""
+    match = _WHEN_RE.search(text)
+    if match is None:
+        return None
+    subject = _SUBJECT_RE.search(text)
+    title = subject.group(1).strip() if subject else 'Event'
+    day, hour, minute = match.groups()
+    if hour is None:
+        return title, day, day, True
+    start = datetime.datetime.fromisoformat(f'{day}T{int(hour):02d}:{minute}:00')
+    end = start + datetime.timedelta(hours=1)
+    return title, start.strftime('%Y-%m-%dT%H:%M:%S'), end.strftime('%Y-%m-%dT%H:%M:%S'), False
+
+
+def _extraction(text):
+    event = _read_event(text)
+    if event is None:
+        return {'has_event': False, 'confidence': 0.9}
+    title, start, end, all_day = event
+    return {'has_event': True, 'title': title, 'start': start, 'end': end if not all_day else None,
+            'all_day': all_day, 'confidence': 0.95}
+
+
+def _tool_call(name, args):
+    return {'name': name, 'args': args, 'id': f'call_{uuid.uuid4().hex[:12]}', 'type': 'tool_call'}
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model with configurable latency and error rate that never leaves the process.
+
+    As the agent it reads the calendar for the day of the event, creates the event if the
+    day is free and then reports back. For structured output it fills EventExtraction or
+    BatchEventExtraction from the email text.
+    """
+
+    latency: float = 0.5
+    jitter: float = 0.5
+    error_rate: float = 0.0
+    tokens_per_char: float = 0.25
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    _random: Any = PrivateAttr(default_factory=random.Random)
+    _calls: int = PrivateAttr(default=0)
+    _tokens: int = PrivateAttr(default=0)
+
+    @property
+    def _llm_type(self):
+        return 'bench-fake'
+
+    @property
+    def calls(self):
+        return self._calls
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    def bind_tools(self, tools, *, tool_choice=None, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _generate(self, messages, stop: Optional[List[str]] = None, run_manager=None, **kwargs):
+        with self._lock:
+            delay = self.latency * (1 + self._random.uniform(-self.jitter, self.jitter))
+            fails = self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if fails:
+            raise RuntimeError('injected LLM error')
+
+        tool_names = {tool['function']['name'] for tool in kwargs.get('tools', [])}
+        if 'BatchEventExtraction' in tool_names:
+            message = self._batch_extraction(messages)
+        elif 'EventExtraction' in tool_names:
+            message = AIMessage(content='', tool_calls=[_tool_call('EventExtraction', _extraction(messages[-1].content))])
+        else:
+            message = self._agent_step(messages)
+
+        input_tokens = int(sum(len(str(m.content)) for m in messages) * self.tokens_per_char) + 1
+        output_tokens = int(len(str(message.content) + str(message.tool_calls)) * self.tokens_per_char) + 1
+        message.usage_metadata = {'input_tokens': input_tokens, 'output_tokens': output_tokens,
+                                  'total_tokens': input_tokens + output_tokens}
+        with self._lock:
+            self._calls += 1
+            self._tokens += input_tokens + output_tokens
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _batch_extraction(self, messages):
+        parts = _BATCH_SPLIT_RE.split(messages[-1].content)
+        results = []
+        # split() gives [preamble, id, text, id, text, ...]
+        for message_id, text in zip(parts[1::2], parts[2::2]):
+            results.append(dict(_extraction(text), message_id=message_id))
+        return AIMessage(content='', tool_calls=[_tool_call('BatchEventExtraction', {'results': results})])
+
+    def _agent_step(self, messages):
+        email_text = next(m.content for m in messages if isinstance(m, HumanMessage))
+        tool_results = [m for m in messages if isinstance(m, ToolMessage)]
+        event = _read_event(email_text)
+
+        if event is None:
+            return AIMessage(content='The email does not announce an event, nothing to do.')
+        title, start, end, all_day = event
+
+        if not tool_results:
+            return AIMessage(content='', tool_calls=[
+                _tool_call('read_calendar', {'date_str': f'{start[:10]}/before=0/after=0'})
+            ])
+        if len(tool_results) == 1:
+            if 'No events found' not in str(tool_results[0].content):
+                return AIMessage(content=f'{start[:10]} already has events, not creating {title!r}.')
+            event_data = {'summary': title, 'start': start,
+                          'end': end if not all_day else (datetime.date.fromisoformat(start) + datetime.timedelta(days=1)).isoformat()}
+            message_id = _ID_RE.search(email_text)
+            if message_id:
+                event_data['source_message_id'] = message_id.group(1)
+            return AIMessage(content='', tool_calls=[_tool_call('create_event', {'event_data': event_data})])
+        return AIMessage(content=f'Created {title!r}: {tool_results[-1].content}')
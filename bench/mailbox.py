@@ -0,0 +1,171 @@
+"""
+Synthetic mailbox: realistic MIME messages, converted into the payload structure
+Gmail's messages.get(format='full') returns.
+"""
+import base64
+import datetime
+import random
+from email.message import EmailMessage
+
+# Relative weight of each kind of email in a generated mailbox
+DEFAULT_MIX = {
+    'event': 5,
+    'invite': 2,
+    'forward': 2,
+    'newsletter': 3,
+    'notification': 2,
+    'duplicate': 1,
+}
+
+_TOPICS = ['Quarterly Review', 'Design Sync', 'Guest Lecture', 'Hackathon Kickoff', 'Budget Planning',
+           'Team Offsite', 'Product Demo', 'Alumni Meetup', 'Security Training', 'Town Hall']
+_PLACES = ['Room 4', 'Main Auditorium', 'Conference Hall B', 'https://meet.google.com/abc-defg-hij', 'Library Lawn']
+_NAMES = ['Asha', 'Ravi', 'Meera', 'Karthik', 'Priya', 'Arjun', 'Divya', 'Vikram']
+_FILLER = ("Please find the details below. Let me know if you have any questions or if the timing "
+           "does not work for you, and feel free to forward this to anyone who might be interested. ")
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+
+def to_gmail_payload(message, attachments, part_id=''):
+    """
+    Convert an email.message.Message into Gmail's payload structure. Attachment bodies are
+    moved into attachments (attachmentId -> base64url data) like Gmail keeps them out of the payload.
+    """
+    payload = {
+        'partId': part_id,
+        'mimeType': message.get_content_type(),
+        'filename': message.get_filename() or '',
+        'headers': [{'name': name, 'value': str(value)} for name, value in message.items()],
+    }
+    if message.is_multipart():
+        payload['body'] = {'size': 0}
+        payload['parts'] = [
+            to_gmail_payload(part, attachments, f'{part_id}.{i}' if part_id else str(i))
+            for i, part in enumerate(message.iter_parts())
+        ]
+        return payload
+
+    data = message.get_payload(decode=True) or b''
+    if payload['filename']:
+        attachment_id = f'att{len(attachments)}'
+        attachments[attachment_id] = _b64(data)
+        payload['body'] = {'attachmentId': attachment_id, 'size': len(data)}
+    else:
+        payload['body'] = {'data': _b64(data), 'size': len(data)}
+    return payload
+
+
+class MailboxGenerator:
+    """Generate Gmail messages of the kinds in mix, reproducibly for a given seed."""
+
+    def __init__(self, seed=0, mix=None, today=None):
+        self._random = random.Random(seed)
+        self.mix = mix or DEFAULT_MIX
+        self.today = today or datetime.date.today()
+        self._count = 0
+        self._event_bodies = []
+
+    def _when(self):
+        day = self.today + datetime.timedelta(days=self._random.randint(1, 120))
+        if self._random.random() < 0.2:
+            return day, None
+        return day, datetime.time(self._random.choice(range(9, 19)), self._random.choice((0, 30)))
+
+    def _sentence(self, topic, place):
+        day, at = self._when()
+        when = f'on {day.isoformat()}' + (f' at {at.strftime("%H:%M")}' if at else '')
+        return f'You are invited to the {topic} {when} in {place}.'
+
+    def _message(self, sender, subject, text, html=None, labels=None):
+        message = EmailMessage()
+        message['From'] = sender
+        message['To'] = 'me@example.com'
+        message['Subject'] = subject
+        message['Date'] = datetime.datetime.now(datetime.timezone.utc).strftime('%a, %d %b %Y %H:%M:%S +0000')
+        message.set_content(text)
+        if html is not None:
+            message.add_alternative(html, subtype='html')
+        return message, labels
+
+    def _event(self):
+        topic, place, name = self._random.choice(_TOPICS), self._random.choice(_PLACES), self._random.choice(_NAMES)
+        sentence = self._sentence(topic, place)
+        text = f'Hi all,\n\n{sentence}\n\n{_FILLER * self._random.randint(1, 4)}\n\nRegards,\n{name}\n'
+        self._event_bodies.append((topic, text))
+        html = f'<html><body><p>Hi all,</p><p><b>{sentence}</b></p><p>{_FILLER}</p><p>Regards,<br>{name}</p></body></html>'
+        return self._message(f'{name} <{name.lower()}@example.org>', topic, text, html)
+
+    def _invite(self):
+        topic, place, name = self._random.choice(_TOPICS), self._random.choice(_PLACES), self._random.choice(_NAMES)
+        day, at = self._when()
+        at = at or datetime.time(10, 0)
+        start = datetime.datetime.combine(day, at)
+        end = start + datetime.timedelta(hours=1)
+        uid = f'{self._random.getrandbits(64):016x}@example.org'
+        ics = '\r\n'.join([
+            'BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//bench//EN', 'METHOD:REQUEST', 'BEGIN:VEVENT',
+            f'UID:{uid}', f'SUMMARY:{topic}', f'LOCATION:{place}',
+            f'DTSTART;TZID=Asia/Kolkata:{start.strftime("%Y%m%dT%H%M%S")}',
+            f'DTEND;TZID=Asia/Kolkata:{end.strftime("%Y%m%dT%H%M%S")}',
+            f'ORGANIZER;CN={name}:mailto:{name.lower()}@example.org',
+            'ATTENDEE;CN=Me:mailto:me@example.com', 'END:VEVENT', 'END:VCALENDAR', '',
+        ])
+        message, labels = self._message(f'{name} <{name.lower()}@example.org>', f'Invitation: {topic}',
+                                        f'{name} has invited you to {topic}.\n')
+        message.add_attachment(ics.encode('utf-8'), maintype='text', subtype='calendar', filename='invite.ics',
+                               params={'method': 'REQUEST'})
+        return message, labels
+
+    def _forward(self):
+        topic, place, name = self._random.choice(_TOPICS), self._random.choice(_PLACES), self._random.choice(_NAMES)
+        sentence = self._sentence(topic, place)
+        quoted = '\n'.join(f'> {line}' for line in f'{sentence}\n{_FILLER * 3}'.splitlines())
+        text = (f'FYI, see below.\n\n---------- Forwarded message ---------\nFrom: {name} <{name.lower()}@example.org>\n'
+                f'Subject: {topic}\n\n{quoted}\n\n-- \n{name}\nSent from my phone\n')
+        return self._message(f'Forwarder <fwd@example.net>', f'Fwd: {topic}', text)
+
+    def _newsletter(self):
+        items = ''.join(f'<li>{self._random.choice(_TOPICS)} recap</li>' for _ in range(self._random.randint(3, 8)))
+        html = (f'<html><body><h1>Weekly digest</h1><ul>{items}</ul><p>{_FILLER * 5}</p>'
+                f'<p><a href="https://example.com/unsubscribe">Unsubscribe</a></p></body></html>')
+        message = EmailMessage()
+        message['From'] = 'Digest <newsletter@example.com>'
+        message['To'] = 'me@example.com'
+        message['Subject'] = 'Your weekly digest'
+        message.set_content(html, subtype='html')
+        return message, ['INBOX', 'CATEGORY_PROMOTIONS']
+
+    def _notification(self):
+        text = f'Your order #{self._random.randint(10000, 99999)} has shipped. Track it in the app.\n'
+        return self._message('Shop <no-reply@shop.example.com>', 'Your order has shipped', text,
+                             labels=['INBOX', 'CATEGORY_UPDATES'])
+
+    def _duplicate(self):
+        if not self._event_bodies:
+            return self._event()
+        topic, text = self._random.choice(self._event_bodies)
+        return self._message('Mailing list <list@example.org>', f'[list] {topic}', text)
+
+    def message(self):
+        """Return the next message as a Gmail API message dictionary (without historyId/internalDate)."""
+        kinds, weights = zip(*self.mix.items())
+        kind = self._random.choices(kinds, weights)[0]
+        mime, labels = getattr(self, f'_{kind}')()
+        self._count += 1
+        attachments = {}
+        message = {
+            'id': f'{self._count:016x}',
+            'payload': to_gmail_payload(mime, attachments),
+            'attachments': attachments,
+            'snippet': '',
+            'kind': kind,
+        }
+        if labels:
+            message['labelIds'] = labels
+        return message
+
+    def messages(self, count):
+        return [self.message() for _ in range(count)]
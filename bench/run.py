@@ -0,0 +1,233 @@
+"""
+Offline end-to-end benchmark: drives the real watcher, callback and calendar tools against
+in-process fakes of Gmail, Calendar and the chat model.
+
+    python -m bench.run --emails 200 --rate 20 --mode extract --save baseline.json
+    python -m bench.run --emails 200 --rate 20 --mode extract --baseline baseline.json
+
+Emails are delivered to the fake inbox at --rate per second; the report gives emails/sec,
+API calls per email and end-to-end latency percentiles (delivery to end of processing).
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import metrics
+from bench.fake_google import FakeCalendar, FakeGmail, Injector
+from bench.fake_llm import FakeChatModel
+from bench.mailbox import MailboxGenerator
+
+
+def install_fakes(gmail, calendar, llm, keep_rate_limits=False):
+    """Point every module of the app at the fake backends."""
+    import auth
+    import ratelimit
+    from agent import agent as agent_module
+    from mail import mail_callback, mail_watcher, pipeline  # noqa: F401, imported so get_service is patched
+    from cal import event_store, free_busy, ics, read_calendar, util  # noqa: F401
+
+    services = {'gmail': gmail, 'calendar': calendar}
+
+    def get_service(api, version):
+        return services[api]
+
+    # Modules hold their own reference to get_service, patch each of them
+    for module in list(sys.modules.values()):
+        if getattr(module, 'get_service', None) is auth.get_service:
+            module.get_service = get_service
+    auth.get_service = get_service
+
+    if not keep_rate_limits:
+        for api in ratelimit.RATE_LIMITS:
+            ratelimit.RATE_LIMITS[api] = (1e9, 1e9)
+        ratelimit._buckets.clear()
+
+    # The agent and the extraction chains are built on first use, from this llm
+    agent_module._llm = llm
+    agent_module._mailer_agent = None
+
+
+def percentiles(values):
+    histogram = metrics.Histogram(window=max(1, len(values)))
+    for value in values:
+        histogram.observe(value)
+    return {f'p{int(q * 100)}': value for q, value in histogram.quantiles().items()}
+
+
+def run(emails=100, rate=10.0, mode='extract', workers=4, pipeline=False, check_interval=0.5,
+        gmail_latency=0.05, calendar_latency=0.05, llm_latency=0.5, error_rate=0.0, llm_error_rate=0.0,
+        calendar_mirror=False, keep_rate_limits=False, seed=0, timeout=600):
+    """
+    Run one benchmark in a scratch directory (for the SQLite state) and return the report dictionary.
+    """
+    os.chdir(tempfile.mkdtemp(prefix='bench-'))
+
+    generator = MailboxGenerator(seed=seed)
+    gmail = FakeGmail(Injector(gmail_latency, error_rate=error_rate, seed=seed))
+    calendar = FakeCalendar(Injector(calendar_latency, error_rate=error_rate, seed=seed + 1))
+    llm = FakeChatModel(latency=llm_latency, error_rate=llm_error_rate)
+    install_fakes(gmail, calendar, llm, keep_rate_limits)
+
+    from cal.event_store import get_event_store
+    from mail.checkpoint import get_checkpoint
+    from mail.mail_callback import email_callback, process_email
+    from mail.mail_watcher import watch_gmail
+    from mail.pipeline import run_pipeline
+
+    # The watcher starts from the newest message already in the inbox
+    gmail.deliver(generator.message())
+    mailbox = generator.messages(emails)
+    kinds = Counter(message['kind'] for message in mailbox)
+
+    latencies = []
+    outcomes = Counter()
+    finished = threading.Event()
+    lock = threading.Lock()
+
+    def record(email, outcome):
+        with lock:
+            latencies.append(time.time() - email['received_at'])
+            outcomes[str(outcome).split(':')[0][:40]] += 1
+            if len(latencies) >= emails:
+                finished.set()
+
+    def callback(new_emails):
+        results = email_callback(new_emails, max_workers=workers, mode=mode)
+        for email in new_emails:
+            record(email, results.get(email['id']))
+        return results
+
+    def processor(email):
+        outcome = process_email(email, mode=mode)
+        record(email, outcome)
+        return outcome
+
+    if calendar_mirror:
+        get_event_store().start_background_sync(interval=5)
+    if pipeline:
+        target = lambda: asyncio.run(run_pipeline(processor=processor, check_interval=check_interval, workers=workers))
+    else:
+        target = lambda: watch_gmail(callback, check_interval=check_interval)
+    threading.Thread(target=target, name='bench-watcher', daemon=True).start()
+
+    checkpoint = get_checkpoint()
+    while checkpoint.get_history_id() is None:
+        time.sleep(0.05)
+
+    started = time.time()
+    for i, message in enumerate(mailbox):
+        time.sleep(max(0.0, started + i / rate - time.time()))
+        gmail.deliver(message)
+    delivered = time.time()
+
+    finished.wait(timeout)
+    ended = time.time()
+
+    processed = len(latencies)
+    gmail_http = gmail.calls['http']
+    calendar_http = calendar.calls['http']
+    return {
+        'config': {'emails': emails, 'rate': rate, 'mode': mode, 'workers': workers, 'pipeline': pipeline,
+                   'gmail_latency': gmail_latency, 'calendar_latency': calendar_latency,
+                   'llm_latency': llm_latency, 'error_rate': error_rate, 'llm_error_rate': llm_error_rate,
+                   'calendar_mirror': calendar_mirror, 'seed': seed},
+        'processed': processed,
+        'timed_out': processed < emails,
+        'delivery_seconds': delivered - started,
+        'emails_per_sec': processed / (ended - started) if processed else 0.0,
+        'latency': percentiles(latencies),
+        'api_calls_per_email': {
+            'gmail': gmail_http / max(1, processed),
+            'calendar': calendar_http / max(1, processed),
+            'llm': llm.calls / max(1, processed),
+        },
+        'llm_tokens_per_email': llm.tokens / max(1, processed),
+        'gmail_calls': dict(gmail.calls),
+        'calendar_calls': dict(calendar.calls),
+        'events_created': calendar.events_created,
+        'mailbox': dict(kinds),
+        'outcomes': dict(outcomes),
+        'metrics': metrics.snapshot(),
+    }
+
+
+_COMPARED = [
+    ('emails/sec', lambda r: r['emails_per_sec'], True),
+    ('latency p50 (s)', lambda r: r['latency']['p50'], False),
+    ('latency p95 (s)', lambda r: r['latency']['p95'], False),
+    ('latency p99 (s)', lambda r: r['latency']['p99'], False),
+    ('gmail calls/email', lambda r: r['api_calls_per_email']['gmail'], False),
+    ('calendar calls/email', lambda r: r['api_calls_per_email']['calendar'], False),
+    ('llm calls/email', lambda r: r['api_calls_per_email']['llm'], False),
+    ('llm tokens/email', lambda r: r['llm_tokens_per_email'], False),
+]
+
+
+def print_report(report, baseline=None):
+    print(f"\nProcessed {report['processed']}/{report['config']['emails']} emails "
+          f"({report['config']['mode']} mode, {'pipeline' if report['config']['pipeline'] else 'watcher'}, "
+          f"{report['config']['workers']} workers) at {report['config']['rate']}/s offered"
+          + (" -- TIMED OUT" if report['timed_out'] else ""))
+    print(f"Mailbox: {report['mailbox']}")
+    print(f"Outcomes: {report['outcomes']}")
+    print(f"Events created: {report['events_created']}\n")
+
+    for name, value_of, higher_is_better in _COMPARED:
+        value = value_of(report)
+        line = f"{name:<22}{value:>12.3f}"
+        if baseline is not None:
+            old = value_of(baseline)
+            change = (value - old) / old * 100 if old else 0.0
+            better = (change > 0) == higher_is_better if change else None
+            line += f"{old:>12.3f}{change:>+9.1f}%" + {True: '  better', False: '  worse', None: ''}[better]
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark against fake Google and LLM backends")
+    parser.add_argument("--emails", type=int, default=100, help="how many emails to deliver")
+    parser.add_argument("--rate", type=float, default=10.0, help="emails delivered per second")
+    parser.add_argument("--mode", choices=('agent', 'extract', 'batch'), default='extract')
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--pipeline", action="store_true", help="run the staged pipeline instead of watch_gmail")
+    parser.add_argument("--check-interval", type=float, default=0.5, help="Gmail poll interval (in seconds)")
+    parser.add_argument("--gmail-latency", type=float, default=0.05, help="mean Gmail round trip (in seconds)")
+    parser.add_argument("--calendar-latency", type=float, default=0.05, help="mean Calendar round trip (in seconds)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="mean LLM call (in seconds)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Google requests failing with 429/503")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of LLM calls failing")
+    parser.add_argument("--calendar-mirror", action="store_true", help="keep the local calendar mirror in sync")
+    parser.add_argument("--keep-rate-limits", action="store_true", help="apply the real API rate limits")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=600, help="give up waiting after this many seconds")
+    parser.add_argument("--save", help="write the report as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a report saved with --save")
+    parser.add_argument("--log", default=os.devnull, help="file the app's own output goes to")
+    args = parser.parse_args()
+
+    save_path = os.path.abspath(args.save) if args.save else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    with open(args.log, 'a') as log, contextlib.redirect_stdout(log):
+        report = run(emails=args.emails, rate=args.rate, mode=args.mode, workers=args.workers,
+                     pipeline=args.pipeline, check_interval=args.check_interval,
+                     gmail_latency=args.gmail_latency, calendar_latency=args.calendar_latency,
+                     llm_latency=args.llm_latency, error_rate=args.error_rate,
+                     llm_error_rate=args.llm_error_rate, calendar_mirror=args.calendar_mirror,
+                     keep_rate_limits=args.keep_rate_limits, seed=args.seed, timeout=args.timeout)
+
+    print_report(report, baseline)
+    if save_path:
+        with open(save_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport saved to {save_path}")
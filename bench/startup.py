@@ -0,0 +1,91 @@
+"""
+Startup-time benchmark: how long a fresh process takes to import the app, build the Gmail
+and Calendar clients (four of each, like a few worker threads do) and build the agent stack
+on the first email.
+
+    python -m bench.startup --runs 5
+
+Every measurement runs in a new interpreter, so module and discovery caches start cold.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Each snippet prints the seconds of the step it measures
+_SNIPPETS = {
+    'import main': """
+import time
+started = time.perf_counter()
+import main
+print(time.perf_counter() - started)
+""",
+    'build clients (shared document)': """
+import time
+from google.oauth2.credentials import Credentials
+import auth
+creds = Credentials(token='startup-benchmark')
+started = time.perf_counter()
+for _ in range(4):
+    for api, version in (('gmail', 'v1'), ('calendar', 'v3')):
+        auth._build(api, version, creds)
+print(time.perf_counter() - started)
+""",
+    'build clients (build() each time)': """
+import time
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+creds = Credentials(token='startup-benchmark')
+started = time.perf_counter()
+for _ in range(4):
+    for api, version in (('gmail', 'v1'), ('calendar', 'v3')):
+        build(api, version, credentials=creds, cache_discovery=False)
+print(time.perf_counter() - started)
+""",
+    'first agent build': """
+import os
+import time
+os.environ.setdefault('GOOGLE_API_KEY', 'startup-benchmark')
+import main
+from agent.agent import get_mailer_agent
+started = time.perf_counter()
+get_mailer_agent()
+print(time.perf_counter() - started)
+""",
+}
+
+
+def measure(snippet, runs):
+    """Run snippet in runs fresh interpreters and return the seconds each one printed."""
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', snippet], cwd=ROOT, capture_output=True, text=True)
+        if output.returncode != 0:
+            raise RuntimeError(output.stderr.strip().splitlines()[-1] if output.stderr.strip() else 'failed')
+        timings.append(float(output.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Measure the startup time of the app")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--save", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {}
+    for name, snippet in _SNIPPETS.items():
+        try:
+            timings = measure(snippet, args.runs)
+        except RuntimeError as e:
+            print(f"{name:<36}failed: {e}")
+            continue
+        results[name] = {'median': statistics.median(timings), 'min': min(timings), 'max': max(timings)}
+        print(f"{name:<36}median {results[name]['median']:.3f}s  (min {min(timings):.3f}s, max {max(timings):.3f}s)")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
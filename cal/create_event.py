@@ -1,73 +1,45 @@
+import contextvars
 import datetime
+import hashlib
+from contextlib import contextmanager
 from typing import Dict, Any
 import json
 
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from langchain_core.tools import tool
 
-from auth import check_auth
+from auth import get_service
+from ratelimit import execute, execute_batch
+from cal.event_store import get_warm_event_store
 from util import parse_date_string
 
+# Gmail message ID of the email the agent is handling, see source_message
+_source_message_id = contextvars.ContextVar('source_message_id', default=None)
 
-@tool
-def create_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
-    """Create a new calendar event with comprehensive error handling and timezone support.
 
-    Features:
-    - Automatic timezone handling (defaults to UTC+5:30 for India)
-    - Supports both timed events and all-day events
-    - Detailed error reporting
-    - Automatic retry on authentication failure
-    - Verbose logging for debugging
+def event_id_for(source_id, index=0):
+    """
+    Deterministic Calendar event ID for the index-th event created from source_id
+    (e.g. a Gmail message ID). Hex digits are valid base32hex, as Calendar requires.
+    """
+    return hashlib.sha1(f"{source_id}:{index}".encode('utf-8')).hexdigest()
 
-    Args:
-        event_data: Dictionary containing event details with these fields:
-            Required:
-            - summary: Title of the event (string)
-            - start: Start time in format:
-                * 'YYYY-MM-DD' for all-day events
-                * 'YYYY-MM-DDTHH:MM:SS' for timed events (will auto-add timezone)
-                * {'dateTime': '...', 'timeZone': '...'} for explicit timezone
-            - end: End time in same format as start
 
-            Optional:
-            - description: Event description (string)
-            - location: Physical location (string)
-            - attendees: List of email dictionaries:
-                [{'email': 'user@example.com'}, ...]
-            - reminders: Dictionary with either:
-                * {'useDefault': True} or
-                * {'overrides': [{'method': 'popup', 'minutes': 30}, ...]}
-            - colorId: Event color ID (1-11)
-            - visibility: 'public', 'private', or 'confidential'
-            - recurrence: RRULE string array (e.g., ['RRULE:FREQ=DAILY;COUNT=2'])
-            - extendedProperties: Dictionary for custom metadata
+def format_event_data(event_data, source_id=None, index=0):
+    """
+    Turn event_data, as the create_event tool describes it, into a Calendar API event body.
+
+    With a source_id the body gets a deterministic ID and the source in its private
+    extended properties, so inserting it twice can't create a duplicate.
 
     Returns:
-        Dictionary with:
-        - On success:
-            {
-                'status': 'success',
-                'event_link': 'https://calendar.google.com/...',
-                'event_id': 'google_event_id',
-                'summary': 'Event title',
-                'start': 'formatted_start',
-                'end': 'formatted_end',
-                'calendar': 'primary'
-            }
-        - On error:
-            {
-                'status': 'error',
-                'error': 'Error description',
-                'details': {additional error info if available}
-            }
+        tuple: (body, error) where error is an error result dictionary or None.
     """
-    creds = check_auth()
-
-    if(creds is None):
-        return {"Proper credentials not found. Please authenticate first.":"Error"}
     formatted_event = event_data.copy()
+    own_source_id = formatted_event.pop('source_message_id', None)
+    if own_source_id:
+        # An event naming its own source is the only one from it
+        source_id, index = own_source_id, 0
     timezone = datetime.timezone(datetime.timedelta(hours=5, minutes=30))  # IST
 
     for time_field in ['start', 'end']:
@@ -94,7 +66,7 @@ def create_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
                         'timeZone': 'Asia/Kolkata'
                     }
                 except ValueError:
-                    return {
+                    return None, {
                         'status': 'error',
                         'error': 'Invalid time format',
                         'details': f'{time_field} must be YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS'
@@ -106,33 +78,37 @@ def create_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
             'useDefault': True
         }
 
-    # Create the event
-    try:
-        service = build("calendar", "v3", credentials=creds)
+    if source_id:
+        formatted_event['id'] = event_id_for(source_id, index)
+        extended_properties = dict(formatted_event.get('extendedProperties', {}))
+        extended_properties['private'] = dict(extended_properties.get('private', {}), sourceId=source_id)
+        formatted_event['extendedProperties'] = extended_properties
 
-        print(f"\nCreating event with details:")
-        for key, value in formatted_event.items():
-            print(f" - {key}: {str(value)[:100]}{'...' if len(str(value)) > 100 else ''}")
+    return formatted_event, None
 
-        created_event = service.events().insert(
-            calendarId='primary',
-            body=formatted_event,
-            sendUpdates='none'  # Change to 'all' to notify attendees
-        ).execute()
 
-        print(f"\nSuccessfully created event: {created_event.get('htmlLink')}")
+def _success_result(created_event, duplicate=False):
+    store = get_warm_event_store()
+    if store is not None:
+        # The organizer of an event on the primary calendar is the primary calendar itself
+        store.record_event(created_event.get('organizer', {}).get('email', 'primary'), created_event)
 
-        return {
-            'status': 'success',
-            'event_link': created_event.get('htmlLink'),
-            'event_id': created_event['id'],
-            'summary': created_event.get('summary'),
-            'start': created_event.get('start'),
-            'end': created_event.get('end'),
-            'calendar': 'primary'
-        }
+    result = {
+        'status': 'success',
+        'event_link': created_event.get('htmlLink'),
+        'event_id': created_event['id'],
+        'summary': created_event.get('summary'),
+        'start': created_event.get('start'),
+        'end': created_event.get('end'),
+        'calendar': 'primary'
+    }
+    if duplicate:
+        result['duplicate'] = True
+    return result
 
-    except HttpError as e:
+
+def _error_result(e):
+    if isinstance(e, HttpError):
         error_details = {
             'status_code': e.resp.status,
             'error_details': e.error_details
@@ -142,9 +118,232 @@ def create_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
             'error': 'Calendar API error',
             'details': error_details
         }
+    return {
+        'status': 'error',
+        'error': 'Unexpected error',
+        'details': str(e)
+    }
+
+
+def _existing_event_result(service, event_id):
+    """Result for an insert that hit an already existing event ID: the earlier insert went through."""
+    existing_event = execute(service.events().get(calendarId='primary', eventId=event_id), 'calendar')
+    print(f"\nEvent already exists, not creating it again: {existing_event.get('htmlLink')}")
+    return _success_result(existing_event, duplicate=True)
+
+
+def insert_event(event_data, source_id=None):
+    """
+    Format event_data like the create_event tool describes and insert it into the primary calendar.
+
+    With a source_id (or a 'source_message_id' in event_data) the insert is idempotent:
+    repeating it returns the existing event, flagged as duplicate, instead of creating another.
+    """
+    formatted_event, error = format_event_data(event_data, source_id)
+    if error:
+        return error
+
+    # Create the event
+    try:
+        service = get_service("calendar", "v3")
+
+        print(f"\nCreating event with details:")
+        for key, value in formatted_event.items():
+            print(f" - {key}: {str(value)[:100]}{'...' if len(str(value)) > 100 else ''}")
+
+        try:
+            created_event = execute(service.events().insert(
+                calendarId='primary',
+                body=formatted_event,
+                sendUpdates='none'  # Change to 'all' to notify attendees
+            ), 'calendar')
+        except HttpError as e:
+            if e.resp.status == 409 and 'id' in formatted_event:
+                return _existing_event_result(service, formatted_event['id'])
+            raise
+
+        print(f"\nSuccessfully created event: {created_event.get('htmlLink')}")
+        return _success_result(created_event)
+
     except Exception as e:
-        return {
-            'status': 'error',
-            'error': 'Unexpected error',
-            'details': str(e)
-        }
+        return _error_result(e)
+
+
+def insert_events(events, source_id=None, batch_size=50):
+    """
+    Insert several events through Calendar batch requests, batch_size events per round trip.
+
+    Args:
+        events: List of event_data dictionaries, as the create_event tool describes them.
+        source_id: Optional ID of the source all events come from; the i-th event gets the
+                   deterministic ID event_id_for(source_id, i), so re-running is safe.
+        batch_size: Events per batch request (Calendar allows up to 1000, 50 keeps responses small).
+
+    Returns:
+        list: One insert_event-style result per event, in order.
+    """
+    results = [None] * len(events)
+    bodies = []
+    for index, event_data in enumerate(events):
+        formatted_event, error = format_event_data(event_data, source_id, index)
+        if error:
+            results[index] = error
+        else:
+            bodies.append((index, formatted_event))
+
+    try:
+        service = get_service("calendar", "v3")
+    except Exception as e:
+        return [result or _error_result(e) for result in results]
+
+    requests = [
+        (str(index), service.events().insert(calendarId='primary', body=formatted_event, sendUpdates='none'))
+        for index, formatted_event in bodies
+    ]
+    try:
+        responses = execute_batch(service, requests, 'calendar', batch_size)
+    except Exception as e:
+        return [result or _error_result(e) for result in results]
+
+    bodies_by_index = dict(bodies)
+    for request_id, (response, exception) in responses.items():
+        index = int(request_id)
+        if exception is None:
+            print(f"\nSuccessfully created event: {response.get('htmlLink')}")
+            results[index] = _success_result(response)
+        elif isinstance(exception, HttpError) and exception.resp.status == 409:
+            # Already inserted by an earlier attempt
+            try:
+                results[index] = _existing_event_result(service, bodies_by_index[index]['id'])
+            except Exception as e:
+                results[index] = _error_result(e)
+        else:
+            results[index] = _error_result(exception)
+
+    return results
+
+
+def update_event(event_id, event_data):
+    """
+    Replace the primary-calendar event event_id (or one instance of a recurring event) with
+    event_data, formatted like insert_event does. Returns an insert_event-style result, flagged as updated.
+    """
+    formatted_event, error = format_event_data(event_data)
+    if error:
+        return error
+
+    try:
+        service = get_service("calendar", "v3")
+        updated_event = execute(service.events().update(
+            calendarId='primary',
+            eventId=event_id,
+            body=formatted_event,
+            sendUpdates='none'
+        ), 'calendar')
+        print(f"\nSuccessfully updated event: {updated_event.get('htmlLink')}")
+        result = _success_result(updated_event)
+        result['updated'] = True
+        return result
+
+    except Exception as e:
+        return _error_result(e)
+
+
+def delete_event(event):
+    """Delete an event, or one instance of a recurring event, from the primary calendar. Returns a result dictionary."""
+    try:
+        service = get_service("calendar", "v3")
+        execute(service.events().delete(calendarId='primary', eventId=event['id'], sendUpdates='none'), 'calendar')
+    except HttpError as e:
+        # 410: already deleted
+        if e.resp.status != 410:
+            return _error_result(e)
+    except Exception as e:
+        return _error_result(e)
+
+    print(f"\nDeleted event: {event.get('htmlLink')}")
+    store = get_warm_event_store()
+    if store is not None:
+        store.record_event(event.get('organizer', {}).get('email', 'primary'), dict(event, status='cancelled'))
+    return {
+        'status': 'deleted',
+        'event_id': event['id'],
+        'summary': event.get('summary'),
+        'calendar': 'primary'
+    }
+
+
+@contextmanager
+def source_message(message_id):
+    """
+    Within the block, events created through the create_event tool get a source_message_id
+    derived from message_id and their start, replacing whatever the model passed, so a step
+    the agent repeats can't create a duplicate.
+    """
+    token = _source_message_id.set(message_id)
+    try:
+        yield
+    finally:
+        _source_message_id.reset(token)
+
+
+@tool
+def create_event(event_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Create a new calendar event with comprehensive error handling and timezone support.
+
+    Features:
+    - Automatic timezone handling (defaults to UTC+5:30 for India)
+    - Supports both timed events and all-day events
+    - Detailed error reporting
+    - Automatic retry on authentication failure
+    - Verbose logging for debugging
+
+    Args:
+        event_data: Dictionary containing event details with these fields:
+            Required:
+            - summary: Title of the event (string)
+            - start: Start time in format:
+                * 'YYYY-MM-DD' for all-day events
+                * 'YYYY-MM-DDTHH:MM:SS' for timed events (will auto-add timezone)
+                * {'dateTime': '...', 'timeZone': '...'} for explicit timezone
+            - end: End time in same format as start
+
+            Optional:
+            - description: Event description (string)
+            - location: Physical location (string)
+            - attendees: List of email dictionaries:
+                [{'email': 'user@example.com'}, ...]
+            - reminders: Dictionary with either:
+                * {'useDefault': True} or
+                * {'overrides': [{'method': 'popup', 'minutes': 30}, ...]}
+            - colorId: Event color ID (1-11)
+            - visibility: 'public', 'private', or 'confidential'
+            - recurrence: RRULE string array (e.g., ['RRULE:FREQ=DAILY;COUNT=2'])
+            - extendedProperties: Dictionary for custom metadata
+            - source_message_id: ID of the email the event comes from; makes the call
+              idempotent, repeating it returns the existing event instead of a duplicate
+
+    Returns:
+        Dictionary with:
+        - On success:
+            {
+                'status': 'success',
+                'event_link': 'https://calendar.google.com/...',
+                'event_id': 'google_event_id',
+                'summary': 'Event title',
+                'start': 'formatted_start',
+                'end': 'formatted_end',
+                'calendar': 'primary'
+            }
+        - On error:
+            {
+                'status': 'error',
+                'error': 'Error description',
+                'details': {additional error info if available}
+            }
+    """
+    message_id = _source_message_id.get()
+    if message_id:
+        # Keyed by the start too, one email can hold several events
+        event_data = dict(event_data, source_message_id=f"{message_id}#{json.dumps(event_data.get('start'), sort_keys=True)}")
+    return insert_event(event_data)
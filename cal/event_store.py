@@ -0,0 +1,322 @@
+import datetime
+import json
+import threading
+import time
+from collections import defaultdict
+
+from googleapiclient.errors import HttpError
+
+from accounts import current_account, use_account
+from auth import get_service
+from cal.util import format_event, get_calendars
+from db import connect
+from ratelimit import execute
+
+# read_calendar only trusts the mirror if it was synced at least this recently (in seconds)
+MAX_STALENESS = 300
+# Multi-day events are indexed on at most this many days
+MAX_INDEXED_DAYS = 366
+# Days before and after the day of a calendar's full sync that its mirror holds. Recurring events
+# are expanded into instances, and one without an end would otherwise fill the mirror for years.
+MIRROR_PAST_DAYS = 60
+MIRROR_FUTURE_DAYS = 365
+# A calendar is fully synced again once its window is this many days old, before its end comes near
+MIRROR_RENEW_DAYS = 30
+
+
+def _in_window(formatted_event, window):
+    """True if the event covers a day of window, a (first, last) pair of YYYY-MM-DD days."""
+    days = _event_days(formatted_event)
+    return days[0] <= window[1] and days[-1] >= window[0]
+
+
+def _event_days(formatted_event):
+    """Return the list of YYYY-MM-DD days an event covers."""
+    end = formatted_event['end']
+
+    start_day = datetime.date.fromisoformat(formatted_event['date'])
+    if 'date' in end:
+        # All-day events have an exclusive end date
+        end_day = datetime.date.fromisoformat(end['date']) - datetime.timedelta(days=1)
+    elif 'dateTime' in end:
+        end_day = datetime.date.fromisoformat(end['dateTime'][:10])
+        # An event ending exactly at midnight doesn't occupy the next day
+        if end['dateTime'][11:19] == '00:00:00' and end_day > start_day:
+            end_day -= datetime.timedelta(days=1)
+    else:
+        end_day = start_day
+
+    end_day = max(start_day, min(end_day, start_day + datetime.timedelta(days=MAX_INDEXED_DAYS - 1)))
+    days = []
+    day = start_day
+    while day <= end_day:
+        days.append(day.isoformat())
+        day += datetime.timedelta(days=1)
+    return days
+
+
+class EventStore:
+    """
+    Local mirror of every readable calendar, kept current through Calendar syncToken
+    incremental sync, held in memory with a per-day index and persisted to SQLite.
+
+    Each calendar is mirrored over a window of days around its last full sync (see
+    MIRROR_PAST_DAYS and MIRROR_FUTURE_DAYS), queries outside it go to the API.
+    """
+
+    def __init__(self, db_path=None, account=None):
+        self._conn = connect(db_path) if db_path else connect()
+        # The account whose calendars are mirrored, syncs run for it whichever thread calls them
+        self.account = account or current_account()
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._events = {}
+        self._days = defaultdict(set)
+        self._sync_tokens = {}
+        self._windows = {}
+        self._calendar_names = {}
+        self._last_sync = 0.0
+        self._sync_thread = None
+
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS calendar_sync ("
+                "calendar_id TEXT PRIMARY KEY, sync_token TEXT, window_start TEXT, window_end TEXT)"
+            )
+            # Mirrors created before they had a window are fully synced again, see sync
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(calendar_sync)")}
+            if 'window_start' not in columns:
+                self._conn.execute("ALTER TABLE calendar_sync ADD COLUMN window_start TEXT")
+                self._conn.execute("ALTER TABLE calendar_sync ADD COLUMN window_end TEXT")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS calendar_events ("
+                "calendar_id TEXT, event_id TEXT, data TEXT, PRIMARY KEY (calendar_id, event_id))"
+            )
+            self._conn.commit()
+            self._load()
+
+    def _load(self):
+        for calendar_id, sync_token, window_start, window_end in self._conn.execute(
+                "SELECT calendar_id, sync_token, window_start, window_end FROM calendar_sync"):
+            self._sync_tokens[calendar_id] = sync_token
+            if window_start and window_end:
+                self._windows[calendar_id] = (window_start, window_end)
+        for calendar_id, event_id, data in self._conn.execute(
+                "SELECT calendar_id, event_id, data FROM calendar_events"):
+            self._index((calendar_id, event_id), json.loads(data))
+
+    def _index(self, key, formatted_event):
+        self._unindex(key)
+        self._events[key] = formatted_event
+        for day in _event_days(formatted_event):
+            self._days[day].add(key)
+
+    def _unindex(self, key):
+        formatted_event = self._events.pop(key, None)
+        if formatted_event is None:
+            return
+        for day in _event_days(formatted_event):
+            keys = self._days.get(day)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._days[day]
+
+    def _drop_calendar(self, calendar_id):
+        for key in [key for key in self._events if key[0] == calendar_id]:
+            self._unindex(key)
+        self._sync_tokens.pop(calendar_id, None)
+        self._windows.pop(calendar_id, None)
+        self._conn.execute("DELETE FROM calendar_events WHERE calendar_id = ?", (calendar_id,))
+        self._conn.execute("DELETE FROM calendar_sync WHERE calendar_id = ?", (calendar_id,))
+
+    def _sync_calendar(self, service, calendar):
+        calendar_id = calendar['id']
+        calendar_name = calendar.get('summary', 'Unnamed Calendar')
+        self._calendar_names[calendar_id] = calendar_name
+        sync_token = self._sync_tokens.get(calendar_id)
+        window = self._windows.get(calendar_id)
+        if not sync_token or window is None:
+            today = datetime.date.today()
+            window = ((today - datetime.timedelta(days=MIRROR_PAST_DAYS)).isoformat(),
+                      (today + datetime.timedelta(days=MIRROR_FUTURE_DAYS)).isoformat())
+        changes = []
+        page_token = None
+
+        try:
+            while True:
+                events_result = execute(service.events().list(
+                    calendarId=calendar_id,
+                    singleEvents=True,
+                    showDeleted=True,
+                    syncToken=sync_token,
+                    pageToken=page_token
+                ), 'calendar')
+                for event in events_result.get('items', []):
+                    formatted_event = format_event(event, calendar_name)
+                    if formatted_event is not None and not _in_window(formatted_event, window):
+                        # Instances beyond the window are dropped like deleted events
+                        formatted_event = None
+                    # A full sync starts from an empty mirror, there is nothing to delete
+                    if formatted_event is not None or sync_token:
+                        changes.append((event['id'], formatted_event))
+                page_token = events_result.get('nextPageToken')
+                if not page_token:
+                    break
+        except HttpError as error:
+            if error.resp.status == 410 and sync_token:
+                # Sync token expired, throw the mirror of this calendar away and do a full sync
+                print(f"Sync token expired for {calendar_name}, running a full sync")
+                with self._lock:
+                    self._drop_calendar(calendar_id)
+                    self._conn.commit()
+                return self._sync_calendar(service, calendar)
+            raise
+
+        with self._lock:
+            for event_id, formatted_event in changes:
+                key = (calendar_id, event_id)
+                if formatted_event is None:
+                    self._unindex(key)
+                    self._conn.execute(
+                        "DELETE FROM calendar_events WHERE calendar_id = ? AND event_id = ?", key
+                    )
+                else:
+                    self._index(key, formatted_event)
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO calendar_events (calendar_id, event_id, data) VALUES (?, ?, ?)",
+                        (calendar_id, event_id, json.dumps(formatted_event))
+                    )
+
+            self._sync_tokens[calendar_id] = events_result.get('nextSyncToken')
+            self._windows[calendar_id] = window
+            self._conn.execute(
+                "INSERT OR REPLACE INTO calendar_sync (calendar_id, sync_token, window_start, window_end) "
+                "VALUES (?, ?, ?, ?)",
+                (calendar_id, self._sync_tokens[calendar_id], window[0], window[1])
+            )
+            self._conn.commit()
+
+        return len(changes)
+
+    def sync(self):
+        """Pull changes for every calendar since the last sync. Returns the number of changed events."""
+        with self._sync_lock, use_account(self.account):
+            service = get_service("calendar", "v3")
+            calendars = get_calendars(raise_errors=True)
+            changed = 0
+            failed = False
+            renew_before = (datetime.date.today() + datetime.timedelta(
+                days=MIRROR_FUTURE_DAYS - MIRROR_RENEW_DAYS)).isoformat()
+
+            for calendar in calendars:
+                window = self._windows.get(calendar['id'])
+                if calendar['id'] in self._sync_tokens and (window is None or window[1] < renew_before):
+                    # Move the window along: instances entering it never show up as changes
+                    with self._lock:
+                        self._drop_calendar(calendar['id'])
+                        self._conn.commit()
+                try:
+                    changed += self._sync_calendar(service, calendar)
+                except Exception as e:
+                    failed = True
+                    print(f"\nError syncing cal {calendar.get('summary', calendar['id'])}: {e}")
+
+            # Forget calendars the user unsubscribed from
+            calendar_ids = {calendar['id'] for calendar in calendars}
+            with self._lock:
+                for calendar_id in set(self._sync_tokens) - calendar_ids:
+                    self._drop_calendar(calendar_id)
+                self._conn.commit()
+
+            if not failed:
+                self._last_sync = time.monotonic()
+            return changed
+
+    def record_event(self, calendar_id, event):
+        """
+        Add an event this process just created or changed, so it is visible before the next sync.
+        A cancelled event is removed.
+        """
+        formatted_event = format_event(event, self._calendar_names.get(calendar_id, 'Primary Calendar'))
+        key = (calendar_id, event['id'])
+        with self._lock:
+            if formatted_event is None:
+                self._unindex(key)
+                self._conn.execute("DELETE FROM calendar_events WHERE calendar_id = ? AND event_id = ?", key)
+            else:
+                self._index(key, formatted_event)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO calendar_events (calendar_id, event_id, data) VALUES (?, ?, ?)",
+                    (calendar_id, event['id'], json.dumps(formatted_event))
+                )
+            self._conn.commit()
+
+    def is_warm(self):
+        """True if the mirror has completed a sync within MAX_STALENESS seconds."""
+        return bool(self._last_sync) and time.monotonic() - self._last_sync < MAX_STALENESS
+
+    def covers(self, start_day, end_day):
+        """True if every calendar's mirror window holds the days from start_day to end_day (dates)."""
+        with self._lock:
+            return all(window[0] <= start_day.isoformat() and end_day.isoformat() <= window[1]
+                       for window in self._windows.values())
+
+    def calendar_count(self):
+        return len(self._sync_tokens)
+
+    def query(self, start_day, end_day):
+        """Return formatted events covering any day between start_day and end_day (inclusive dates)."""
+        keys = set()
+        with self._lock:
+            day = start_day
+            while day <= end_day:
+                keys.update(self._days.get(day.isoformat(), ()))
+                day += datetime.timedelta(days=1)
+            events = [self._events[key] for key in keys]
+        events.sort(key=lambda x: x['date'])
+        return events
+
+    def start_background_sync(self, interval=60):
+        """Keep the mirror current from a daemon thread, syncing every interval seconds."""
+        if self._sync_thread is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    changed = self.sync()
+                    if changed:
+                        print(f"Calendar mirror synced {changed} changed events")
+                except Exception as e:
+                    print(f"Calendar mirror sync error: {e}")
+                time.sleep(interval)
+
+        self._sync_thread = threading.Thread(target=run, name='calendar-sync', daemon=True)
+        self._sync_thread.start()
+
+
+_event_stores = {}
+_event_store_lock = threading.Lock()
+
+
+def get_event_store():
+    """Return the EventStore of the current account, opening it on first use."""
+    account = current_account()
+    with _event_store_lock:
+        if account.name not in _event_stores:
+            _event_stores[account.name] = EventStore(account.db_path, account)
+        return _event_stores[account.name]
+
+
+def get_warm_event_store(start_day=None, end_day=None):
+    """
+    Return the current account's EventStore if it is open and recently synced, and its window
+    holds the days from start_day to end_day (dates) when they are given, otherwise None.
+    """
+    store = _event_stores.get(current_account().name)
+    if store is None or not store.is_warm():
+        return None
+    if start_day is not None and not store.covers(start_day, end_day or start_day):
+        return None
+    return store
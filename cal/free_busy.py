@@ -0,0 +1,135 @@
+import datetime
+
+from langchain_core.tools import tool
+
+from util import IST, get_date_range, parse_date_string
+from auth import get_service
+from ratelimit import execute
+from cal.event_store import get_warm_event_store
+from cal.util import get_calendars
+
+# freebusy().query accepts at most 50 calendars per request
+MAX_CALENDARS_PER_QUERY = 50
+
+
+def get_busy_intervals(time_min, time_max, calendar_ids=None):
+    """
+    Return the busy intervals of every calendar between time_min and time_max (aware datetimes).
+
+    Only event times are transferred, no event bodies. Events marked as "free" in Calendar
+    don't count as busy.
+
+    Returns:
+        list: Dictionaries with start, end (ISO strings) and calendar, sorted by start.
+    """
+    if calendar_ids is None:
+        calendar_ids = [calendar['id'] for calendar in get_calendars()]
+
+    service = get_service("calendar", "v3")
+    intervals = []
+
+    for i in range(0, len(calendar_ids), MAX_CALENDARS_PER_QUERY):
+        result = execute(service.freebusy().query(body={
+            'timeMin': time_min.isoformat(),
+            'timeMax': time_max.isoformat(),
+            'timeZone': 'Asia/Kolkata',
+            'items': [{'id': calendar_id} for calendar_id in calendar_ids[i:i + MAX_CALENDARS_PER_QUERY]]
+        }), 'calendar')
+
+        for calendar_id, calendar in result.get('calendars', {}).items():
+            for error in calendar.get('errors', []):
+                print(f"FreeBusy error for {calendar_id}: {error.get('reason')}")
+            for busy in calendar.get('busy', []):
+                intervals.append({'start': busy['start'], 'end': busy['end'], 'calendar': calendar_id})
+
+    intervals.sort(key=lambda x: x['start'])
+    return intervals
+
+
+def get_busy_days(intervals):
+    """Return the sorted YYYY-MM-DD days (IST) touched by the given busy intervals."""
+    days = set()
+    for interval in intervals:
+        start = datetime.datetime.fromisoformat(interval['start']).astimezone(IST)
+        end = datetime.datetime.fromisoformat(interval['end']).astimezone(IST)
+        day = start.date()
+        # The end is exclusive, an interval ending at midnight doesn't touch the next day
+        last_day = (end - datetime.timedelta(microseconds=1)).date() if end > start else day
+        while day <= last_day:
+            days.add(day.isoformat())
+            day += datetime.timedelta(days=1)
+    return sorted(days)
+
+
+def _has_events(time_min, time_max):
+    """True if any calendar has an event between time_min and time_max, marked free or not."""
+    service = get_service("calendar", "v3")
+    for calendar in get_calendars():
+        result = execute(service.events().list(
+            calendarId=calendar['id'],
+            timeMin=time_min.isoformat(),
+            timeMax=time_max.isoformat(),
+            singleEvents=True,
+            showDeleted=False,
+            maxResults=1
+        ), 'calendar')
+        if result.get('items'):
+            return True
+    return False
+
+
+def is_day_busy(date):
+    """
+    Deterministic occupancy check: True if any calendar has an event on date (YYYY-MM-DD).
+
+    Events marked as free count too, like the all-day events Calendar creates as free by
+    default, so the answer is the same whether it comes from the mirror or the API.
+    """
+    day = datetime.date.fromisoformat(date)
+    store = get_warm_event_store(day)
+    if store is not None:
+        return bool(store.query(day, day))
+
+    start_date, end_date = get_date_range(date, 0, 0)
+    return _has_events(start_date, end_date)
+
+
+@tool
+def check_free_busy(date_str: str) -> dict:
+    """Check whether days already have events, across all calendars, in a single cheap request.
+
+    Prefer this over read_calendar when you only need to know if a day is occupied;
+    use read_calendar when you need the event titles or details. Events marked as free,
+    like most all-day events, don't count as busy here; read_calendar lists them.
+
+    Args:
+        date_str: 'YYYY-MM-DD/before=X/after=Y', the same format as read_calendar
+                  (use before=0/after=0 for a single day)
+
+    Returns:
+        Dictionary with date_range, busy (bool), busy_days (list of YYYY-MM-DD)
+        and intervals (list of {'start', 'end', 'calendar'}).
+    """
+    try:
+        date, days_before, days_after = parse_date_string(date_str)
+        start_date, end_date = get_date_range(date, days_before, days_after)
+    except Exception as e:
+        return {"error": f"Invalid date format: {str(e)}. Use YYYY-MM-DD/before=X/after=Y"}
+
+    try:
+        intervals = get_busy_intervals(start_date, end_date)
+    except Exception as e:
+        return {"error": f"Calendar API error: {str(e)}"}
+
+    busy_days = get_busy_days(intervals)
+    print(f"\nBusy days between {start_date.date()} and {end_date.date()-datetime.timedelta(days=1)}: {busy_days}")
+
+    return {
+        'date_range': {
+            'start': start_date.date().isoformat(),
+            'end': (end_date.date()-datetime.timedelta(days=1)).isoformat()
+        },
+        'busy': bool(intervals),
+        'busy_days': busy_days,
+        'intervals': intervals
+    }
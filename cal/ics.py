@@ -0,0 +1,403 @@
+import datetime
+import re
+import zoneinfo
+
+from auth import get_service
+from ratelimit import execute
+from cal.create_event import delete_event, insert_events, update_event
+from util import IST
+
+# Recurrence properties are passed to Calendar as raw iCalendar lines
+_RECURRENCE_PROPERTIES = {'RRULE', 'EXRULE', 'RDATE', 'EXDATE'}
+_DURATION_RE = re.compile(
+    r'^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$')
+_TEXT_ESCAPES = {'n': '\n', 'N': '\n', ',': ',', ';': ';', '\\': '\\'}
+_TEXT_ESCAPE_RE = re.compile(r'\\(.)')
+
+# Outlook writes Windows zone names in TZID, Calendar only accepts IANA names
+_WINDOWS_TIMEZONES = {
+    'India Standard Time': 'Asia/Kolkata',
+    'UTC': 'UTC',
+    'GMT Standard Time': 'Europe/London',
+    'W. Europe Standard Time': 'Europe/Berlin',
+    'Central Europe Standard Time': 'Europe/Budapest',
+    'Romance Standard Time': 'Europe/Paris',
+    'Eastern Standard Time': 'America/New_York',
+    'Central Standard Time': 'America/Chicago',
+    'Mountain Standard Time': 'America/Denver',
+    'Pacific Standard Time': 'America/Los_Angeles',
+    'Singapore Standard Time': 'Asia/Singapore',
+    'China Standard Time': 'Asia/Shanghai',
+    'Tokyo Standard Time': 'Asia/Tokyo',
+    'AUS Eastern Standard Time': 'Australia/Sydney',
+    'Arabian Standard Time': 'Asia/Dubai',
+}
+
+
+def _unfold(text):
+    """Join folded content lines (RFC 5545 3.1)."""
+    lines = []
+    for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n'):
+        if line[:1] in (' ', '\t') and lines:
+            lines[-1] += line[1:]
+        elif line:
+            lines.append(line)
+    return lines
+
+
+def _parse_line(line):
+    """Split a content line into (name, params, value), honouring quoted parameter values."""
+    in_quotes = False
+    for i, char in enumerate(line):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ':' and not in_quotes:
+            head, value = line[:i], line[i + 1:]
+            break
+    else:
+        return None
+
+    name, *raw_params = head.split(';')
+    params = {}
+    for raw_param in raw_params:
+        key, _, param_value = raw_param.partition('=')
+        params[key.upper()] = param_value.strip('"')
+    return name.upper(), params, value
+
+
+def _unescape(value):
+    return _TEXT_ESCAPE_RE.sub(lambda m: _TEXT_ESCAPES.get(m.group(1), m.group(1)), value)
+
+
+def parse_ics(text):
+    """
+    Parse the VEVENTs of an iCalendar document.
+
+    Returns:
+        tuple: (method, vevents) where each vevent maps a property name to a list of
+               (params, value, raw_line) tuples. Nested components (VALARM) are ignored.
+    """
+    method = None
+    vevents = []
+    current = None
+    nested = 0
+
+    for line in _unfold(text):
+        parsed = _parse_line(line)
+        if parsed is None:
+            continue
+        name, params, value = parsed
+
+        if name == 'BEGIN':
+            if value.upper() == 'VEVENT' and current is None:
+                current = {}
+            elif current is not None:
+                nested += 1
+        elif name == 'END':
+            if current is not None and nested:
+                nested -= 1
+            elif current is not None and value.upper() == 'VEVENT':
+                vevents.append(current)
+                current = None
+        elif current is not None and not nested:
+            current.setdefault(name, []).append((params, value, line))
+        elif name == 'METHOD':
+            method = value.upper()
+
+    return method, vevents
+
+
+def _first(vevent, name):
+    values = vevent.get(name)
+    return values[0] if values else None
+
+
+def _text(vevent, name):
+    prop = _first(vevent, name)
+    return _unescape(prop[1]) if prop else ''
+
+
+def _timezone_name(tzid):
+    tzid = _WINDOWS_TIMEZONES.get(tzid, tzid)
+    try:
+        zoneinfo.ZoneInfo(tzid)
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        return None
+    return tzid
+
+
+def _convert_time(prop):
+    """Convert a DTSTART/DTEND property into create_event's start/end format."""
+    params, value, _ = prop
+    value = value.strip()
+
+    if params.get('VALUE') == 'DATE' or len(value) == 8:
+        return f'{value[:4]}-{value[4:6]}-{value[6:8]}'
+
+    local = f'{value[:4]}-{value[4:6]}-{value[6:8]}T{value[9:11]}:{value[11:13]}:{value[13:15]}'
+    if value.endswith('Z'):
+        return {'dateTime': local + 'Z', 'timeZone': 'UTC'}
+
+    timezone = _timezone_name(params.get('TZID', ''))
+    if timezone:
+        return {'dateTime': local, 'timeZone': timezone}
+    # Floating time or unknown zone, create_event treats it as IST
+    return local
+
+
+def _apply_duration(start, duration):
+    match = _DURATION_RE.match(duration.strip())
+    if not match:
+        return start
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    delta = datetime.timedelta(weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0),
+                               minutes=int(minutes or 0), seconds=int(seconds or 0))
+    if sign == '-':
+        delta = -delta
+
+    if isinstance(start, str) and 'T' not in start:
+        return (datetime.date.fromisoformat(start) + delta).isoformat()
+
+    local = start['dateTime'] if isinstance(start, dict) else start
+    suffix = 'Z' if local.endswith('Z') else ''
+    end = (datetime.datetime.fromisoformat(local.rstrip('Z')) + delta).strftime('%Y-%m-%dT%H:%M:%S') + suffix
+    return dict(start, dateTime=end) if isinstance(start, dict) else end
+
+
+def event_key(vevent):
+    """
+    Identify a VEVENT across imports: its UID, plus its RECURRENCE-ID for an override of one
+    instance of a recurring event, which shares the UID of the series. '' if it has no UID.
+    """
+    uid = _text(vevent, 'UID')
+    recurrence_id = _first(vevent, 'RECURRENCE-ID')
+    if uid and recurrence_id is not None:
+        return f"{uid}#{recurrence_id[1]}"
+    return uid
+
+
+def vevent_to_event_data(vevent):
+    """Map a parsed VEVENT onto the event_data format of create_event, None if it has no start."""
+    dtstart = _first(vevent, 'DTSTART')
+    if dtstart is None:
+        return None
+    start = _convert_time(dtstart)
+
+    dtend = _first(vevent, 'DTEND')
+    duration = _first(vevent, 'DURATION')
+    if dtend is not None:
+        end = _convert_time(dtend)
+    elif duration is not None:
+        end = _apply_duration(start, duration[1])
+    elif isinstance(start, str) and 'T' not in start:
+        # All-day events without an end last one day
+        end = _apply_duration(start, 'P1D')
+    else:
+        end = start
+
+    event_data = {
+        'summary': _text(vevent, 'SUMMARY') or 'No title',
+        'start': start,
+        'end': end,
+    }
+
+    description = _text(vevent, 'DESCRIPTION')
+    if description:
+        event_data['description'] = description
+    location = _text(vevent, 'LOCATION')
+    if location:
+        event_data['location'] = location
+
+    recurrence = [prop[2] for name in _RECURRENCE_PROPERTIES for prop in vevent.get(name, [])]
+    if recurrence:
+        event_data['recurrence'] = recurrence
+
+    attendees = []
+    for params, value, _ in vevent.get('ATTENDEE', []):
+        if value.lower().startswith('mailto:'):
+            attendee = {'email': value[7:]}
+            if params.get('CN'):
+                attendee['displayName'] = params['CN']
+            attendees.append(attendee)
+    if attendees:
+        event_data['attendees'] = attendees
+
+    key = event_key(vevent)
+    if key:
+        private = {'icalUid': key}
+        sequence = _text(vevent, 'SEQUENCE')
+        if sequence.isdigit():
+            private['icalSequence'] = sequence
+        event_data['extendedProperties'] = {'private': private}
+
+    return event_data
+
+
+def event_days(event_data):
+    """Return the YYYY-MM-DD day an event_data starts on, as a one-element set."""
+    start = event_data['start']
+    value = start.get('dateTime', start.get('date', '')) if isinstance(start, dict) else start
+    return {value[:10]} if value else set()
+
+
+def find_existing_event(key):
+    """Return an existing primary-calendar event for this event_key, None if there is none."""
+    service = get_service("calendar", "v3")
+    # Gmail adds invitations to the calendar on its own, those keep the UID as iCalUID. It also
+    # applies the overrides of the series it added, so those count as existing too.
+    uid = key.split('#', 1)[0]
+    existing = execute(service.events().list(calendarId='primary', iCalUID=uid, showDeleted=False), 'calendar')
+    if existing.get('items'):
+        return existing['items'][0]
+    # Events inserted from an .ics file by us carry the key as a private property
+    existing = execute(service.events().list(
+        calendarId='primary', privateExtendedProperty=f'icalUid={key}', showDeleted=False
+    ), 'calendar')
+    if existing.get('items'):
+        return existing['items'][0]
+    return None
+
+
+def _private(event):
+    return event.get('extendedProperties', {}).get('private', {})
+
+
+def _instant(time):
+    """Comparable form of an event_data or Calendar API start/end: a date string or an aware datetime."""
+    if isinstance(time, dict):
+        if 'date' in time:
+            return time['date']
+        value, timezone = time.get('dateTime', ''), time.get('timeZone')
+    elif 'T' not in time:
+        return time
+    else:
+        value, timezone = time, None
+    dt = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=zoneinfo.ZoneInfo(timezone) if timezone else IST)
+    return dt
+
+
+def _is_newer(event_data, existing):
+    """True if event_data, from an invite, changes an existing event: a higher SEQUENCE or other times."""
+    sequence = int(_private(event_data).get('icalSequence', 0))
+    if sequence > int(_private(existing).get('icalSequence', 0)):
+        return True
+    return any(_instant(event_data[field]) != _instant(existing.get(field, {})) for field in ('start', 'end'))
+
+
+def find_series_instance(vevent):
+    """
+    For an override of one instance of a recurring event (a VEVENT with RECURRENCE-ID), return
+    that instance of the series in the primary calendar if this code imported the series, else None.
+    """
+    uid = _text(vevent, 'UID')
+    recurrence_id = _first(vevent, 'RECURRENCE-ID')
+    if not uid or recurrence_id is None:
+        return None
+
+    service = get_service("calendar", "v3")
+    series = execute(service.events().list(
+        calendarId='primary', privateExtendedProperty=f'icalUid={uid}', showDeleted=False
+    ), 'calendar')
+    series = [event for event in series.get('items', []) if event.get('recurrence')]
+    if not series:
+        return None
+
+    original_start = _instant(_convert_time(recurrence_id))
+    instances = execute(service.events().instances(
+        calendarId='primary',
+        eventId=series[0]['id'],
+        originalStart=original_start if isinstance(original_start, str) else original_start.isoformat(),
+        showDeleted=False
+    ), 'calendar')
+    items = instances.get('items')
+    return items[0] if items else None
+
+
+def _apply_to_existing(existing, event_data, cancelled, force=False):
+    """
+    Bring an event this code imported earlier in line with a newer invite for it, or with an
+    override of one of its instances (force). Returns the result.
+    """
+    summary = event_data['summary']
+    if cancelled:
+        return delete_event(existing)
+    if not force and not _is_newer(event_data, existing):
+        return {'status': 'skipped', 'summary': summary, 'reason': 'duplicate UID',
+                'event_link': existing.get('htmlLink')}
+    # The update replaces the event, keep what the insert recorded besides the invite's own properties
+    event_data['extendedProperties'] = {'private': dict(_private(existing), **_private(event_data))}
+    return update_event(existing['id'], event_data)
+
+
+def _ingest_vevent(vevent, event_data, cancelled):
+    """Handle a VEVENT that may already be in the calendar. Returns the result, None if it should be inserted."""
+    summary = event_data['summary']
+    key = event_key(vevent)
+    existing = find_existing_event(key) if key else None
+    if existing is not None:
+        print(f"Event {summary!r} (UID {key}) already in calendar: {existing.get('htmlLink')}")
+        if _private(existing).get('icalUid') == key:
+            return _apply_to_existing(existing, event_data, cancelled)
+        return {'status': 'skipped', 'summary': summary, 'reason': 'duplicate UID',
+                'event_link': existing.get('htmlLink')}
+
+    # An override of a series imported here changes that instance, it isn't an event of its own
+    instance = find_series_instance(vevent) if key else None
+    if instance is not None:
+        print(f"Applying override {key} of {summary!r} to its instance: {instance.get('htmlLink')}")
+        return _apply_to_existing(instance, event_data, cancelled, force=True)
+
+    if cancelled:
+        return {'status': 'skipped', 'summary': summary, 'reason': 'cancelled'}
+    return None
+
+
+def ingest_ics(ics_texts, source_id=None):
+    """
+    Create calendar events straight from iCalendar parts, without the agent.
+
+    Events get deterministic IDs derived from their UID (with the RECURRENCE-ID for overrides of
+    a recurring event, or source_id and position when they have no UID), so importing the same
+    invite twice can't create a duplicate. An event imported earlier is updated when the invite
+    reschedules it (higher SEQUENCE or other times) and deleted when the invite cancels it.
+    Events Gmail added to the calendar itself are left to Gmail.
+
+    Overrides of one instance of a recurring event are handled after the series are inserted,
+    and change the matching instance of a series imported here. Only overrides of a series that
+    isn't in the calendar become events of their own.
+
+    Returns:
+        list: One result per VEVENT, in order: the insert_events, update_event or delete_event result,
+              or a 'skipped' status with the reason.
+    """
+    vevents = []
+    for ics_text in ics_texts:
+        method, parsed = parse_ics(ics_text)
+        for vevent in parsed:
+            event_data = vevent_to_event_data(vevent)
+            if event_data is not None:
+                cancelled = method == 'CANCEL' or _text(vevent, 'STATUS').upper() == 'CANCELLED'
+                vevents.append((vevent, event_data, cancelled))
+
+    results = [None] * len(vevents)
+    for overrides in (False, True):
+        to_insert = []
+        for position, (vevent, event_data, cancelled) in enumerate(vevents, 1):
+            if (_first(vevent, 'RECURRENCE-ID') is not None) != overrides:
+                continue
+            result = _ingest_vevent(vevent, event_data, cancelled)
+            if result is not None:
+                results[position - 1] = result
+                continue
+            key = event_key(vevent)
+            if key or source_id:
+                event_data['source_message_id'] = key or f"{source_id}#{position}"
+            to_insert.append((position - 1, event_data))
+
+        if to_insert:
+            inserted = insert_events([event_data for _, event_data in to_insert])
+            for (index, _), result in zip(to_insert, inserted):
+                results[index] = result
+    return results
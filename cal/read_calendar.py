@@ -1,10 +1,55 @@
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 from langchain_core.tools import tool
-from googleapiclient.discovery import build
 
-from util import parse_date_string
-from auth import check_auth
+from util import get_date_range, parse_date_string
+from auth import get_service
+from ratelimit import execute
+from cal.event_store import get_warm_event_store
+from cal.util import format_event, get_calendars
+
+# Upper bound on concurrent events().list requests
+MAX_WORKERS = 8
+
+# Long-lived pool so each worker thread keeps its cached Calendar client between calls
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='read-calendar')
+
+
+def _read_single_calendar(calendar, time_min, time_max):
+    """List every event of one calendar in the range, following pagination."""
+    calendar_id = calendar['id']
+    calendar_name = calendar.get('summary', 'Unnamed Calendar')
+    service = get_service("calendar", "v3")
+    events = []
+    page_token = None
+
+    try:
+        while True:
+            events_result = execute(service.events().list(
+                calendarId=calendar_id,
+                timeMin=time_min,
+                timeMax=time_max,
+                singleEvents=True,
+                orderBy="startTime",
+                showDeleted=False,
+                pageToken=page_token
+            ), 'calendar')
+
+            for event in events_result.get('items', []):
+                formatted_event = format_event(event, calendar_name)
+                if formatted_event is not None:
+                    events.append(formatted_event)
+
+            page_token = events_result.get('nextPageToken')
+            if not page_token:
+                break
+    except Exception as e:
+        print(f"\nError accessing cal {calendar_name}: {e}")
+
+    print(f"Found {len(events)} events in {calendar_name} ({calendar_id})")
+    return events
+
 
 @tool
 def read_calendar(date_str: str) -> list:
@@ -14,93 +59,37 @@ def read_calendar(date_str: str) -> list:
     except Exception as e:
         return [{"error": f"Invalid date format: {str(e)}. Use YYYY-MM-DD/before=X/after=Y"}]
 
-    creds = check_auth()
-
-    if creds is None:
-        return ["Proper credentials not found. Please authenticate first."]
-
-
     try:
-        service = build("calendar", "v3", credentials=creds)
         all_events = []
 
-        tz = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
         try:
-            central_date = datetime.datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=tz)
+            start_date, end_date = get_date_range(date, days_before, days_after)
         except ValueError:
             return [{"error": "Invalid date format. Please use YYYY-MM-DD"}]
 
-        start_date = (central_date - datetime.timedelta(days=days_before)).replace(
-            hour=0, minute=0, second=0, microsecond=0)
-        end_date = (central_date + datetime.timedelta(days=days_after + 1)).replace(
-            hour=0, minute=0, second=0, microsecond=0)
-
         print(f"\nSearching events from {start_date.date()} to {end_date.date()-datetime.timedelta(days=1)}")
 
-        try:
-            calendar_list = service.calendarList().list(
-                minAccessRole="reader",
-                showHidden=True
-            ).execute()
-            calendars = calendar_list.get('items', [])
-            print(f"\nFound {len(calendars)} calendars:")
-            for cal in calendars:
-                print(f" - {cal.get('summary', 'Unnamed')} (ID: {cal['id']})")
-        except Exception as e:
-            print(f"\nError getting calendars: {e}")
-            calendars = []
-
-        calendars.insert(0, {'id': 'primary', 'summary': 'Primary Calendar'})
-
-        for calendar in calendars:
-            calendar_id = calendar['id']
-            calendar_name = calendar.get('summary', 'Unnamed Calendar')
-            print(f"\nChecking cal: {calendar_name} ({calendar_id})")
-
-            try:
-                events_result = service.events().list(
-                    calendarId=calendar_id,
-                    timeMin=start_date.isoformat(),
-                    timeMax=end_date.isoformat(),
-                    singleEvents=True,
-                    orderBy="startTime",
-                    showDeleted=False
-                ).execute()
-
-                events = events_result.get('items', [])
-                print(f"Found {len(events)} events in {calendar_name}")
-
-                for event in events:
-                    # Skip cancelled events
-                    if event.get('status') == 'cancelled':
-                        continue
-
-                    start = event.get('start', {})
-                    end = event.get('end', {})
-
-                    event_date = start.get('dateTime', start.get('date'))
-                    if not event_date:
-                        continue
-
-                    formatted_event = {
-                        'summary': event.get('summary', 'No title'),
-                        'start': start,
-                        'end': end,
-                        'calendar': calendar_name,
-                        'date': event_date[:10],
-                        'description': event.get('description', '')[:100] + '...' if event.get('description') else '',
-                        'location': event.get('location', ''),
-                        'status': event.get('status', 'confirmed')
-                    }
-                    all_events.append(formatted_event)
-
-                    if 'thug life' in formatted_event['summary'].lower():
-                        print("\nFOUND THUG LIFE EVENT:")
-                        print(formatted_event)
-
-            except Exception as e:
-                print(f"\nError accessing cal {calendar_name}: {e}")
-                continue
+        first_day, last_day = start_date.date(), end_date.date() - datetime.timedelta(days=1)
+        store = get_warm_event_store(first_day, last_day)
+        if store is not None:
+            # Answer from the local mirror, no API round trip needed
+            all_events = store.query(first_day, last_day)
+            calendars_checked = store.calendar_count()
+        else:
+            calendars = get_calendars()
+            calendars_checked = len(calendars)
+
+            futures = [
+                _executor.submit(_read_single_calendar, calendar, start_date.isoformat(), end_date.isoformat())
+                for calendar in calendars
+            ]
+            for future in futures:
+                all_events.extend(future.result())
+
+        for formatted_event in all_events:
+            if 'thug life' in formatted_event['summary'].lower():
+                print("\nFOUND THUG LIFE EVENT:")
+                print(formatted_event)
 
         if not all_events:
             return [{
@@ -109,7 +98,7 @@ def read_calendar(date_str: str) -> list:
                     'start': start_date.date().isoformat(),
                     'end': (end_date.date()-datetime.timedelta(days=1)).isoformat()
                 },
-                'calendars_checked': len(calendars),
+                'calendars_checked': calendars_checked,
                 'note': 'Try expanding the date range or check if the event exists in another cal'
             }]
 
@@ -123,4 +112,4 @@ def read_calendar(date_str: str) -> list:
         return all_events
 
     except Exception as e:
-        return [{"error": f"Calendar API error: {str(e)}"}]
\ No newline at end of file
+        return [{"error": f"Calendar API error: {str(e)}"}]
@@ -0,0 +1,94 @@
+import threading
+import time
+
+from accounts import current_account
+from auth import get_service
+from ratelimit import execute
+
+# How long the calendar list is reused before asking the API again (in seconds)
+CALENDAR_LIST_TTL = 300
+
+# Calendar list of each account, keyed by account name
+_calendar_caches = {}
+_calendar_caches_lock = threading.Lock()
+
+
+def get_calendars(raise_errors=False):
+    """
+    Return the de-duplicated list of readable calendars, cached for CALENDAR_LIST_TTL seconds.
+
+    If the lookup fails the primary calendar alone is returned, unless raise_errors is set.
+    """
+    with _calendar_caches_lock:
+        cache = _calendar_caches.setdefault(
+            current_account().name, {'items': None, 'expires_at': 0.0, 'lock': threading.Lock()})
+
+    # Each account has its own lock, so a slow lookup for one account doesn't hold up the others
+    with cache['lock']:
+        if cache['items'] is not None and time.monotonic() < cache['expires_at']:
+            return cache['items']
+
+        service = get_service("calendar", "v3")
+        calendars = []
+        page_token = None
+        try:
+            while True:
+                calendar_list = execute(service.calendarList().list(
+                    minAccessRole="reader",
+                    showHidden=True,
+                    pageToken=page_token
+                ), 'calendar')
+                calendars.extend(calendar_list.get('items', []))
+                page_token = calendar_list.get('nextPageToken')
+                if not page_token:
+                    break
+        except Exception as e:
+            if raise_errors:
+                raise
+            print(f"\nError getting calendars: {e}")
+            # Don't cache a failed lookup, fall back to the primary calendar only
+            return [{'id': 'primary', 'summary': 'Primary Calendar'}]
+
+        # The primary calendar shows up in the list under its real ID, only add the alias if it is missing
+        if not any(cal.get('primary') for cal in calendars):
+            calendars.insert(0, {'id': 'primary', 'summary': 'Primary Calendar'})
+
+        unique_calendars = []
+        seen = set()
+        for cal in calendars:
+            if cal['id'] not in seen:
+                seen.add(cal['id'])
+                unique_calendars.append(cal)
+
+        print(f"\nFound {len(unique_calendars)} calendars:")
+        for cal in unique_calendars:
+            print(f" - {cal.get('summary', 'Unnamed')} (ID: {cal['id']})")
+
+        cache['items'] = unique_calendars
+        cache['expires_at'] = time.monotonic() + CALENDAR_LIST_TTL
+        return unique_calendars
+
+
+def format_event(event, calendar_name):
+    """Convert a Calendar API event into the shape returned by read_calendar, None if it should be skipped."""
+    # Skip cancelled events
+    if event.get('status') == 'cancelled':
+        return None
+
+    start = event.get('start', {})
+    end = event.get('end', {})
+
+    event_date = start.get('dateTime', start.get('date'))
+    if not event_date:
+        return None
+
+    return {
+        'summary': event.get('summary', 'No title'),
+        'start': start,
+        'end': end,
+        'calendar': calendar_name,
+        'date': event_date[:10],
+        'description': event.get('description', '')[:100] + '...' if event.get('description') else '',
+        'location': event.get('location', ''),
+        'status': event.get('status', 'confirmed')
+    }
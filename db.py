@@ -0,0 +1,12 @@
+import sqlite3
+
+# Local state (calendar mirror, checkpoints, caches) lives in one SQLite file next to token.json
+DB_PATH = "automated_manager.db"
+
+
+def connect(path=DB_PATH):
+    """Open a SQLite connection that can be shared between threads (callers serialize access)."""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
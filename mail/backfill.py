@@ -0,0 +1,285 @@
+import argparse
+import datetime
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from accounts import current_account, load_accounts, set_default_account, use_account
+from db import connect
+from mail.checkpoint import get_checkpoint
+from mail.mail_callback import DEFAULT_MODE, MAX_WORKERS, MODES, email_callback
+from mail.mail_watcher import DEFAULT_BATCH_SIZE, fetch_messages, unfetchable
+from mail.pipeline import _with_gmail
+from ratelimit import execute, set_rate_share
+from util import IST
+
+# messages().list returns at most 500 IDs per page
+LIST_PAGE_SIZE = 500
+# Emails fetched and handed to email_callback at a time
+CHUNK_SIZE = 50
+# Share of the API rate limits a backfill takes; the live watcher must be started with
+# --rate-share for the rest, limits aren't coordinated between processes
+DEFAULT_RATE_SHARE = 0.5
+
+
+def build_query(query=None, after=None, before=None):
+    """
+    Combine a Gmail search query with a date range (YYYY-MM-DD, IST, before is exclusive)
+    into one messages().list query.
+    """
+    terms = [query] if query else []
+    for operator, day in (('after', after), ('before', before)):
+        if day:
+            midnight = datetime.datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=IST)
+            # Gmail reads YYYY/MM/DD in Pacific time, epoch seconds are unambiguous
+            terms.append(f'{operator}:{int(midnight.timestamp())}')
+    return ' '.join(terms)
+
+
+class BackfillProgress:
+    """
+    Persistent progress of backfill jobs: how far messages().list got (its page token) and
+    which listed messages are still pending. A job is identified by its query, so running
+    the same backfill again resumes it.
+    """
+
+    def __init__(self, db_path=None):
+        self._conn = connect(db_path) if db_path else connect()
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS backfill_jobs ("
+                "job_id TEXT PRIMARY KEY, query TEXT, page_token TEXT, listed INTEGER, "
+                "listing_done INTEGER, started_at REAL, updated_at REAL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS backfill_messages ("
+                "job_id TEXT, message_id TEXT, position INTEGER, status TEXT, outcome TEXT, "
+                "PRIMARY KEY (job_id, message_id))"
+            )
+            self._conn.commit()
+
+    def start(self, query):
+        """Register the job for query, if it is new. Returns its job ID."""
+        job_id = hashlib.sha1(query.encode('utf-8')).hexdigest()[:16]
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "INSERT OR IGNORE INTO backfill_jobs "
+                "(job_id, query, page_token, listed, listing_done, started_at, updated_at) "
+                "VALUES (?, ?, NULL, 0, 0, ?, ?)",
+                (job_id, query, now, now)
+            )
+            self._conn.commit()
+        return job_id
+
+    def listing_state(self, job_id):
+        """Return (page_token, listing_done) to continue listing from."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT page_token, listing_done FROM backfill_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+        return row[0], bool(row[1])
+
+    def record_page(self, job_id, message_ids, next_page_token):
+        """Atomically store a listed page as pending messages and the token of the next page."""
+        with self._lock:
+            listed = self._conn.execute("SELECT listed FROM backfill_jobs WHERE job_id = ?", (job_id,)).fetchone()[0]
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO backfill_messages (job_id, message_id, position, status, outcome) "
+                "VALUES (?, ?, ?, 'pending', '')",
+                [(job_id, message_id, listed + i) for i, message_id in enumerate(message_ids)]
+            )
+            self._conn.execute(
+                "UPDATE backfill_jobs SET page_token = ?, listed = ?, listing_done = ?, updated_at = ? "
+                "WHERE job_id = ?",
+                (next_page_token, listed + len(message_ids), int(not next_page_token), time.time(), job_id)
+            )
+            self._conn.commit()
+
+    def pending_ids(self, job_id):
+        """Return the pending message IDs of the job in listing order."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT message_id FROM backfill_messages WHERE job_id = ? AND status = 'pending' ORDER BY position",
+                (job_id,)
+            )]
+
+    def mark_done(self, job_id, message_id, outcome=''):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE backfill_messages SET status = 'done', outcome = ? WHERE job_id = ? AND message_id = ?",
+                (str(outcome or ''), job_id, message_id)
+            )
+            self._conn.commit()
+
+    def stats(self, job_id):
+        with self._lock:
+            listed, listing_done = self._conn.execute(
+                "SELECT listed, listing_done FROM backfill_jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            done = self._conn.execute(
+                "SELECT COUNT(*) FROM backfill_messages WHERE job_id = ? AND status = 'done'", (job_id,)
+            ).fetchone()[0]
+        return {'listed': listed, 'listing_done': bool(listing_done), 'done': done}
+
+
+def get_backfill_progress():
+    """Return the BackfillProgress of the current account."""
+    return BackfillProgress(current_account().db_path)
+
+
+def _list_page(service, query, page_token):
+    return execute(service.users().messages().list(
+        userId='me',
+        q=query,
+        maxResults=LIST_PAGE_SIZE,
+        pageToken=page_token
+    ), 'gmail')
+
+
+def _fetch(message_ids, batch_size):
+    """Fetch message_ids, returning (emails, failures) like mail_watcher.fetch_messages."""
+    failures = {}
+    return _with_gmail(fetch_messages, message_ids, batch_size, failures), failures
+
+
+def _process(job_id, emails, progress, checkpoint, workers, mode):
+    outcomes = email_callback(emails, max_workers=workers, mode=mode) or {}
+    for email in emails:
+        outcome = outcomes.get(email['id'], '')
+        progress.mark_done(job_id, email['id'], outcome)
+        # Shared with the watcher's ledger, so neither handles the message again
+        checkpoint.mark_done(email['id'], outcome)
+
+
+def run_backfill(query=None, after=None, before=None, workers=MAX_WORKERS, mode=DEFAULT_MODE,
+                 batch_size=DEFAULT_BATCH_SIZE, rate_share=DEFAULT_RATE_SHARE, limit=None):
+    """
+    Run existing inbox mail matched by a Gmail query and/or date range through the same
+    parse and extraction pipeline as new mail, for the account the process works for
+    (see accounts.set_default_account, the worker threads don't inherit use_account).
+
+    Pages of message IDs are listed and saved before they are processed, so an interrupted
+    backfill resumes where it stopped when it is run again with the same arguments. Messages
+    the watcher (or an earlier backfill) already processed are skipped. The next chunk is
+    fetched while the current one is processed, by up to workers emails at a time.
+    Messages that fail to load, unless they were deleted, stay pending for the next run.
+
+    Args:
+        query (str): Gmail search query, e.g. 'in:inbox has:attachment'.
+        after, before (str): YYYY-MM-DD range (IST), before is exclusive.
+        workers (int): Emails processed concurrently.
+        mode (str): Processing mode, see mail_callback.process_email; 'batch' saves most LLM calls.
+        batch_size (int): Messages per Gmail batch request.
+        rate_share (float): Share of the API rate limits to use, None leaves them as they are. Start the
+                            live watcher with --rate-share for the rest, processes don't share limits.
+        limit (int): Stop after processing this many messages in this run.
+
+    Returns:
+        dict: listed, listing_done and done counts of the job, and failed, the messages of this
+              run that failed to load and are left for the next one.
+    """
+    if rate_share is not None:
+        set_rate_share(rate_share)
+    query = build_query(query, after, before)
+    progress = get_backfill_progress()
+    checkpoint = get_checkpoint()
+    job_id = progress.start(query)
+    print(f"Backfill {job_id} for query {query!r}: {progress.stats(job_id)}")
+
+    processed = 0
+    # Messages that failed to load in this run, they stay pending for the next one
+    failed = set()
+    started = time.monotonic()
+    page_token, listing_done = progress.listing_state(job_id)
+
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='gmail') as fetcher:
+        while True:
+            pending = []
+            for message_id in progress.pending_ids(job_id):
+                if checkpoint.is_done(message_id):
+                    progress.mark_done(job_id, message_id, 'already processed')
+                elif message_id not in failed:
+                    pending.append(message_id)
+            if limit is not None:
+                pending = pending[:max(0, limit - processed)]
+
+            if not pending:
+                if listing_done or (limit is not None and processed >= limit):
+                    break
+                page = _with_gmail(_list_page, query, page_token)
+                page_token = page.get('nextPageToken')
+                listing_done = not page_token
+                progress.record_page(job_id, [msg['id'] for msg in page.get('messages', [])], page_token)
+                continue
+
+            chunks = [pending[i:i + CHUNK_SIZE] for i in range(0, len(pending), CHUNK_SIZE)]
+            future = fetcher.submit(_fetch, chunks[0], batch_size)
+            for i, chunk in enumerate(chunks):
+                emails, failures = future.result()
+                # Fetch the next chunk while this one is processed
+                if i + 1 < len(chunks):
+                    future = fetcher.submit(_fetch, chunks[i + 1], batch_size)
+
+                gone = dict(unfetchable(chunk, [email['id'] for email in emails], failures))
+                for message_id, reason in gone.items():
+                    progress.mark_done(job_id, message_id, reason)
+                # Rate limited past the retries or a server error, worth another try on the next run
+                failed.update(message_id for message_id in failures if message_id not in gone)
+                if emails:
+                    _process(job_id, emails, progress, checkpoint, workers, mode)
+
+                processed += len(chunk)
+                elapsed = time.monotonic() - started
+                print(f"Backfill {job_id}: {processed} messages this run, "
+                      f"{processed / elapsed:.1f}/s, {len(failed)} failed, {progress.stats(job_id)}")
+
+    stats = dict(progress.stats(job_id), failed=len(failed))
+    finished = stats['listing_done'] and stats['done'] >= stats['listed']
+    print(f"Backfill {job_id} {'finished' if finished else 'stopped, run it again to continue'}: {stats}")
+    return stats
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create calendar events from mail already in the inbox")
+    parser.add_argument("--query", help="Gmail search query, e.g. 'in:inbox'")
+    parser.add_argument("--after", help="first day to backfill (YYYY-MM-DD)")
+    parser.add_argument("--before", help="day to stop before (YYYY-MM-DD)")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS, help="emails processed concurrently")
+    parser.add_argument("--mode", choices=MODES, default='batch',
+                        help="processing mode, see main.py; 'batch' needs the fewest LLM calls")
+    parser.add_argument("--rate-share", type=float, default=DEFAULT_RATE_SHARE,
+                        help="share of the API rate limits to use; start the watcher with the rest")
+    parser.add_argument("--limit", type=int, help="stop after this many messages (run again to continue)")
+    parser.add_argument("--accounts",
+                        help="directory or JSON config of several accounts (see main.py), backfilled one after another")
+    parser.add_argument("--account", help="only backfill the account of this name from --accounts")
+    args = parser.parse_args()
+
+    # The job is identified by its query, so a range relative to today wouldn't resume on another day
+    if not args.query and not args.after and not args.before:
+        parser.error("give --query and/or --after/--before, e.g. --after 2024-05-01")
+    if args.account and not args.accounts:
+        parser.error("--account needs --accounts")
+
+    accounts = [None]
+    if args.accounts:
+        accounts = [account for account in load_accounts(args.accounts)
+                    if not args.account or account.name == args.account]
+        if not accounts:
+            parser.error(f"no account named {args.account} in {args.accounts}")
+
+    # Once for all accounts, set_rate_share scales the current limits
+    set_rate_share(args.rate_share)
+    for account in accounts:
+        if account is None:
+            run_backfill(query=args.query or 'in:inbox', after=args.after, before=args.before, workers=args.workers,
+                         mode=args.mode, rate_share=None, limit=args.limit)
+            continue
+        print(f"Backfilling account {account.name}")
+        # One account at a time, so the threads of email_callback can use a process-wide account
+        set_default_account(account)
+        with use_account(account):
+            run_backfill(query=args.query or 'in:inbox', after=args.after, before=args.before, workers=args.workers,
+                         mode=args.mode, rate_share=None, limit=args.limit)
@@ -0,0 +1,157 @@
+import threading
+import time
+
+from accounts import current_account
+from db import connect
+
+# Processed message IDs are remembered this long (in seconds), well past Gmail's history retention
+LEDGER_RETENTION = 30 * 24 * 3600
+# Pending messages are retried this many times while the watcher runs, then given up
+MAX_RETRIES = 5
+# Delay before the first retry (in seconds), doubled for each one after it
+RETRY_DELAY = 30
+
+
+class Checkpoint:
+    """
+    Persistent watcher state: the last Gmail history ID and a ledger of message IDs.
+
+    Message IDs are recorded as pending, together with the history ID that revealed them,
+    and marked done once processed. A restart resumes from the stored history ID and
+    re-processes only pending messages, so no email is lost or handled twice. While the
+    watcher runs, messages left pending by a failed fetch are retried with retry_ids.
+    """
+
+    def __init__(self, db_path=None):
+        self._conn = connect(db_path) if db_path else connect()
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS watcher_state (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS processed_messages ("
+                "message_id TEXT PRIMARY KEY, status TEXT, outcome TEXT, updated_at REAL, "
+                "attempts INTEGER DEFAULT 0, retry_after REAL DEFAULT 0)"
+            )
+            # Ledgers created before retries were counted
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(processed_messages)")}
+            if 'attempts' not in columns:
+                self._conn.execute("ALTER TABLE processed_messages ADD COLUMN attempts INTEGER DEFAULT 0")
+                self._conn.execute("ALTER TABLE processed_messages ADD COLUMN retry_after REAL DEFAULT 0")
+            self._conn.execute(
+                "DELETE FROM processed_messages WHERE status = 'done' AND updated_at < ?",
+                (time.time() - LEDGER_RETENTION,)
+            )
+            self._conn.commit()
+
+    def _get_state(self, key):
+        row = self._conn.execute("SELECT value FROM watcher_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO watcher_state (key, value) VALUES (?, ?)", (key, value))
+
+    def get_history_id(self):
+        with self._lock:
+            return self._get_state('history_id')
+
+    def get_checkpoint_time(self):
+        """Return when the history ID was last saved (epoch seconds), None if never."""
+        with self._lock:
+            value = self._get_state('checkpoint_time')
+            return float(value) if value else None
+
+    def record_history(self, history_id, message_ids):
+        """
+        Atomically store a new history ID and the message IDs it revealed as pending.
+
+        Returns:
+            list: The message IDs that still need processing (already done ones are left out).
+        """
+        with self._lock:
+            now = time.time()
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO processed_messages (message_id, status, outcome, updated_at) "
+                "VALUES (?, 'pending', '', ?)",
+                [(message_id, now) for message_id in message_ids]
+            )
+            if history_id:
+                self._set_state('history_id', str(history_id))
+                self._set_state('checkpoint_time', str(now))
+            self._conn.commit()
+
+            done = set()
+            # Stay well below SQLite's limit on bound parameters
+            for i in range(0, len(message_ids), 500):
+                chunk = message_ids[i:i + 500]
+                done.update(row[0] for row in self._conn.execute(
+                    "SELECT message_id FROM processed_messages WHERE status = 'done' AND message_id IN (%s)"
+                    % ','.join('?' * len(chunk)), chunk
+                ))
+        return [message_id for message_id in message_ids if message_id not in done]
+
+    def pending_ids(self):
+        """Return the message IDs recorded but not processed yet, oldest first."""
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                "SELECT message_id FROM processed_messages WHERE status = 'pending' ORDER BY updated_at"
+            )]
+
+    def retry_ids(self, max_retries=MAX_RETRIES, exclude=()):
+        """
+        Return the pending message IDs due for another attempt, oldest first, and count the attempt.
+
+        Each retry waits twice as long as the one before it. Messages that were already retried
+        max_retries times are marked done as given up. Messages in exclude, e.g. ones still
+        queued for processing, are left alone.
+        """
+        with self._lock:
+            now = time.time()
+            rows = self._conn.execute(
+                "SELECT message_id, attempts FROM processed_messages "
+                "WHERE status = 'pending' AND retry_after <= ? ORDER BY updated_at",
+                (now,)
+            ).fetchall()
+            rows = [(message_id, attempts) for message_id, attempts in rows if message_id not in exclude]
+            retry = [(message_id, attempts) for message_id, attempts in rows if attempts < max_retries]
+            given_up = [message_id for message_id, attempts in rows if attempts >= max_retries]
+            self._conn.executemany(
+                "UPDATE processed_messages SET attempts = ?, retry_after = ? WHERE message_id = ?",
+                [(attempts + 1, now + RETRY_DELAY * 2 ** attempts, message_id) for message_id, attempts in retry]
+            )
+            self._conn.executemany(
+                "UPDATE processed_messages SET status = 'done', outcome = ?, updated_at = ? WHERE message_id = ?",
+                [(f"gave up after {max_retries} retries", now, message_id) for message_id in given_up]
+            )
+            self._conn.commit()
+        for message_id in given_up:
+            print(f"Giving up on message {message_id} after {max_retries} retries")
+        return [message_id for message_id, _ in retry]
+
+    def is_done(self, message_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status FROM processed_messages WHERE message_id = ?", (message_id,)
+            ).fetchone()
+            return bool(row) and row[0] == 'done'
+
+    def mark_done(self, message_id, outcome=''):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO processed_messages (message_id, status, outcome, updated_at) "
+                "VALUES (?, 'done', ?, ?)",
+                (message_id, str(outcome or ''), time.time())
+            )
+            self._conn.commit()
+
+
+_checkpoints = {}
+_checkpoint_lock = threading.Lock()
+
+
+def get_checkpoint():
+    """Return the Checkpoint of the current account, opening it on first use."""
+    account = current_account()
+    with _checkpoint_lock:
+        if account.name not in _checkpoints:
+            _checkpoints[account.name] = Checkpoint(account.db_path)
+        return _checkpoints[account.name]
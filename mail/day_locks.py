@@ -0,0 +1,45 @@
+import threading
+from contextlib import contextmanager
+
+
+class DayLocks:
+    """
+    Serializes work that targets the same calendar days.
+
+    Work holding a set of days runs concurrently with work on other days. Work that can't name
+    its days holds every day: it waits for everything else to finish and runs alone.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._held = set()
+        self._active = 0
+        self._exclusive = False
+        self._exclusive_waiting = 0
+
+    @contextmanager
+    def hold(self, days):
+        days = set(days)
+        with self._cond:
+            if days:
+                # Waiting exclusive work goes first so it can't be starved by a stream of dated work
+                self._cond.wait_for(lambda: not self._exclusive and not self._exclusive_waiting
+                                    and self._held.isdisjoint(days))
+                self._held |= days
+            else:
+                self._exclusive_waiting += 1
+                self._cond.wait_for(lambda: not self._exclusive and self._active == 0)
+                self._exclusive_waiting -= 1
+                self._exclusive = True
+            self._active += 1
+
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                if days:
+                    self._held -= days
+                else:
+                    self._exclusive = False
+                self._cond.notify_all()
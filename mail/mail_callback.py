@@ -1,26 +1,228 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 
-from agent.agent import mailer_agent
+from agent.budget import compact_email
+from mail.day_locks import DayLocks
+from metrics import inc, observe, record_email_done
+from mail.prefilter import should_process
+from mail.result_cache import content_key, get_result_cache
+from util import email_date, extract_dates
 
+# Default number of emails handed to the agent at the same time
+MAX_WORKERS = 4
+# Processing modes, see process_email
+MODES = ('agent', 'extract', 'batch')
+DEFAULT_MODE = 'agent'
 
-def email_callback(new_emails):
-    """Example callback function to process new emails."""
-    print(f"\nNew emails received at {datetime.now()}:")
-    for email in new_emails:
-        print(email)
-        mailer_agent.invoke({"input":f"""
+day_locks = DayLocks()
+
+
+def process_invite(email):
+    """
+    Create events straight from the iCalendar parts of an email, without the agent.
+
+    Returns:
+        str: The outcome, or None if the parts held no usable events and the agent should handle the email.
+    """
+    # Imported here, like the agent stack: creating events loads LangChain for the create_event tool
+    from cal.ics import event_days, ingest_ics, parse_ics, vevent_to_event_data
+
+    days = set()
+    for ics_text in email['calendar']:
+        for vevent in parse_ics(ics_text)[1]:
+            event_data = vevent_to_event_data(vevent)
+            if event_data is not None:
+                days |= event_days(event_data)
+    if not days:
+        return None
+
+    with day_locks.hold(days):
+        try:
+            results = ingest_ics(email['calendar'], source_id=email.get('id'))
+        except Exception as e:
+            print(f"Error importing invite from email {email.get('id')}: {e}")
+            return None
+
+    print(f"Imported invite from email {email.get('id')}: {results}")
+    return "; ".join(
+        f"{result.get('status')}: {result.get('summary', '')} {result.get('event_link') or result.get('reason') or ''}".strip()
+        for result in results
+    )
+
+
+def run_agent(email):
+    """Let the tool-calling agent handle one email. Returns the outcome."""
+    # Imported here so the agent stack is only loaded once an email needs it
+    from agent.agent import get_mailer_agent
+    from agent.callbacks import metrics_callback
+    from cal.create_event import source_message
+
+    # Events the agent creates are keyed by the email in code, the model isn't trusted with it
+    with source_message(email.get('id')):
+        result = get_mailer_agent().invoke({"input":f"""
         GUARDRAILS:
          NEVER DUPLICATE ANY EVENT ON THAT PARTICULAR DAY
          ----------------------------------------------
-        Process the following email:
+        Process the following email, received on {email_date(email).isoformat()}
+        (resolve relative dates like "tomorrow" against that day, not today):
         {email}
         i have given you the contents of the email and you are asked to clean the email
         dont duplicate events 
         extract the required contents and create an event on that particular day of event 
-        check for any other events on that day 
+        check for any other events on that day with read_calendar (check_free_busy misses events marked free, like all-day events)
         if there are any other evets dont to anything
          if there are no events create an event with the details provided in the email 
          send me the link to the event created 
          You should and have to use tools not just get out easily
           you should also print a detailed response on what happened 
-        """})
\ No newline at end of file
+        """}, config={"callbacks": [metrics_callback]})
+    return str(result.get('output', ''))
+
+
+def screen_email(email):
+    """
+    Handle what needs no LLM: iCalendar invites and the prefilter. Emails that pass are
+    compacted to fit the prompt token budget, see agent.budget.
+
+    Returns:
+        tuple: (outcome, email) where outcome is None if the email still needs an LLM,
+               and email is the email to hand on to it.
+    """
+    if email.get('calendar'):
+        outcome = process_invite(email)
+        if outcome is not None:
+            return outcome, email
+        # Raw iCalendar text only bloats the prompt, the agent works from the body
+        email = {key: value for key, value in email.items() if key != 'calendar'}
+
+    passed, reason = should_process(email)
+    if not passed:
+        return f"skipped by prefilter: {reason}", email
+
+    email, before, after = compact_email(email)
+    if before > after:
+        print(f"[budget] email {email.get('id')}: {before} -> {after} body tokens ({before - after} saved)")
+        inc('prompt_tokens_saved_total', before - after)
+    return None, email
+
+
+def _email_days(email):
+    """Return (days, key): the days the email mentions, empty if vague, and its result cache key."""
+    reference = email_date(email)
+    days, vague = extract_dates(email.get('body', ''), reference)
+    # Without a definite set of days the email might target any day, so it runs alone;
+    # what its vague dates resolve to still depends on the day it was received
+    if vague:
+        return set(), content_key(email.get('body', ''), days | {reference.isoformat()})
+    return days, content_key(email.get('body', ''), days)
+
+
+def handle_email(email, mode=DEFAULT_MODE, extraction=None):
+    """
+    Run the LLM stage for one screened email while holding the calendar days it mentions.
+
+    extraction, in 'extract' mode, is a result extracted beforehand that replaces the LLM call.
+    """
+    # Copies of the same email name the same days, so the lock also orders their cache lookups
+    days, key = _email_days(email)
+    with day_locks.hold(days):
+        if key is not None:
+            cache = get_result_cache()
+            cached = cache.get(key)
+            if cached is not None:
+                print(f"Email {email.get('id')} repeats an already processed email, reusing its outcome "
+                      f"(cache: {cache.stats()})")
+                return f"cached: {cached}"
+
+        print(email)
+        started = time.monotonic()
+        try:
+            if mode == 'extract':
+                from agent.extractor import process_with_extraction
+                outcome = process_with_extraction(email, extraction)
+            else:
+                outcome = run_agent(email)
+        except Exception as e:
+            print(f"Error processing email {email.get('id')}: {e}")
+            return f"error: {e}"
+        elapsed = time.monotonic() - started
+        observe('stage_seconds', elapsed, stage='process', mode=mode)
+        print(f"Processed email {email.get('id')} in {elapsed:.2f}s ({mode} mode)")
+
+        # Errors may be temporary, the next copy gets a fresh try
+        if key is not None and not outcome.startswith('error'):
+            get_result_cache().put(key, outcome)
+        return outcome
+
+
+def process_email(email, mode=DEFAULT_MODE):
+    """
+    Process one email. Returns the outcome.
+
+    mode selects how events are extracted: 'agent' runs the tool-calling agent,
+    'extract' makes a single structured LLM call and checks and inserts in code.
+    'batch' only differs from 'extract' in email_callback, a single email is extracted on its own.
+    """
+    outcome, screened = screen_email(email)
+    if outcome is None:
+        outcome = handle_email(screened, 'agent' if mode == 'agent' else 'extract')
+    record_email_done(email, outcome)
+    return outcome
+
+
+def _batch_callback(new_emails, max_workers):
+    """email_callback for 'batch' mode: one extraction request for many emails."""
+    from agent.extractor import extract_events_batch
+
+    outcomes = {}
+    candidates = []
+    for email in new_emails:
+        outcome, screened = screen_email(email)
+        if outcome is None:
+            candidates.append(screened)
+        else:
+            outcomes[email['id']] = outcome
+
+    # Repeats of already processed emails are answered from the cache, don't pay for extracting them
+    cache = get_result_cache()
+    to_extract = [email for email in candidates
+                  if not cache.contains(_email_days(email)[1])]
+    extractions = extract_events_batch(to_extract) if to_extract else {}
+
+    # Emails the batch didn't cover get extraction=None and are extracted one by one
+    def handle(email):
+        return handle_email(email, 'extract', extractions.get(email['id']))
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='email') as executor:
+        for email, outcome in zip(candidates, executor.map(handle, candidates)):
+            outcomes[email['id']] = outcome
+
+    for email in new_emails:
+        record_email_done(email, outcomes.get(email['id']))
+    return outcomes
+
+
+def email_callback(new_emails, max_workers=MAX_WORKERS, mode=DEFAULT_MODE):
+    """
+    Process new emails in the given mode (see process_email), up to max_workers at a time.
+    In 'batch' mode the events of all emails are first extracted with as few LLM calls as possible.
+
+    Emails mentioning the same day are never processed concurrently, so the
+    "no duplicate event on a day" check still sees the result of the previous email.
+
+    Returns:
+        dict: The outcome of each email, keyed by message ID.
+    """
+    print(f"\nNew emails received at {datetime.now()}:")
+    if mode == 'batch':
+        return _batch_callback(new_emails, max_workers)
+
+    if max_workers <= 1 or len(new_emails) <= 1:
+        outcomes = [process_email(email, mode) for email in new_emails]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='email') as executor:
+            outcomes = list(executor.map(partial(process_email, mode=mode), new_emails))
+
+    return {email['id']: outcome for email, outcome in zip(new_emails, outcomes)}
@@ -1,43 +1,43 @@
 import time
 
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
-from auth import check_auth
+import metrics
+from auth import get_service
+from ratelimit import AdaptivePollInterval, execute, execute_batch
+from mail.checkpoint import get_checkpoint
 from mail.mail_callback import email_callback
-from mail.util import get_sender,get_simple_email_body
+from mail.util import get_calendar_parts,get_sender,get_simple_email_body,get_subject
 
+# Gmail accepts up to 100 calls per batch but recommends staying at or below 50
+DEFAULT_BATCH_SIZE = 50
 
-def watch_gmail(callback, check_interval=10):
-    """
-    Watch Gmail inbox for new messages and execute callback when new emails arrive.
 
-    Args:
-        callback (function): Function to call when new emails are detected.
-                            Receives list of email dictionaries with sender and body.
-        check_interval (int): How often to check for new emails (in seconds).
-    """
-    creds = check_auth()
-    service = build('gmail', 'v1', credentials=creds)
+def get_latest_history_id(service):
+    """Return the history ID of the most recent inbox message, None if the inbox is empty."""
+    results = execute(service.users().messages().list(
+        userId='me',
+        maxResults=1,
+        labelIds=['INBOX']
+    ), 'gmail')
 
-    # Get the initial history ID by getting the most recent message
+    if 'messages' in results and results['messages']:
+        message = execute(service.users().messages().get(
+            userId='me',
+            id=results['messages'][0]['id'],
+            format='metadata',
+            metadataHeaders=['from', 'subject']
+        ), 'gmail')
+        return message.get('historyId')
+    return None
+
+
+def get_initial_history_id(service):
+    """Return the history ID to start watching from, falling back to the current time."""
     try:
         # First get the latest message to get a valid historyId
-        results = service.users().messages().list(
-            userId='me',
-            maxResults=1,
-            labelIds=['INBOX']
-        ).execute()
-
-        if 'messages' in results and results['messages']:
-            message = service.users().messages().get(
-                userId='me',
-                id=results['messages'][0]['id'],
-                format='metadata',
-                metadataHeaders=['from', 'subject']
-            ).execute()
-            last_history_id = message.get('historyId')
-        else:
+        last_history_id = get_latest_history_id(service)
+        if last_history_id is None:
             # If no messages in inbox, start with current time
             last_history_id = str(int(time.time() * 1000))
 
@@ -46,68 +46,264 @@ def watch_gmail(callback, check_interval=10):
         # Fallback to current time if history ID can't be obtained
         last_history_id = str(int(time.time() * 1000))
 
-    print(f"Gmail watcher started. Using history ID: {last_history_id}")
+    return last_history_id
+
+
+def list_message_ids_since(service, since):
+    """Return the IDs of inbox messages received after since (epoch seconds), oldest first."""
+    message_ids = []
+    page_token = None
+
+    while True:
+        results = execute(service.users().messages().list(
+            userId='me',
+            labelIds=['INBOX'],
+            q=f'after:{int(since)}',
+            pageToken=page_token
+        ), 'gmail')
+        message_ids.extend(msg['id'] for msg in results.get('messages', []))
+        page_token = results.get('nextPageToken')
+        if not page_token:
+            break
+
+    message_ids.reverse()
+    return message_ids
+
+
+def iter_history_pages(service, start_history_id):
+    """
+    Page through the Gmail history since start_history_id, one request per page as the pages are consumed.
+
+    Yields:
+        tuple: (message_ids, history_id) for each page, where message_ids are the messages added on
+               the page that no earlier page reported, in order, and history_id is the latest history
+               ID reported by the API on the last page and None on the pages before it.
+    """
+    seen = set()
+    page_token = None
+
+    while True:
+        history = execute(service.users().history().list(
+            userId='me',
+            startHistoryId=start_history_id,
+            labelId='INBOX',
+            historyTypes=['messageAdded'],
+            pageToken=page_token
+        ), 'gmail')
+
+        message_ids = []
+        for h in history.get('history', []):
+            for msg in h.get('messagesAdded', []):
+                msg_id = msg['message']['id']
+                if msg_id not in seen:
+                    seen.add(msg_id)
+                    message_ids.append(msg_id)
+        metrics.inc('messages_seen_total', len(message_ids))
+
+        page_token = history.get('nextPageToken')
+        yield message_ids, None if page_token else history.get('historyId')
+        if not page_token:
+            break
+
+
+def list_new_message_ids(service, start_history_id):
+    """
+    Page through the Gmail history since start_history_id.
+
+    Returns:
+        tuple: (message_ids, history_id) where message_ids keeps the order in which
+               messages were added with duplicates removed, and history_id is the
+               latest history ID reported by the API (None if nothing was returned).
+    """
+    message_ids = []
+    history_id = None
+
+    with metrics.timed('history_poll'):
+        for page_ids, history_id in iter_history_pages(service, start_history_id):
+            message_ids.extend(page_ids)
+
+    return message_ids, history_id
+
+
+def _parse_message(service, msg_id, message):
+    """Turn a format='full' message into an email dictionary, None if it has no payload."""
+    if not message or 'payload' not in message:
+        return None
+
+    payload = message['payload']
+    headers = payload.get('headers', [])
+
+    def fetch_attachment(attachment_id):
+        # Only used for oversized text parts Gmail keeps out of the message payload
+        return execute(service.users().messages().attachments().get(
+            userId='me', messageId=msg_id, id=attachment_id
+        ), 'gmail').get('data')
+
+    with metrics.timed('body_parse'):
+        email = {
+            "sender": get_sender(headers),
+            "subject": get_subject(headers),
+            "body": get_simple_email_body(payload, fetch_attachment=fetch_attachment),
+            "labels": message.get('labelIds', []),
+            "id": msg_id,
+            "received_at": int(message.get('internalDate', 0)) / 1000 or None
+        }
+        calendars = get_calendar_parts(payload, fetch_attachment)
+        if calendars:
+            email["calendar"] = calendars
+    return email
+
+
+def iter_messages(service, message_ids, batch_size=DEFAULT_BATCH_SIZE, failures=None):
+    """
+    Fetch full messages like fetch_messages, one batch request at a time, and yield each email
+    as soon as it is parsed. Only the raw responses of the current batch are held, and each one
+    is dropped once parsed. failures, if given, receives the error of each message that failed to load.
+    """
+    for i in range(0, len(message_ids), batch_size):
+        chunk = message_ids[i:i + batch_size]
+        with metrics.timed('message_fetch'):
+            fetched = execute_batch(
+                service,
+                [(msg_id, service.users().messages().get(userId='me', id=msg_id, format='full')) for msg_id in chunk],
+                'gmail',
+                batch_size
+            )
+
+        for msg_id in chunk:
+            message, exception = fetched.pop(msg_id, (None, None))
+            if exception is not None:
+                print(f"Error fetching message {msg_id}: {exception}")
+                metrics.inc('messages_fetched_total', status='error')
+                if failures is not None:
+                    failures[msg_id] = exception
+                continue
+            email = _parse_message(service, msg_id, message)
+            if email is None:
+                continue
+            metrics.inc('messages_fetched_total', status='ok')
+            yield email
+
+
+def fetch_messages(service, message_ids, batch_size=DEFAULT_BATCH_SIZE, failures=None):
+    """
+    Fetch full messages through Gmail batch requests, batch_size messages per round trip.
+
+    Args:
+        failures (dict): If given, receives the error of each message that failed to load, keyed by message ID.
+
+    Returns:
+        list: Email dictionaries with sender, subject, body, labels, id and received_at (epoch seconds
+              of Gmail's internalDate), plus calendar, the iCalendar parts, when there are any,
+              in the order of message_ids.
+              Messages that failed to load or have no payload are skipped.
+    """
+    return list(iter_messages(service, message_ids, batch_size, failures))
+
+
+def unfetchable(message_ids, fetched_ids, failures):
+    """
+    Yield (message_id, reason) for the given messages that weren't fetched and never will be:
+    deleted ones (404) and ones without a payload. Other failures are worth retrying.
+    """
+    fetched = set(fetched_ids)
+    for msg_id in message_ids:
+        if msg_id in fetched:
+            continue
+        error = failures.get(msg_id)
+        if error is None:
+            yield msg_id, 'no payload'
+        elif isinstance(error, HttpError) and error.resp.status == 404:
+            yield msg_id, 'not found'
+
+
+def deliver_messages(service, callback, message_ids, batch_size, checkpoint):
+    """
+    Fetch the given messages, pass them to callback and mark them processed in the checkpoint.
+
+    Messages that failed to load for a reason other than being deleted stay pending and are
+    retried on a later poll, see Checkpoint.retry_ids.
+    """
+    failures = {}
+    messages = fetch_messages(service, message_ids, batch_size, failures)
+    for msg_id, reason in unfetchable(message_ids, [message['id'] for message in messages], failures):
+        checkpoint.mark_done(msg_id, reason)
+    if not messages:
+        return
+    outcomes = callback(messages) or {}
+    for message in messages:
+        checkpoint.mark_done(message['id'], outcomes.get(message['id'], ''))
+
+
+def watch_gmail(callback, check_interval=10, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Watch Gmail inbox for new messages and execute callback when new emails arrive.
+
+    Args:
+        callback (function): Function to call when new emails are detected.
+                            Receives list of email dictionaries with sender and body, and may
+                            return a dictionary of outcomes keyed by message ID for the ledger.
+        check_interval (int): How often to check for new emails (in seconds) while the inbox is idle
+                              at its normal pace; it tightens while mail is flowing, see AdaptivePollInterval.
+        batch_size (int): How many messages to fetch per Gmail batch request.
+    """
+    service = get_service('gmail', 'v1')
+    poll_interval = AdaptivePollInterval(check_interval)
+
+    checkpoint = get_checkpoint()
+
+    last_history_id = checkpoint.get_history_id()
+    if last_history_id is None:
+        last_history_id = get_initial_history_id(service)
+        checkpoint.record_history(last_history_id, [])
+        print(f"Gmail watcher started. Using history ID: {last_history_id}")
+    else:
+        print(f"Gmail watcher resumed from checkpointed history ID: {last_history_id}")
+
+    # Finish whatever the previous run had seen but not processed
+    pending_ids = checkpoint.pending_ids()
+    if pending_ids:
+        print(f"Resuming {len(pending_ids)} pending messages")
+        deliver_messages(service, callback, pending_ids, batch_size, checkpoint)
 
     while True:
         try:
+            # Messages that failed to load on an earlier poll
+            retry_ids = checkpoint.retry_ids()
+            if retry_ids:
+                print(f"Retrying {len(retry_ids)} pending messages")
+                deliver_messages(service, callback, retry_ids, batch_size, checkpoint)
+
             # Check for changes since last history ID
-            history = service.users().history().list(
-                userId='me',
-                startHistoryId=last_history_id,
-                labelId='INBOX'
-            ).execute()
-
-            if 'history' in history:
-                # Process new messages
-                messages = []
-                for h in history['history']:
-                    if 'messagesAdded' in h:
-                        for msg in h['messagesAdded']:
-                            message = service.users().messages().get(
-                                userId='me',
-                                id=msg['message']['id'],
-                                format='full'
-                            ).execute()
-
-                            if 'payload' not in message:
-                                continue
-
-                            payload = message['payload']
-                            headers = payload.get('headers', [])
-
-                            messages.append({
-                                "sender": get_sender(headers),
-                                "body": get_simple_email_body(payload),
-                                "id": msg['message']['id']
-                            })
-
-                if messages:
-                    callback(messages)
+            message_ids, new_history_id = list_new_message_ids(service, last_history_id)
+            # Persist the new position and the pending messages before doing any work on them
+            message_ids = checkpoint.record_history(new_history_id, message_ids)
+
+            if message_ids:
+                deliver_messages(service, callback, message_ids, batch_size, checkpoint)
 
+            if new_history_id:
                 # Update the last history ID
-                last_history_id = history['historyId']
+                last_history_id = new_history_id
 
-            time.sleep(check_interval)
+            time.sleep(poll_interval.next(bool(message_ids)))
 
         except HttpError as error:
             if error.resp.status == 404:
                 # History ID might be too old, get a new one
                 print("History ID not found, getting new history ID...")
-                results = service.users().messages().list(
-                    userId='me',
-                    maxResults=1,
-                    labelIds=['INBOX']
-                ).execute()
-                if 'messages' in results and results['messages']:
-                    message = service.users().messages().get(
-                        userId='me',
-                        id=results['messages'][0]['id'],
-                        format='metadata'
-                    ).execute()
-                    last_history_id = message.get('historyId')
+                checkpoint_time = checkpoint.get_checkpoint_time()
+                last_history_id = get_latest_history_id(service) or last_history_id
+                # Catch up on what arrived since the last checkpoint, skipping messages already handled
+                missed_ids = list_message_ids_since(service, checkpoint_time) if checkpoint_time else []
+                missed_ids = checkpoint.record_history(last_history_id, missed_ids)
+                if missed_ids:
+                    print(f"Catching up on {len(missed_ids)} messages")
+                    deliver_messages(service, callback, missed_ids, batch_size, checkpoint)
+                time.sleep(poll_interval.next(bool(missed_ids)))
             else:
                 print(f"An error occurred: {error}")
-            time.sleep(30)  # Wait before retrying
+                time.sleep(poll_interval.on_error(error))  # Wait before retrying
         except Exception as e:
             print(f"Unexpected error: {e}")
-            time.sleep(30)
\ No newline at end of file
+            time.sleep(poll_interval.on_error(e))
\ No newline at end of file
@@ -0,0 +1,194 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from googleapiclient.errors import HttpError
+
+import metrics
+import ratelimit
+from accounts import set_default_account, use_account
+from auth import get_credentials
+from cal.event_store import get_event_store
+from mail.checkpoint import get_checkpoint
+from mail.mail_callback import DEFAULT_MODE, MAX_WORKERS, email_callback
+from mail.mail_watcher import (DEFAULT_BATCH_SIZE, fetch_messages, get_initial_history_id,
+                               get_latest_history_id, list_message_ids_since, list_new_message_ids,
+                               unfetchable)
+from mail.pipeline import _with_gmail
+from ratelimit import AdaptivePollInterval
+
+# Emails of one account handed to a worker process at a time. Accounts sharing a worker
+# take turns chunk by chunk, so a burst in one account can't starve the others.
+CHUNK_SIZE = 20
+# Gmail calls of all accounts run on this many threads at most
+MAX_GMAIL_THREADS = 32
+
+
+def _init_worker(shard_count, rate_share=1.0):
+    # Workers are spawned with the default limits, give them the share of the parent
+    if rate_share < 1:
+        ratelimit.set_rate_share(rate_share)
+    # All worker processes share the project's Gemini quota
+    rate, capacity = ratelimit.RATE_LIMITS['gemini']
+    ratelimit.RATE_LIMITS['gemini'] = (rate / shard_count, max(1, capacity // shard_count))
+
+
+def _process_chunk(account, emails, mode, workers):
+    """
+    Run in a worker process: process emails of account. Returns the outcomes keyed by message ID
+    and the metrics the worker recorded since its last chunk, for the parent's /metrics.
+    """
+    # A worker runs one chunk at a time, so the threads of email_callback can use a process-wide account
+    set_default_account(account)
+    # Keeps the account's calendar mirror current in the worker that handles its emails
+    get_event_store().start_background_sync()
+    outcomes = email_callback(emails, max_workers=workers, mode=mode)
+    return outcomes, metrics.drain()
+
+
+async def _deliver(account, shard, message_ids, checkpoint, batch_size, mode, workers):
+    """
+    Fetch the given messages and process them on the account's worker, chunk by chunk.
+
+    Like mail_watcher.deliver_messages, deleted messages are marked done, while messages that
+    failed to load, or whose chunk failed in the worker, stay pending and are retried on a later
+    poll, see Checkpoint.retry_ids.
+    """
+    loop = asyncio.get_running_loop()
+    for i in range(0, len(message_ids), CHUNK_SIZE):
+        chunk = message_ids[i:i + CHUNK_SIZE]
+        failures = {}
+        emails = await asyncio.to_thread(_with_gmail, fetch_messages, chunk, batch_size, failures)
+        for message_id, reason in unfetchable(chunk, [email['id'] for email in emails], failures):
+            checkpoint.mark_done(message_id, reason)
+        if not emails:
+            continue
+        try:
+            outcomes, worker_metrics = await loop.run_in_executor(shard, _process_chunk, account, emails, mode, workers)
+        except Exception as e:
+            print(f"[{account.name}] Error processing {len(emails)} emails: {e}")
+            continue
+        metrics.merge(worker_metrics)
+        for email in emails:
+            checkpoint.mark_done(email['id'], outcomes.get(email['id'], ''))
+
+
+async def _watch_account(account, shard, check_interval, batch_size, mode, workers):
+    """Poll the Gmail history of one account and hand new emails to its worker."""
+    with use_account(account):
+        checkpoint = get_checkpoint()
+        poll_interval = AdaptivePollInterval(check_interval)
+
+        last_history_id = checkpoint.get_history_id()
+        if last_history_id is None:
+            last_history_id = await asyncio.to_thread(_with_gmail, get_initial_history_id)
+            checkpoint.record_history(last_history_id, [])
+            print(f"[{account.name}] Gmail watcher started. Using history ID: {last_history_id}")
+        else:
+            print(f"[{account.name}] Gmail watcher resumed from checkpointed history ID: {last_history_id}")
+
+        # Finish whatever the previous run had seen but not processed
+        pending_ids = checkpoint.pending_ids()
+        if pending_ids:
+            print(f"[{account.name}] Resuming {len(pending_ids)} pending messages")
+            await _deliver(account, shard, pending_ids, checkpoint, batch_size, mode, workers)
+
+        while True:
+            try:
+                # Messages that failed to load or to process on an earlier poll
+                retry_ids = checkpoint.retry_ids()
+                if retry_ids:
+                    print(f"[{account.name}] Retrying {len(retry_ids)} pending messages")
+                    await _deliver(account, shard, retry_ids, checkpoint, batch_size, mode, workers)
+
+                message_ids, new_history_id = await asyncio.to_thread(
+                    _with_gmail, list_new_message_ids, last_history_id)
+                # Persist the new position and the pending messages before doing any work on them
+                message_ids = checkpoint.record_history(new_history_id, message_ids)
+
+                if message_ids:
+                    await _deliver(account, shard, message_ids, checkpoint, batch_size, mode, workers)
+
+                if new_history_id:
+                    last_history_id = new_history_id
+                delay = poll_interval.next(bool(message_ids))
+
+            except HttpError as error:
+                if error.resp.status == 404:
+                    # History ID might be too old, get a new one
+                    print(f"[{account.name}] History ID not found, getting new history ID...")
+                    checkpoint_time = checkpoint.get_checkpoint_time()
+                    last_history_id = await asyncio.to_thread(_with_gmail, get_latest_history_id) or last_history_id
+                    # Catch up on what arrived since the last checkpoint, skipping messages already handled
+                    missed_ids = await asyncio.to_thread(
+                        _with_gmail, list_message_ids_since, checkpoint_time) if checkpoint_time else []
+                    missed_ids = checkpoint.record_history(last_history_id, missed_ids)
+                    if missed_ids:
+                        print(f"[{account.name}] Catching up on {len(missed_ids)} messages")
+                        await _deliver(account, shard, missed_ids, checkpoint, batch_size, mode, workers)
+                    delay = poll_interval.next(bool(missed_ids))
+                else:
+                    print(f"[{account.name}] An error occurred: {error}")
+                    delay = poll_interval.on_error(error)
+            except Exception as e:
+                print(f"[{account.name}] Unexpected error: {e}")
+                delay = poll_interval.on_error(e)
+
+            await asyncio.sleep(delay)
+
+
+async def run_accounts(accounts, shards=None, check_interval=10, batch_size=DEFAULT_BATCH_SIZE,
+                       mode=DEFAULT_MODE, workers=MAX_WORKERS, rate_share=1.0):
+    """
+    Watch several Gmail accounts from one process.
+
+    History polls of every account are scheduled on one event loop, with the blocking Gmail
+    calls on a shared thread pool. Emails are processed in a pool of worker processes; each
+    account is pinned to one worker, so its emails never race each other on a calendar day,
+    and accounts sharing a worker take turns in chunks of CHUNK_SIZE.
+
+    Args:
+        accounts (list): Account objects, see accounts.load_accounts.
+        shards (int): Worker processes, by default one per CPU (never more than accounts).
+        check_interval (int): How often to poll each account while its inbox is idle (in seconds).
+        batch_size (int): How many messages to fetch per Gmail batch request.
+        mode (str): Processing mode, see mail_callback.process_email.
+        workers (int): Emails each worker process handles concurrently.
+        rate_share (float): Share of the API rate limits to use, see ratelimit.set_rate_share.
+    """
+    if not accounts:
+        raise ValueError("No accounts to watch")
+    shards = max(1, min(shards or os.cpu_count() or 1, len(accounts)))
+
+    # Authenticate every account up front, an interactive login can't happen once polling runs
+    for account in accounts:
+        with use_account(account):
+            get_credentials()
+        print(f"Authenticated account {account.name}")
+
+    loop = asyncio.get_running_loop()
+    gmail_executor = ThreadPoolExecutor(max_workers=min(MAX_GMAIL_THREADS, 2 * len(accounts)),
+                                        thread_name_prefix='gmail')
+    loop.set_default_executor(gmail_executor)
+
+    # Workers are spawned rather than forked, forking a process with running threads isn't safe
+    context = multiprocessing.get_context('spawn')
+    executors = [
+        ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=_init_worker, initargs=(shards, rate_share))
+        for _ in range(shards)
+    ]
+    print(f"Watching {len(accounts)} accounts with {shards} worker processes")
+
+    tasks = [
+        asyncio.create_task(_watch_account(account, executors[i % shards], check_interval, batch_size, mode, workers))
+        for i, account in enumerate(accounts)
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        for executor in executors:
+            executor.shutdown(wait=False, cancel_futures=True)
+        gmail_executor.shutdown(wait=False)
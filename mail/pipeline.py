@@ -0,0 +1,190 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from googleapiclient.errors import HttpError
+
+from auth import get_service
+from mail.checkpoint import get_checkpoint
+from ratelimit import AdaptivePollInterval
+from mail.mail_callback import MAX_WORKERS, process_email
+from mail.mail_watcher import (DEFAULT_BATCH_SIZE, fetch_messages, get_initial_history_id,
+                               get_latest_history_id, list_message_ids_since, list_new_message_ids,
+                               unfetchable)
+
+# Message IDs are tiny, so the poller can run far ahead of the agent before it has to wait
+ID_QUEUE_SIZE = 1000
+
+
+def _with_gmail(func, *args):
+    """Run func with the Gmail client of the current thread (clients can't be shared across threads)."""
+    return func(get_service('gmail', 'v1'), *args)
+
+
+async def _queue_ids(id_queue, queued, message_ids):
+    """Queue message IDs for fetching, remembering them in queued until they leave the pipeline."""
+    for message_id in message_ids:
+        queued.add(message_id)
+        # Blocks only if the fetch stage is ID_QUEUE_SIZE messages behind
+        await id_queue.put(message_id)
+
+
+async def _poll_history(executor, id_queue, check_interval, checkpoint, queued):
+    """
+    Stage 1: poll the Gmail history on its own schedule and queue new message IDs, along with
+    the pending messages that failed to load earlier and are due for a retry.
+    """
+    loop = asyncio.get_running_loop()
+    poll_interval = AdaptivePollInterval(check_interval)
+
+    last_history_id = checkpoint.get_history_id()
+    if last_history_id is None:
+        last_history_id = await loop.run_in_executor(executor, _with_gmail, get_initial_history_id)
+        checkpoint.record_history(last_history_id, [])
+        print(f"Gmail pipeline started. Using history ID: {last_history_id}")
+    else:
+        print(f"Gmail pipeline resumed from checkpointed history ID: {last_history_id}")
+
+    # Finish whatever the previous run had seen but not processed
+    await _queue_ids(id_queue, queued, checkpoint.pending_ids())
+
+    while True:
+        started = time.monotonic()
+        try:
+            # Messages that failed to load earlier; the ones still in the pipeline are pending too
+            retry_ids = checkpoint.retry_ids(exclude=queued)
+            if retry_ids:
+                print(f"Retrying {len(retry_ids)} pending messages")
+                await _queue_ids(id_queue, queued, retry_ids)
+
+            message_ids, new_history_id = await loop.run_in_executor(
+                executor, _with_gmail, list_new_message_ids, last_history_id)
+            # Persist the new position and the pending messages before queueing them
+            message_ids = checkpoint.record_history(new_history_id, message_ids)
+            await _queue_ids(id_queue, queued, message_ids)
+
+            if new_history_id:
+                last_history_id = new_history_id
+
+        except HttpError as error:
+            if error.resp.status == 404:
+                # History ID might be too old, get a new one
+                print("History ID not found, getting new history ID...")
+                checkpoint_time = checkpoint.get_checkpoint_time()
+                last_history_id = await loop.run_in_executor(
+                    executor, _with_gmail, get_latest_history_id) or last_history_id
+                # Catch up on what arrived since the last checkpoint, skipping messages already handled
+                missed_ids = await loop.run_in_executor(
+                    executor, _with_gmail, list_message_ids_since, checkpoint_time) if checkpoint_time else []
+                await _queue_ids(id_queue, queued, checkpoint.record_history(last_history_id, missed_ids))
+                message_ids = missed_ids
+            else:
+                print(f"An error occurred: {error}")
+                await asyncio.sleep(poll_interval.on_error(error))  # Wait before retrying
+                continue
+        except Exception as e:
+            print(f"Unexpected error: {e}")
+            await asyncio.sleep(poll_interval.on_error(e))
+            continue
+
+        # Keep the schedule: the time spent polling counts towards the interval
+        interval = poll_interval.next(bool(message_ids))
+        await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
+async def _fetch_messages(executor, id_queue, email_queue, batch_size, checkpoint, queued):
+    """
+    Stage 2: fetch and parse queued messages in batches and queue the parsed emails.
+
+    Deleted messages and ones without a payload are marked done. Messages that failed to load
+    for another reason leave the pipeline but stay pending, stage 1 queues them again once they
+    are due for a retry, see Checkpoint.retry_ids.
+    """
+    loop = asyncio.get_running_loop()
+
+    while True:
+        message_ids = [await id_queue.get()]
+        while len(message_ids) < batch_size and not id_queue.empty():
+            message_ids.append(id_queue.get_nowait())
+
+        failures = {}
+        try:
+            messages = await loop.run_in_executor(
+                executor, _with_gmail, fetch_messages, message_ids, batch_size, failures)
+        except Exception as e:
+            print(f"Error fetching messages {message_ids}: {e}")
+            messages = []
+        else:
+            for message_id, reason in unfetchable(message_ids, [message['id'] for message in messages], failures):
+                checkpoint.mark_done(message_id, reason)
+
+        fetched_ids = {message['id'] for message in messages}
+        queued.difference_update(message_id for message_id in message_ids if message_id not in fetched_ids)
+
+        for message in messages:
+            # Blocks while the agent workers are busy, which keeps parsed bodies out of memory
+            await email_queue.put(message)
+
+        for _ in message_ids:
+            id_queue.task_done()
+
+
+async def _process_emails(executor, email_queue, processor, checkpoint, queued):
+    """Stage 3: hand parsed emails to the processor, one at a time per worker."""
+    loop = asyncio.get_running_loop()
+
+    while True:
+        email = await email_queue.get()
+        try:
+            outcome = await loop.run_in_executor(executor, processor, email)
+            checkpoint.mark_done(email['id'], outcome)
+        except Exception as e:
+            print(f"Error processing email {email.get('id')}: {e}")
+            checkpoint.mark_done(email['id'], f"error: {e}")
+        finally:
+            queued.discard(email['id'])
+            email_queue.task_done()
+
+
+async def run_pipeline(processor=process_email, check_interval=10, batch_size=DEFAULT_BATCH_SIZE,
+                       workers=MAX_WORKERS):
+    """
+    Watch Gmail with separate polling, fetching and processing stages connected by bounded queues.
+
+    Polling runs on its own schedule no matter how long the processor takes; when the later
+    stages fall behind, the queues fill up and push back on the stage before them.
+
+    Args:
+        processor (function): Called with one email dictionary at a time, from a worker thread.
+                              Its return value is stored as the outcome in the checkpoint ledger.
+        check_interval (int): How often to poll the Gmail history (in seconds) while the inbox is idle,
+                              see AdaptivePollInterval.
+        batch_size (int): How many messages to fetch per Gmail batch request.
+        workers (int): How many emails are processed concurrently.
+    """
+    checkpoint = get_checkpoint()
+    id_queue = asyncio.Queue(maxsize=ID_QUEUE_SIZE)
+    email_queue = asyncio.Queue(maxsize=workers)
+    # IDs somewhere between the two queues and the processor, all touched from the event loop only
+    queued = set()
+
+    # Separate pools so slow processing can never hold up the Gmail calls
+    gmail_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='gmail')
+    agent_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='email')
+
+    tasks = [
+        asyncio.create_task(_poll_history(gmail_executor, id_queue, check_interval, checkpoint, queued)),
+        asyncio.create_task(_fetch_messages(gmail_executor, id_queue, email_queue, batch_size, checkpoint, queued)),
+    ]
+    tasks.extend(
+        asyncio.create_task(_process_emails(agent_executor, email_queue, processor, checkpoint, queued))
+        for _ in range(workers)
+    )
+
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        gmail_executor.shutdown(wait=False)
+        agent_executor.shutdown(wait=False)
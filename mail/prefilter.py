@@ -0,0 +1,105 @@
+import json
+import os
+import re
+
+from util import _TIME_RE, email_date, extract_dates
+
+# Optional JSON file overriding any of the DEFAULT_RULES keys
+RULES_FILE = "prefilter.json"
+
+DEFAULT_RULES = {
+    # Substrings matched against the lowercased sender; allow wins over deny
+    "allow_senders": [],
+    "deny_senders": [],
+    # Gmail label IDs, e.g. CATEGORY_PROMOTIONS or a user label ID
+    "allow_labels": [],
+    "deny_labels": ["SPAM", "TRASH"],
+    # Emails scoring below this never reach the agent
+    "threshold": 2,
+}
+
+_EVENT_PHRASE_RE = re.compile(
+    r'\b(meeting|meet\.google\.com|zoom\.us|teams\.microsoft\.com|webinar|workshop|seminar|conference|'
+    r'interview|session|event|invit(?:e|ation)|rsvp|join us|scheduled?|venue|agenda|appointment|'
+    r'deadline|hackathon|lecture|class|exam|ceremony|party|reminder)\b', re.IGNORECASE)
+_NO_EVENT_PHRASE_RE = re.compile(
+    r'\b(otp|one[- ]time password|verification code|security code|password reset|'
+    r'your (?:order|receipt|invoice|payment)|order (?:#|no\.?|number)|transaction|statement is ready|'
+    r'has been (?:credited|debited)|sign[- ]in attempt)\b', re.IGNORECASE)
+
+
+def load_rules(path=RULES_FILE):
+    """Return DEFAULT_RULES updated with the rules file, if there is one."""
+    rules = dict(DEFAULT_RULES)
+    if os.path.exists(path):
+        with open(path) as f:
+            rules.update(json.load(f))
+    return rules
+
+
+_rules = load_rules()
+
+
+def score_email(email):
+    """
+    Score how likely an email is to describe an event, from cheap local signals.
+
+    Returns:
+        tuple: (score, signals) where signals lists what contributed to the score.
+    """
+    text = f"{email.get('subject', '')}\n{email.get('body', '')}"
+    score = 0
+    signals = []
+
+    days, vague = extract_dates(text, email_date(email))
+    if days:
+        score += 2
+        signals.append(f"dates={len(days)}")
+    elif vague:
+        score += 1
+        signals.append("relative-date")
+
+    if _TIME_RE.search(text):
+        score += 1
+        signals.append("time")
+
+    phrases = {match.lower() for match in _EVENT_PHRASE_RE.findall(text)}
+    if phrases:
+        score += min(len(phrases), 2)
+        signals.append("phrases=" + ",".join(sorted(phrases)[:5]))
+
+    negative = {match.lower() for match in _NO_EVENT_PHRASE_RE.findall(text)}
+    if negative:
+        score -= 3
+        signals.append("no-event=" + ",".join(sorted(negative)[:5]))
+
+    return score, signals
+
+
+def should_process(email, rules=None):
+    """
+    Decide whether an email is worth an agent run, and log the decision.
+
+    Returns:
+        tuple: (passed, reason)
+    """
+    rules = rules or _rules
+    sender = email.get('sender', '').lower()
+    labels = set(email.get('labels', []))
+
+    if any(pattern.lower() in sender for pattern in rules['allow_senders']):
+        passed, reason = True, "allowed sender"
+    elif labels & set(rules['allow_labels']):
+        passed, reason = True, "allowed label"
+    elif any(pattern.lower() in sender for pattern in rules['deny_senders']):
+        passed, reason = False, "denied sender"
+    elif labels & set(rules['deny_labels']):
+        passed, reason = False, "denied label"
+    else:
+        score, signals = score_email(email)
+        passed = score >= rules['threshold']
+        reason = f"score={score} [{'; '.join(signals)}]"
+
+    print(f"[prefilter] {'PASS' if passed else 'SKIP'} id={email.get('id')} "
+          f"sender={email.get('sender', '')!r} subject={email.get('subject', '')!r} {reason}")
+    return passed, reason
@@ -0,0 +1,132 @@
+import hashlib
+import re
+import threading
+import time
+
+from accounts import current_account
+from db import connect
+
+# Cached outcomes are reused for this long (in seconds)
+CACHE_TTL = 14 * 24 * 3600
+# Least recently used entries are evicted beyond this many
+MAX_ENTRIES = 5000
+# Bodies shorter than this carry too little content to be told apart safely
+MIN_BODY_CHARS = 40
+
+_QUOTE_PREFIX_RE = re.compile(r'(?m)^[>\s]+')
+_EMAIL_ADDRESS_RE = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def content_key(body, days=()):
+    """
+    Hash an email body so copies of the same announcement share a key: quote markers,
+    email addresses, case and whitespace are ignored. Returns None for bodies too short to key.
+
+    days are the YYYY-MM-DD days the body resolves to. They are part of the key, so the same
+    template sent again a week later ("Standup tomorrow at 10am") doesn't hit the old entry.
+    """
+    text = _QUOTE_PREFIX_RE.sub('', body)
+    text = _EMAIL_ADDRESS_RE.sub('', text)
+    text = _WHITESPACE_RE.sub(' ', text).strip().lower()
+    if len(text) < MIN_BODY_CHARS:
+        return None
+    text += '\n' + ','.join(sorted(days))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Persistent LRU cache, with a TTL, of processing outcomes keyed by content_key()."""
+
+    def __init__(self, db_path=None, max_entries=MAX_ENTRIES, ttl=CACHE_TTL):
+        self._conn = connect(db_path) if db_path else connect()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS result_cache ("
+                "key TEXT PRIMARY KEY, outcome TEXT, created_at REAL, last_used REAL, hits INTEGER)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS result_cache_last_used ON result_cache (last_used)")
+            self._conn.commit()
+
+    def get(self, key):
+        """Return the cached outcome for key, None on a miss."""
+        with self._lock:
+            now = time.time()
+            row = self._conn.execute(
+                "SELECT outcome, created_at FROM result_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and row[1] + self.ttl < now:
+                self._conn.execute("DELETE FROM result_cache WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                row = None
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE result_cache SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def contains(self, key):
+        """True if key has an unexpired entry. Unlike get(), doesn't count as a lookup."""
+        if key is None:
+            return False
+        with self._lock:
+            row = self._conn.execute("SELECT created_at FROM result_cache WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] + self.ttl >= time.time()
+
+    def put(self, key, outcome):
+        with self._lock:
+            now = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO result_cache (key, outcome, created_at, last_used, hits) "
+                "VALUES (?, ?, ?, ?, 0)",
+                (key, outcome, now, now)
+            )
+            # Expired entries go first, then the least recently used ones beyond max_entries
+            cursor = self._conn.execute("DELETE FROM result_cache WHERE created_at < ?", (now - self.ttl,))
+            self.evictions += cursor.rowcount
+            cursor = self._conn.execute(
+                "DELETE FROM result_cache WHERE key IN ("
+                "SELECT key FROM result_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.evictions += cursor.rowcount
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM result_cache").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'evictions': self.evictions,
+        }
+
+
+_result_caches = {}
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Return the ResultCache of the current account, opening it on first use."""
+    # Outcomes name events in the account's own calendar, so they can't be shared between accounts
+    account = current_account()
+    with _result_cache_lock:
+        if account.name not in _result_caches:
+            _result_caches[account.name] = ResultCache(account.db_path)
+        return _result_caches[account.name]
@@ -0,0 +1,220 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from googleapiclient.errors import HttpError
+
+import metrics
+from auth import get_service
+from mail.checkpoint import get_checkpoint
+from mail.mail_callback import MAX_WORKERS, process_email
+from mail.mail_watcher import (DEFAULT_BATCH_SIZE, get_initial_history_id, get_latest_history_id,
+                               iter_history_pages, iter_messages, list_message_ids_since, unfetchable)
+from ratelimit import AdaptivePollInterval
+
+# Characters of a body an EmailRecord keeps, below the 20000 mail.util reads. The prompt budget
+# (agent.budget, about 6000 characters) uses fewer, the rest leaves room for the quoted thread
+# its date lines are taken from
+MAX_BODY_CHARS = 8000
+# Characters of iCalendar parts an EmailRecord keeps in total; an invite is a few kilobytes,
+# a cut part still yields its complete VEVENTs
+MAX_CALENDAR_CHARS = 64000
+
+
+def _bound_calendar(parts, max_chars):
+    """Keep iCalendar parts up to max_chars characters in total, cutting the one that crosses it."""
+    kept = []
+    for part in parts:
+        if max_chars <= 0:
+            break
+        kept.append(part[:max_chars])
+        max_chars -= len(part)
+    return tuple(kept)
+
+
+class EmailRecord:
+    """
+    A parsed email as held by the streaming watcher: sender, subject, ID, labels, receive time,
+    a body cut to max_body_chars and iCalendar parts cut to MAX_CALENDAR_CHARS, without a
+    per-instance __dict__.
+    """
+
+    __slots__ = ('id', 'sender', 'subject', 'body', 'labels', 'received_at', 'calendar')
+
+    def __init__(self, id, sender, subject, body, labels=(), received_at=None, calendar=None,
+                 max_body_chars=MAX_BODY_CHARS):
+        self.id = id
+        self.sender = sender
+        self.subject = subject
+        self.body = body[:max_body_chars]
+        self.labels = tuple(labels)
+        self.received_at = received_at
+        self.calendar = _bound_calendar(calendar, MAX_CALENDAR_CHARS) if calendar else None
+
+    @classmethod
+    def from_email(cls, email, max_body_chars=MAX_BODY_CHARS):
+        """Build a record from an email dictionary of mail_watcher.fetch_messages."""
+        return cls(max_body_chars=max_body_chars, **email)
+
+    def as_email(self):
+        """Return the email dictionary the processors take."""
+        email = {
+            "sender": self.sender,
+            "subject": self.subject,
+            "body": self.body,
+            "labels": list(self.labels),
+            "id": self.id,
+            "received_at": self.received_at
+        }
+        if self.calendar:
+            email["calendar"] = list(self.calendar)
+        return email
+
+    def __repr__(self):
+        return f"EmailRecord({self.id!r}, {self.subject!r})"
+
+
+def iter_records(service, message_ids, batch_size=DEFAULT_BATCH_SIZE, max_body_chars=MAX_BODY_CHARS,
+                 failures=None):
+    """Fetch the given messages and yield an EmailRecord for each one as soon as it is parsed."""
+    for email in iter_messages(service, message_ids, batch_size, failures):
+        yield EmailRecord.from_email(email, max_body_chars)
+
+
+def _process_record(processor, record, checkpoint):
+    email = record.as_email()
+    try:
+        outcome = processor(email)
+    except Exception as e:
+        print(f"Error processing email {record.id}: {e}")
+        outcome = f"error: {e}"
+    checkpoint.mark_done(record.id, outcome)
+
+
+def stream_messages(service, processor, message_ids, checkpoint, executor, workers,
+                    batch_size=DEFAULT_BATCH_SIZE, max_body_chars=MAX_BODY_CHARS):
+    """
+    Fetch the given messages and hand each one to processor as soon as it is parsed, with at most
+    workers emails in flight; fetching waits while they are all busy.
+
+    Messages that failed to load for a reason other than being deleted stay pending and are
+    retried on a later poll, see Checkpoint.retry_ids.
+    """
+    failures = {}
+    fetched_ids = []
+    in_flight = set()
+    for record in iter_records(service, message_ids, batch_size, max_body_chars, failures):
+        fetched_ids.append(record.id)
+        if len(in_flight) >= workers:
+            _, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+        in_flight.add(executor.submit(_process_record, processor, record, checkpoint))
+    wait(in_flight)
+    for message_id, reason in unfetchable(message_ids, fetched_ids, failures):
+        checkpoint.mark_done(message_id, reason)
+
+
+def stream_history(service, processor, start_history_id, checkpoint, executor, workers,
+                   batch_size=DEFAULT_BATCH_SIZE, max_body_chars=MAX_BODY_CHARS):
+    """
+    Consume the Gmail history since start_history_id page by page, streaming the messages of
+    each page before requesting the next one.
+
+    Each page's message IDs are recorded as pending before they are fetched, and the history ID
+    only after the last page, so an interrupted burst is picked up again on the next start.
+
+    Returns:
+        tuple: (new_history_id, count) where new_history_id is None if the API reported none,
+               and count is the number of messages streamed.
+    """
+    new_history_id = None
+    count = 0
+    pages = iter_history_pages(service, start_history_id)
+    while True:
+        # Only the history requests are timed, not the streaming of their messages
+        with metrics.timed('history_poll'):
+            page = next(pages, None)
+        if page is None:
+            break
+        page_ids, history_id = page
+        page_ids = checkpoint.record_history(history_id, page_ids)
+        stream_messages(service, processor, page_ids, checkpoint, executor, workers, batch_size, max_body_chars)
+        new_history_id = history_id or new_history_id
+        count += len(page_ids)
+    return new_history_id, count
+
+
+def watch_gmail_stream(processor=process_email, check_interval=10, batch_size=DEFAULT_BATCH_SIZE,
+                       workers=MAX_WORKERS, max_body_chars=MAX_BODY_CHARS):
+    """
+    Watch Gmail like mail_watcher.watch_gmail, but stream history changes instead of collecting them.
+
+    History pages are read lazily, messages are fetched one batch request at a time and each one
+    is handed to processor as soon as it is parsed. Only lightweight EmailRecords with a bounded
+    body and bounded iCalendar parts are held, at most one batch plus workers of them, so memory
+    stays flat however many messages a burst brings.
+
+    Args:
+        processor (function): Called with one email dictionary at a time, from a worker thread.
+                              Its return value is stored as the outcome in the checkpoint ledger.
+        check_interval (int): How often to poll the Gmail history (in seconds) while the inbox is idle,
+                              see AdaptivePollInterval.
+        batch_size (int): How many messages to fetch per Gmail batch request.
+        workers (int): How many emails are processed concurrently.
+        max_body_chars (int): Characters of each body kept.
+    """
+    service = get_service('gmail', 'v1')
+    poll_interval = AdaptivePollInterval(check_interval)
+    checkpoint = get_checkpoint()
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='email')
+
+    last_history_id = checkpoint.get_history_id()
+    if last_history_id is None:
+        last_history_id = get_initial_history_id(service)
+        checkpoint.record_history(last_history_id, [])
+        print(f"Gmail stream started. Using history ID: {last_history_id}")
+    else:
+        print(f"Gmail stream resumed from checkpointed history ID: {last_history_id}")
+
+    # Finish whatever the previous run had seen but not processed
+    pending_ids = checkpoint.pending_ids()
+    if pending_ids:
+        print(f"Resuming {len(pending_ids)} pending messages")
+        stream_messages(service, processor, pending_ids, checkpoint, executor, workers, batch_size, max_body_chars)
+
+    try:
+        while True:
+            try:
+                # Messages that failed to load on an earlier poll
+                retry_ids = checkpoint.retry_ids()
+                if retry_ids:
+                    print(f"Retrying {len(retry_ids)} pending messages")
+                    stream_messages(service, processor, retry_ids, checkpoint, executor, workers,
+                                    batch_size, max_body_chars)
+
+                new_history_id, count = stream_history(service, processor, last_history_id, checkpoint,
+                                                       executor, workers, batch_size, max_body_chars)
+                if new_history_id:
+                    last_history_id = new_history_id
+                time.sleep(poll_interval.next(bool(count)))
+
+            except HttpError as error:
+                if error.resp.status == 404:
+                    # History ID might be too old, get a new one
+                    print("History ID not found, getting new history ID...")
+                    checkpoint_time = checkpoint.get_checkpoint_time()
+                    last_history_id = get_latest_history_id(service) or last_history_id
+                    # Catch up on what arrived since the last checkpoint, skipping messages already handled
+                    missed_ids = list_message_ids_since(service, checkpoint_time) if checkpoint_time else []
+                    missed_ids = checkpoint.record_history(last_history_id, missed_ids)
+                    if missed_ids:
+                        print(f"Catching up on {len(missed_ids)} messages")
+                        stream_messages(service, processor, missed_ids, checkpoint, executor, workers,
+                                        batch_size, max_body_chars)
+                    time.sleep(poll_interval.next(bool(missed_ids)))
+                else:
+                    print(f"An error occurred: {error}")
+                    time.sleep(poll_interval.on_error(error))  # Wait before retrying
+            except Exception as e:
+                print(f"Unexpected error: {e}")
+                time.sleep(poll_interval.on_error(e))
+    finally:
+        executor.shutdown(wait=False)
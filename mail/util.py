@@ -1,7 +1,30 @@
 import base64
-import quopri
+import binascii
 import re
-from email.header import decode_header
+from email.header import decode_header, make_header
+from html.parser import HTMLParser
+
+# Upper bound on the characters of body text handed on to the agent
+MAX_BODY_CHARS = 20000
+# Nesting depth of forwarded (message/rfc822) parts that is still looked into
+MAX_DEPTH = 3
+# Upper bound on the characters decoded from each iCalendar part
+MAX_CALENDAR_CHARS = 1000000
+# HTML carries a lot of markup, so more of it is decoded before conversion to text
+HTML_DECODE_FACTOR = 4
+
+_FORWARD_MARKER_RE = re.compile(r'-+\s*Begin forwarded message\s*-+.*?(\n\s*\n)', re.DOTALL)
+_QUOTED_HEADER_RE = re.compile(r'(?m)^(>|\s)*(From|Sent|To|Subject|Date):.*$')
+_EXCESS_NEWLINES_RE = re.compile(r'\n{3,}')
+_HORIZONTAL_SPACE_RE = re.compile(r'[ \t\r\f\v]+')
+# A folded iCalendar line continues on the next line after a space or tab
+_ICS_FOLD_RE = re.compile(r'\r?\n[ \t]')
+_ICS_VEVENTS_RE = re.compile(r'BEGIN:VEVENT.*END:VEVENT', re.DOTALL)
+_CHARSET_RE = re.compile(r'charset="?([\w.:-]+)"?', re.IGNORECASE)
+
+_HTML_BLOCK_TAGS = {'br', 'p', 'div', 'tr', 'li', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'table', 'section'}
+_HTML_SKIP_TAGS = {'script', 'style', 'head', 'title'}
+
 
 def get_sender(headers):
     """Extract sender from email headers with better encoding handling."""
@@ -21,54 +44,181 @@ def get_sender(headers):
                 return sender
     return "Unknown sender"
 
-def get_simple_email_body(payload, depth=0):
-    """Extract plain text body from email payload with forwarded message support."""
-    MAX_DEPTH = 3  # Prevent infinite recursion
 
-    def decode_body(data):
-        try:
-            return base64.urlsafe_b64decode(data).decode('utf-8')
-        except:
+def get_subject(headers):
+    """Extract the decoded subject from email headers."""
+    for header in headers:
+        if header['name'].lower() == 'subject':
             try:
-                return quopri.decodestring(data).decode('utf-8', errors='replace')
-            except:
-                return data
-
-    def clean_forwarded_content(text):
-        """Remove common forwarding markers and headers."""
-        # Remove "Begin forwarded message" sections
-        text = re.sub(r'-+\s*Begin forwarded message\s*-+.*?(\n\s*\n)', '', text, flags=re.DOTALL)
-        # Remove quoted headers (From:, Date:, Subject:, etc.)
-        text = re.sub(r'(?m)^(>|\s)*(From|Sent|To|Subject|Date):.*$', '', text)
-        # Remove excessive newlines
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        return text.strip()
-
-    # Base case for recursion
-    if depth > MAX_DEPTH:
-        return "Max depth reached in forwarded message"
-
-    # Check for multipart payload
-    if 'parts' in payload:
-        for part in payload['parts']:
-            # Prefer text/plain but fallback to text/html if needed
-            if part['mimeType'] in ['text/plain', 'text/html']:
-                if 'body' in part and 'data' in part['body']:
-                    body = decode_body(part['body']['data'])
-                    if body.strip():
-                        return clean_forwarded_content(body)
-
-            # Handle nested forwarded messages (message/rfc822)
-            elif part['mimeType'] == 'message/rfc822':
-                if 'parts' in part:
-                    nested_body = get_simple_email_body(part, depth+1)
-                    if nested_body and nested_body != "No body content":
-                        return clean_forwarded_content(nested_body)
-
-    # Check direct body content
-    if 'body' in payload and 'data' in payload['body']:
-        body = decode_body(payload['body']['data'])
-        if body.strip():
-            return clean_forwarded_content(body)
-
-    return "No body content"
\ No newline at end of file
+                return str(make_header(decode_header(header['value'])))
+            except Exception:
+                return header['value']
+    return ""
+
+
+class _HTMLTextExtractor(HTMLParser):
+    """Collects the visible text of an HTML document, one line per block element."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _HTML_SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in _HTML_BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in _HTML_SKIP_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in _HTML_BLOCK_TAGS:
+            self.chunks.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self.chunks.append(data)
+
+
+def html_to_text(html):
+    """Convert HTML to compact plain text: no markup, scripts or styles, collapsed whitespace."""
+    parser = _HTMLTextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        pass
+    lines = (_HORIZONTAL_SPACE_RE.sub(' ', line).strip() for line in ''.join(parser.chunks).split('\n'))
+    return _EXCESS_NEWLINES_RE.sub('\n\n', '\n'.join(lines))
+
+
+def clean_forwarded_content(text):
+    """Remove common forwarding markers and headers."""
+    # Remove "Begin forwarded message" sections
+    text = _FORWARD_MARKER_RE.sub('', text)
+    # Remove quoted headers (From:, Date:, Subject:, etc.)
+    text = _QUOTED_HEADER_RE.sub('', text)
+    # Remove excessive newlines
+    text = _EXCESS_NEWLINES_RE.sub('\n\n', text)
+    return text.strip()
+
+
+def _get_charset(part):
+    for header in part.get('headers', []):
+        if header['name'].lower() == 'content-type':
+            match = _CHARSET_RE.search(header['value'])
+            if match:
+                return match.group(1)
+    return 'utf-8'
+
+
+def _decode_body(data, charset, max_chars):
+    """Decode at most enough base64url data to produce max_chars characters."""
+    # UTF-8 needs up to 4 bytes per character, every 4 base64 characters carry 3 bytes
+    data = data[:(max_chars * 4 + 2) // 3 * 4]
+    try:
+        raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    except (binascii.Error, ValueError):
+        return ''
+    try:
+        return raw.decode(charset, errors='replace')
+    except LookupError:
+        return raw.decode('utf-8', errors='replace')
+
+
+def _is_attachment(part):
+    return bool(part.get('filename'))
+
+
+def _read_part(part, max_chars, fetch_attachment):
+    body = part.get('body', {})
+    data = body.get('data')
+    if data is None and body.get('attachmentId') and fetch_attachment is not None:
+        data = fetch_attachment(body['attachmentId'])
+    if not data:
+        return ''
+    return _decode_body(data, _get_charset(part), max_chars)
+
+
+def get_simple_email_body(payload, max_chars=MAX_BODY_CHARS, fetch_attachment=None):
+    """
+    Extract the plain text body from an email payload with forwarded message support.
+
+    The MIME tree is walked once. Attachments are skipped without being decoded, text/plain is
+    preferred over text/html (which is converted to text), and at most max_chars characters are
+    decoded and returned.
+
+    Args:
+        payload (dict): The 'payload' of a Gmail message in format='full'.
+        max_chars (int): Upper bound on the length of the returned text.
+        fetch_attachment (function): Optional, called with an attachmentId to download a text part
+                                     Gmail left out of the payload because of its size.
+    """
+    html_part = None
+    stack = [(payload, 0)]
+
+    while stack:
+        part, depth = stack.pop()
+        mime_type = part.get('mimeType', '')
+
+        if 'parts' in part:
+            # message/rfc822 parts hold forwarded messages, don't go deeper than MAX_DEPTH of them
+            if mime_type == 'message/rfc822':
+                depth += 1
+                if depth > MAX_DEPTH:
+                    continue
+            # Reversed so the first part is looked at first
+            stack.extend((child, depth) for child in reversed(part['parts']))
+            continue
+
+        if _is_attachment(part):
+            continue
+
+        if mime_type == 'text/plain' or (mime_type == '' and part is payload):
+            text = _read_part(part, max_chars, fetch_attachment)
+            if text.strip():
+                return clean_forwarded_content(text)[:max_chars]
+        elif mime_type == 'text/html' and html_part is None:
+            html_part = part
+
+    # Only fall back to HTML when there is no plain text at all
+    if html_part is not None:
+        text = html_to_text(_read_part(html_part, max_chars * HTML_DECODE_FACTOR, fetch_attachment))
+        if text.strip():
+            return clean_forwarded_content(text)[:max_chars]
+
+    return "No body content"
+
+
+def get_calendar_parts(payload, fetch_attachment=None):
+    """
+    Return the decoded text of every iCalendar part of an email payload: text/calendar
+    parts and .ics attachments (downloaded through fetch_attachment when needed).
+
+    Invites often carry the same events twice, inline and as invite.ics; a part whose
+    events match those of an earlier part is left out.
+    """
+    calendars = []
+    seen = set()
+    stack = [payload]
+
+    while stack:
+        part = stack.pop()
+        if 'parts' in part:
+            stack.extend(reversed(part['parts']))
+            continue
+
+        mime_type = part.get('mimeType', '').lower()
+        filename = part.get('filename', '').lower()
+        if mime_type in ('text/calendar', 'application/ics') or filename.endswith('.ics'):
+            text = _read_part(part, MAX_CALENDAR_CHARS, fetch_attachment)
+            if 'BEGIN:VEVENT' in text:
+                # Compared on the events only, the copies may differ in METHOD or line endings
+                events = _ICS_VEVENTS_RE.search(_ICS_FOLD_RE.sub('', text).replace('\r\n', '\n'))
+                key = events.group(0) if events else text
+                if key not in seen:
+                    seen.add(key)
+                    calendars.append(text)
+
+    return calendars
@@ -1,8 +1,62 @@
+import argparse
+import asyncio
+from functools import partial
 
 from mail.mail_watcher import watch_gmail
 
-from mail.mail_callback import email_callback
+from mail.mail_callback import DEFAULT_MODE, MAX_WORKERS, MODES, email_callback, process_email
+from mail.pipeline import run_pipeline
+from mail.stream import watch_gmail_stream
+from mail.multi_account import run_accounts
+from accounts import load_accounts
+from cal.event_store import get_event_store
+import metrics
+from ratelimit import set_rate_share
 
 if __name__ == '__main__':
-    print("Starting mail watcher...")
-    watch_gmail(email_callback)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Watch Gmail and create calendar events from emails")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help="how many emails the agent processes concurrently (1 disables concurrency)")
+    parser.add_argument("--mode", choices=MODES, default=DEFAULT_MODE,
+                        help="'agent' runs the tool-calling agent, 'extract' makes one structured LLM call per email, "
+                             "'batch' extracts a burst of emails in as few LLM calls as the token budget allows")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="poll, fetch and process emails as separate concurrent stages")
+    parser.add_argument("--stream", action="store_true",
+                        help="stream history changes one message at a time, keeping memory flat during large bursts")
+    parser.add_argument("--accounts",
+                        help="directory (one subdirectory with a token.json per account) or JSON config "
+                             "of several accounts to watch from this process")
+    parser.add_argument("--shards", type=int, default=None,
+                        help="worker processes for --accounts, one per CPU by default")
+    parser.add_argument("--metrics-port", type=int, default=metrics.METRICS_PORT,
+                        help="local port serving Prometheus metrics at /metrics (0 disables it, "
+                             "a port already in use only skips it)")
+    parser.add_argument("--metrics-snapshot", default=metrics.SNAPSHOT_FILE,
+                        help="file the metrics are written to as JSON every minute (empty disables it)")
+    parser.add_argument("--rate-share", type=float, default=1.0,
+                        help="share of the API rate limits to use, e.g. 0.5 while a backfill takes the other half")
+    args = parser.parse_args()
+
+    if args.rate_share < 1:
+        set_rate_share(args.rate_share)
+
+    if args.metrics_port:
+        metrics.start_http_server(args.metrics_port)
+    if args.metrics_snapshot:
+        metrics.start_snapshots(args.metrics_snapshot)
+
+    if args.accounts:
+        print("Starting multi-account watcher...")
+        asyncio.run(run_accounts(load_accounts(args.accounts), shards=args.shards,
+                                 mode=args.mode, workers=args.workers, rate_share=args.rate_share))
+    else:
+        print("Starting calendar mirror...")
+        get_event_store().start_background_sync()
+        print("Starting mail watcher...")
+        if args.pipeline:
+            asyncio.run(run_pipeline(processor=partial(process_email, mode=args.mode), workers=args.workers))
+        elif args.stream:
+            watch_gmail_stream(processor=partial(process_email, mode=args.mode), workers=args.workers)
+        else:
+            watch_gmail(partial(email_callback, max_workers=args.workers, mode=args.mode))
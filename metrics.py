@@ -0,0 +1,220 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histograms keep this many recent observations for their percentiles
+WINDOW_SIZE = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+METRICS_PORT = 9464
+SNAPSHOT_FILE = "metrics.json"
+SNAPSHOT_INTERVAL = 60
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+_started = time.time()
+
+
+class Histogram:
+    """Count and sum of all observations, plus a sliding window of recent ones for percentiles."""
+
+    def __init__(self, window=WINDOW_SIZE):
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantiles(self):
+        values = sorted(self.recent)
+        if not values:
+            return {q: 0.0 for q in QUANTILES}
+        return {q: values[min(len(values) - 1, int(q * len(values)))] for q in QUANTILES}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Add value to the counter name{labels}."""
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def observe(name, value, **labels):
+    """Record one observation (e.g. a duration in seconds) of the histogram name{labels}."""
+    with _lock:
+        key = _key(name, labels)
+        if key not in _histograms:
+            _histograms[key] = Histogram()
+        _histograms[key].observe(value)
+
+
+def drain():
+    """
+    Take everything recorded so far and start over, for a worker process to hand its metrics
+    to the parent, which adds them to its own with merge().
+
+    Returns:
+        tuple: (counters, histograms) keyed like the internal tables, histograms as (count, sum, recent).
+    """
+    global _counters, _histograms
+    with _lock:
+        counters, histograms = _counters, _histograms
+        _counters, _histograms = defaultdict(float), {}
+    return dict(counters), {key: (h.count, h.sum, list(h.recent)) for key, h in histograms.items()}
+
+
+def merge(drained):
+    """Add metrics taken with drain() in another process to this one's."""
+    counters, histograms = drained
+    with _lock:
+        for key, value in counters.items():
+            _counters[key] += value
+        for key, (count, total, recent) in histograms.items():
+            if key not in _histograms:
+                _histograms[key] = Histogram()
+            histogram = _histograms[key]
+            histogram.count += count
+            histogram.sum += total
+            histogram.recent.extend(recent)
+
+
+@contextmanager
+def timed(stage, **labels):
+    """Time the block as stage: stage_seconds{stage} and stage_total{stage, status}."""
+    started = time.monotonic()
+    status = 'ok'
+    try:
+        yield
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        observe('stage_seconds', time.monotonic() - started, stage=stage, **labels)
+        inc('stage_total', stage=stage, status=status, **labels)
+
+
+def record_email_done(email, outcome):
+    """
+    Record the end-to-end latency of an email, from its arrival in Gmail (internalDate)
+    to the end of its processing, labelled by whether an event was created.
+    """
+    outcome = outcome or ''
+    # Outcomes of created events carry the event link, agent outputs included
+    result = 'event' if 'calendar/event' in outcome or outcome.startswith('created') else 'no_event'
+    inc('emails_processed_total', result=result)
+    received_at = email.get('received_at')
+    if received_at:
+        observe('email_end_to_end_seconds', max(0.0, time.time() - received_at), result=result)
+
+
+def _format_labels(labels, **extra):
+    labels = list(labels) + list(extra.items())
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{str(value)}"' for name, value in labels) + '}'
+
+
+def render_prometheus():
+    """Render every metric in the Prometheus text exposition format."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (h.count, h.sum, h.quantiles()) for key, h in _histograms.items()}
+
+    lines = []
+    typed = set()
+    for (name, labels), value in sorted(counters.items()):
+        if name not in typed:
+            lines.append(f'# TYPE {name} counter')
+            typed.add(name)
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+    for (name, labels), (count, total, quantiles) in sorted(histograms.items()):
+        if name not in typed:
+            lines.append(f'# TYPE {name} summary')
+            typed.add(name)
+        for q, value in quantiles.items():
+            lines.append(f'{name}{_format_labels(labels, quantile=q)} {value}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {total}')
+        lines.append(f'{name}_count{_format_labels(labels)} {count}')
+    lines.append(f'process_uptime_seconds {time.time() - _started}')
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot():
+    """Return every metric as a JSON-serialisable dictionary."""
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (h.count, h.sum, h.quantiles()) for key, h in _histograms.items()}
+
+    result = {'time': time.time(), 'uptime': time.time() - _started, 'counters': [], 'histograms': []}
+    for (name, labels), value in sorted(counters.items()):
+        result['counters'].append({'name': name, 'labels': dict(labels), 'value': value})
+    for (name, labels), (count, total, quantiles) in sorted(histograms.items()):
+        result['histograms'].append({
+            'name': name, 'labels': dict(labels), 'count': count, 'sum': total,
+            **{f'p{int(q * 100)}': value for q, value in quantiles.items()},
+        })
+    return result
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = render_prometheus(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(snapshot()), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        # Scrapes would flood the console
+        pass
+
+
+def start_http_server(port=METRICS_PORT, host='127.0.0.1'):
+    """
+    Serve /metrics (Prometheus text) and /metrics.json on a local port from a daemon thread.
+    Returns the server, None if the port is taken (e.g. by another watcher), which isn't fatal.
+    """
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        print(f"Warning: not serving metrics, can't listen on {host}:{port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    print(f"Metrics served at http://{host}:{port}/metrics")
+    return server
+
+
+def start_snapshots(path=SNAPSHOT_FILE, interval=SNAPSHOT_INTERVAL):
+    """Write snapshot() to path every interval seconds from a daemon thread."""
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                tmp_path = f'{path}.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(snapshot(), f, indent=2)
+                os.replace(tmp_path, path)
+            except Exception as e:
+                print(f"Error writing metrics snapshot: {e}")
+
+    thread = threading.Thread(target=loop, name='metrics-snapshots', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,242 @@
+import email.utils
+import os
+import random
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+import metrics
+from accounts import current_account
+
+# Requests per second and burst size for each API. Gmail allows 250 quota units per user per
+# second (messages.get costs 5), Calendar about 10 requests per second per user, and Gemini
+# Flash 15 requests per minute on the free tier. Each can be overridden with an environment
+# variable RATE_LIMIT_<API> set to "<requests per second>,<burst>", e.g. RATE_LIMIT_GEMINI=16,50
+# for a paid Gemini key with 1000 requests per minute.
+DEFAULT_RATE_LIMITS = {
+    'gmail': (25.0, 50),
+    'calendar': (8.0, 20),
+    'gemini': (0.25, 5),
+}
+
+
+def _limits_from_env(defaults):
+    limits = dict(defaults)
+    for api in defaults:
+        value = os.environ.get(f'RATE_LIMIT_{api.upper()}')
+        if not value:
+            continue
+        try:
+            rate, capacity = value.split(',')
+            limits[api] = (float(rate), max(1, int(capacity)))
+        except ValueError:
+            print(f"Warning: ignoring RATE_LIMIT_{api.upper()}={value!r}, expected '<requests per second>,<burst>'")
+    return limits
+
+
+RATE_LIMITS = _limits_from_env(DEFAULT_RATE_LIMITS)
+
+# Quotas of these APIs are per user, every account gets its own buckets for them
+PER_USER_APIS = {'gmail', 'calendar'}
+
+MAX_RETRIES = 6
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 64.0
+
+_RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+_RATE_LIMIT_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded'}
+
+
+class TokenBucket:
+    """Thread-safe token bucket: rate tokens per second, holding at most capacity."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available, then take them."""
+        tokens = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def _bucket(api):
+    key = (api, current_account().name if api in PER_USER_APIS else None)
+    with _buckets_lock:
+        if key not in _buckets:
+            _buckets[key] = TokenBucket(*RATE_LIMITS[api])
+        return _buckets[key]
+
+
+def set_rate_share(share):
+    """
+    Let this process use only share (0 to 1] of every API's rate limit, e.g. for a backfill
+    running next to the live watcher. Limits aren't coordinated between processes, so the
+    watcher has to be given the rest of the quota (main.py --rate-share). Each call scales
+    the current limits again.
+    """
+    with _buckets_lock:
+        for api, (rate, capacity) in RATE_LIMITS.items():
+            RATE_LIMITS[api] = (rate * share, max(1, int(capacity * share)))
+        _buckets.clear()
+
+
+def acquire(api, tokens=1):
+    """Wait for the rate limit of api, e.g. before a call that doesn't go through execute()."""
+    _bucket(api).acquire(tokens)
+
+
+def _status(error):
+    if isinstance(error, HttpError):
+        return error.resp.status
+    # google.api_core exceptions (Gemini) carry the HTTP status as code
+    code = getattr(error, 'code', None)
+    return code if isinstance(code, int) else None
+
+
+def is_retryable(error):
+    """True for rate limiting and transient server errors."""
+    status = _status(error)
+    if status in _RETRYABLE_STATUSES:
+        return True
+    if status == 403 and isinstance(error, HttpError):
+        reasons = {detail.get('reason') for detail in (error.error_details or []) if isinstance(detail, dict)}
+        return bool(reasons & _RATE_LIMIT_REASONS) or 'rateLimitExceeded' in str(error)
+    return type(error).__name__ in ('ResourceExhausted', 'ServiceUnavailable', 'TooManyRequests')
+
+
+def retry_after(error):
+    """Return the delay requested by a Retry-After header (in seconds), None if there is none."""
+    resp = getattr(error, 'resp', None)
+    value = resp.get('retry-after') if resp is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        return max(0.0, parsed.timestamp() - time.time()) if parsed else None
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter for the given (0-based) attempt."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def call(api, func, *args, tokens=1, max_retries=MAX_RETRIES, **kwargs):
+    """
+    Call func(*args, **kwargs) within the rate limit of api, retrying rate-limit and
+    transient errors with exponential backoff and jitter, honouring Retry-After.
+    """
+    attempt = 0
+    while True:
+        _bucket(api).acquire(tokens)
+        try:
+            with metrics.timed('api_request', api=api):
+                return func(*args, **kwargs)
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            metrics.inc('api_retries_total', api=api)
+            delay = retry_after(e)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            print(f"{api} call failed ({e.__class__.__name__}: {_status(e)}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+def execute(request, api, tokens=1):
+    """Execute a googleapiclient request (or batch) through the scheduler, see call()."""
+    return call(api, request.execute, tokens=tokens)
+
+
+def execute_batch(service, requests, api, batch_size=50, max_retries=MAX_RETRIES):
+    """
+    Execute (request_id, request) pairs through batch requests of batch_size, counting each
+    request against the rate limit and re-sending the ones that were rate limited.
+
+    Returns:
+        dict: (response, exception) per request_id.
+    """
+    results = {}
+    requests_by_id = dict(requests)
+    pending = [request_id for request_id, _ in requests]
+    attempt = 0
+
+    while pending:
+        rate_limited = []
+
+        def on_response(request_id, response, exception):
+            if exception is not None and attempt < max_retries and is_retryable(exception):
+                rate_limited.append(request_id)
+            else:
+                results[request_id] = (response, exception)
+
+        for i in range(0, len(pending), batch_size):
+            chunk = pending[i:i + batch_size]
+            batch = service.new_batch_http_request(callback=on_response)
+            for request_id in chunk:
+                batch.add(requests_by_id[request_id], request_id=request_id)
+            execute(batch, api, tokens=len(chunk))
+            metrics.inc('api_batched_requests_total', len(chunk), api=api)
+
+        if rate_limited:
+            delay = backoff_delay(attempt)
+            print(f"{len(rate_limited)} {api} batch calls were rate limited, retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+        pending = rate_limited
+
+    return results
+
+
+class AdaptivePollInterval:
+    """
+    Poll interval that tightens while mail is flowing and relaxes while the inbox is idle,
+    and backs off exponentially after errors.
+    """
+
+    def __init__(self, base=10, minimum=2, maximum=60, relax_factor=1.5):
+        self.base = base
+        self.minimum = min(minimum, base)
+        self.maximum = max(maximum, base)
+        self.relax_factor = relax_factor
+        self.current = base
+        self._errors = 0
+
+    def next(self, found_messages):
+        """Return how long to wait after a successful poll."""
+        self._errors = 0
+        if found_messages:
+            self.current = self.minimum
+        elif self.current < self.base:
+            self.current = self.base
+        else:
+            self.current = min(self.maximum, self.current * self.relax_factor)
+        return self.current
+
+    def on_error(self, error=None):
+        """Return how long to wait after a failed poll."""
+        delay = retry_after(error) if error is not None else None
+        if delay is None:
+            delay = min(BACKOFF_CAP * 4, self.base * 2 ** self._errors)
+        self._errors += 1
+        return delay
@@ -0,0 +1,66 @@
+from agent.budget import compact_body, estimate_tokens, split_quoted, strip_signature, truncate
+
+
+def test_split_quoted_cuts_at_attribution():
+    body = ("Works for me, see you there.\n\n"
+            "On Mon, Oct 5, 2026 at 10:00 AM Alice <alice@example.com>\nwrote:\n"
+            "> Lunch on Friday at 1pm?")
+    new, quoted = split_quoted(body)
+    assert new == "Works for me, see you there."
+    assert quoted.startswith("On Mon, Oct 5")
+    assert "> Lunch on Friday at 1pm?" in quoted
+
+
+def test_split_quoted_moves_quoted_lines():
+    new, quoted = split_quoted("> Can we move it?\nYes, 4pm works.\n> Thanks")
+    assert new == "Yes, 4pm works."
+    assert quoted == "> Can we move it?\n> Thanks"
+
+
+def test_split_quoted_keeps_fully_quoted_body():
+    new, quoted = split_quoted("> Offsite on 2026-11-02\n> Venue: Goa")
+    assert new == "Offsite on 2026-11-02\nVenue: Goa"
+    assert quoted == ''
+
+
+def test_strip_signature_removes_sign_off_block():
+    text = "Hi,\nThe review is moved to 3pm.\nSee you there.\nThanks,\nBob\nAcme Corp\nPhone: +91 98765 43210"
+    assert strip_signature(text) == "Hi,\nThe review is moved to 3pm.\nSee you there."
+
+
+def test_strip_signature_removes_delimiter_and_sent_from():
+    assert strip_signature("Dinner at 8?\nLet me know.\n-- \nBob") == "Dinner at 8?\nLet me know."
+    assert strip_signature("Dinner at 8?\nLet me know.\nSent from my iPhone") == "Dinner at 8?\nLet me know."
+
+
+def test_strip_signature_keeps_content_after_early_sign_off():
+    text = "Hi team,\nThanks\nThe offsite is confirmed. Venue: Taj Exotica, Goa.\nPlease book flights via travel desk."
+    assert strip_signature(text) == text
+
+
+def test_strip_signature_keeps_details_after_sign_off():
+    assert strip_signature("Hey,\nBest\nJoining details: Room 4B") == "Hey,\nBest\nJoining details: Room 4B"
+    assert "Room 4B" in compact_body("Hey,\nBest\nJoining details: Room 4B\n")
+
+
+def test_strip_signature_keeps_dates_after_sign_off():
+    text = "Hi,\nSee the invite below.\nThanks\nStandup 10am"
+    assert strip_signature(text) == text
+
+
+def test_truncate_keeps_dates_first_in_original_order():
+    text = "\n".join(["intro " * 20, "Meeting on 2026-10-20 at 3pm", "filler " * 20, "Venue: Room 4B"])
+    result = truncate(text, 20)
+    assert result.splitlines() == ["[...]", "Meeting on 2026-10-20 at 3pm", "[...]", "Venue: Room 4B"]
+
+
+def test_truncate_stays_within_budget():
+    text = "\n".join(f"line {i} " * 10 for i in range(100))
+    result = truncate(text, 100)
+    kept = [line for line in result.splitlines() if line != '[...]']
+    assert sum(estimate_tokens(line) for line in kept) <= 100
+
+
+def test_truncate_splits_long_lines_into_sentences():
+    text = "Some context here. " * 30 + "The call is on Friday."
+    assert "The call is on Friday." in truncate(text, 10)
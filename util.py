@@ -1,3 +1,10 @@
+import datetime
+import re
+
+# Events are created and looked up in Indian Standard Time
+IST = datetime.timezone(datetime.timedelta(hours=5, minutes=30))
+
+
 def parse_date_string(date_str: str) -> tuple:
     """Parse the date string with before/after parameters."""
     days_before = 2
@@ -18,4 +25,105 @@ def parse_date_string(date_str: str) -> tuple:
             except (IndexError, ValueError):
                 print(f"Warning: Invalid after value in {part}, using default {days_after}")
 
-    return date_part, days_before, days_after
\ No newline at end of file
+    return date_part, days_before, days_after
+
+
+def get_date_range(date, days_before, days_after):
+    """
+    Return the (start, end) datetimes covering days_before days before and days_after days
+    after date (YYYY-MM-DD), from midnight IST with an exclusive end. Raises ValueError on a bad date.
+    """
+    central_date = datetime.datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=IST)
+
+    start_date = (central_date - datetime.timedelta(days=days_before)).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    end_date = (central_date + datetime.timedelta(days=days_after + 1)).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+    return start_date, end_date
+
+
+_MONTHS = {
+    'jan': 1, 'feb': 2, 'mar': 3, 'apr': 4, 'may': 5, 'jun': 6,
+    'jul': 7, 'aug': 8, 'sep': 9, 'oct': 10, 'nov': 11, 'dec': 12
+}
+_MONTH_PATTERN = (r'(jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?'
+                  r'|sep(?:t(?:ember)?)?|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?)')
+
+_ISO_DATE_RE = re.compile(r'\b(\d{4})-(\d{1,2})-(\d{1,2})\b')
+# Numeric dates are read day first, as they are written in India
+_NUMERIC_DATE_RE = re.compile(r'\b(\d{1,2})[/.-](\d{1,2})[/.-](\d{4}|\d{2})\b')
+_DAY_MONTH_RE = re.compile(
+    r'\b(\d{1,2})(?:st|nd|rd|th)?\s+(?:of\s+)?' + _MONTH_PATTERN + r'\b\.?,?(?:\s+(\d{4}))?', re.IGNORECASE)
+_MONTH_DAY_RE = re.compile(
+    _MONTH_PATTERN + r'\b\.?\s+(\d{1,2})(?:st|nd|rd|th)?\b,?(?:\s+(\d{4}))?', re.IGNORECASE)
+_RELATIVE_DAY_RE = re.compile(r'\b(today|tonight|tomorrow)\b', re.IGNORECASE)
+_WEEKDAY_RE = re.compile(r'\b(monday|tuesday|wednesday|thursday|friday|saturday|sunday)\b', re.IGNORECASE)
+_VAGUE_DATE_RE = re.compile(r'\b(next week|this week|weekend|day after)\b', re.IGNORECASE)
+_TIME_RE = re.compile(r'\b\d{1,2}(?::\d{2})?\s*(?:a\.?m\.?|p\.?m\.?)(?!\w)|\b(?:[01]?\d|2[0-3]):[0-5]\d\b', re.IGNORECASE)
+
+
+def _make_date(year, month, day, reference):
+    if year is None:
+        year = reference.year
+        try:
+            candidate = datetime.date(year, month, day)
+        except ValueError:
+            return None
+        # A date without a year that is long past most likely means next year
+        if (reference - candidate).days > 180:
+            year += 1
+    elif year < 100:
+        year += 2000
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+
+def email_date(email):
+    """
+    Return the day (IST) an email was received, the day its relative dates ("tomorrow") refer to.
+    Falls back to today for emails without a receive time.
+    """
+    received_at = email.get('received_at')
+    if received_at:
+        return datetime.datetime.fromtimestamp(received_at, IST).date()
+    return datetime.datetime.now(IST).date()
+
+
+def extract_dates(text, reference=None):
+    """
+    Find the calendar days mentioned in free text, resolving relative ones against reference
+    (a date, default today).
+
+    Returns:
+        tuple: (days, vague) where days is a set of YYYY-MM-DD strings and vague is True if the
+               text also refers to days that can't be resolved without context ("next week", ...).
+               Weekday names only make it vague when no date was found, they mostly come with
+               one ("Thursday, 12 June").
+    """
+    reference = reference or datetime.datetime.now(IST).date()
+    dates = set()
+
+    for year, month, day in _ISO_DATE_RE.findall(text):
+        dates.add(_make_date(int(year), int(month), int(day), reference))
+    for day, month, year in _NUMERIC_DATE_RE.findall(text):
+        dates.add(_make_date(int(year), int(month), int(day), reference))
+    for day, month, year in _DAY_MONTH_RE.findall(text):
+        dates.add(_make_date(int(year) if year else None, _MONTHS[month[:3].lower()], int(day), reference))
+    for month, day, year in _MONTH_DAY_RE.findall(text):
+        dates.add(_make_date(int(year) if year else None, _MONTHS[month[:3].lower()], int(day), reference))
+    for word in _RELATIVE_DAY_RE.findall(text):
+        offset = 1 if word.lower() == 'tomorrow' else 0
+        dates.add(reference + datetime.timedelta(days=offset))
+
+    dates.discard(None)
+    vague = bool(_VAGUE_DATE_RE.search(text)) or (not dates and bool(_WEEKDAY_RE.search(text)))
+    return {date.isoformat() for date in dates}, vague
+
+
+def mentions_date_or_time(text):
+    """True if text mentions a date, a weekday or a time of day, resolvable or not."""
+    return any(pattern.search(text) for pattern in (
+        _ISO_DATE_RE, _NUMERIC_DATE_RE, _DAY_MONTH_RE, _MONTH_DAY_RE, _RELATIVE_DAY_RE, _WEEKDAY_RE,
+        _VAGUE_DATE_RE, _TIME_RE))